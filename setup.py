@@ -16,6 +16,9 @@ setuptools.setup(
     url='https://github.com/nod/databag',
     packages=['databag', 'databag.orm'],
     package_dir={'':'src'},
+    entry_points={
+        'console_scripts': ['databag=databag.cli:main'],
+        },
     classifiers=[
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
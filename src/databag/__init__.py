@@ -1,3 +1,9 @@
 
 from .main import DataBag, DictBag, Q
+from .cache import CacheBag
+from .database import Database
+from .mirror import MirrorBag
 
+from .frozen import FrozenBag
+from .metrics import Metrics
+from .shard import ShardedDataBag, ShardedDictBag, reshard
@@ -0,0 +1,5 @@
+
+from .cli import main
+
+
+main()
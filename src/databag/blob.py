@@ -0,0 +1,118 @@
+
+import io
+from bz2 import BZ2Compressor, BZ2Decompressor
+
+
+class BlobWriter(io.RawIOBase):
+    """
+    file like object from `DataBag.open_writer(key)`.  bytes written get bz2
+    compressed as they come in and stored in chunks of `chunk_size`, so
+    memory use is about one chunk plus bz2's block (100k * compresslevel) no
+    matter how much goes through.
+
+    nothing is visible to readers until `close()`, which stores the value
+    and commits.  leaving a `with` block on an exception throws it all away.
+    """
+
+    def __init__(self, bag, keyf, blob_id, chunk_size, compresslevel):
+        self._bag = bag
+        self._keyf = keyf
+        self._blob = blob_id
+        self._chunk_size = chunk_size
+        self._comp = BZ2Compressor(compresslevel)
+        self._buf = bytearray()
+        self._n = 0
+        self._size = 0
+        # everything the writer does lands in one transaction on the bag
+        bag._txn += 1
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.closed: raise ValueError('write to closed blob')
+        self._size += len(b)
+        self._buf += self._comp.compress(b)
+        while len(self._buf) >= self._chunk_size:
+            self._put(self._buf[:self._chunk_size])
+            del self._buf[:self._chunk_size]
+        return len(b)
+
+    def _put(self, chunk):
+        self._bag._db.execute(
+            '''insert into {tbl}_chunks (blob, n, data)
+                values (?, ?, ?)'''.format(tbl=self._bag._table),
+            (self._blob, self._n, bytes(chunk))
+            )
+        self._n += 1
+
+    def close(self):
+        if self.closed: return
+        try:
+            self._buf += self._comp.flush()
+            if self._buf: self._put(self._buf)
+            self._bag._store_blob(self._keyf, self._blob)
+        except BaseException:
+            self.abort()
+            raise
+        super(BlobWriter, self).close()
+        self._bag._txn -= 1
+        self._bag._commit()
+
+    def abort(self):
+        """ throws away everything written so far """
+        if self.closed: return
+        super(BlobWriter, self).close()
+        self._bag._txn -= 1
+        if not self._bag._txn: self._bag._db.rollback()
+
+    def __exit__(self, exc_type, *a):
+        if exc_type is None: self.close()
+        else: self.abort()
+
+    @property
+    def size(self):
+        """ uncompressed bytes written so far """
+        return self._size
+
+
+class BlobReader(io.RawIOBase):
+    """
+    raw stream over a chunked value, fetching and decompressing one chunk at
+    a time.  `DataBag.open_reader(key)` hands these out wrapped in an
+    io.BufferedReader.
+    """
+
+    def __init__(self, bag, blob_id):
+        self._bag = bag
+        self._blob = blob_id
+        self._n = 0
+        self._decomp = BZ2Decompressor()
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        cur = self._bag._db.cursor()
+        cur.execute(
+            '''select data from {tbl}_chunks
+                where blob=? and n=?'''.format(tbl=self._bag._table),
+            (self._blob, self._n)
+            )
+        r = cur.fetchone()
+        if r is None: return None
+        self._n += 1
+        return r['data']
+
+    def readinto(self, b):
+        while not self._decomp.eof:
+            data = b''
+            if self._decomp.needs_input:
+                data = self._next_chunk()
+                if data is None:
+                    raise EOFError('blob ended before the compressed stream')
+            out = self._decomp.decompress(data, len(b))
+            if out:
+                b[:len(out)] = out
+                return len(out)
+        return 0
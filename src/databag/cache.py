@@ -0,0 +1,212 @@
+
+from time import time
+
+from .main import CHUNKED, DataBag
+
+
+class CacheBag(DataBag):
+    """
+    a size bounded bag, handy as a disk backed cache in front of something
+    slow.  once the bag holds more than `max_items` keys or more than
+    `max_bytes` of stored payload, the least recently used (`policy='lru'`) or
+    least frequently used (`policy='lfu'`) keys get evicted on insert.
+
+    ```python
+    cache = CacheBag('cache', '/tmp/cache.sqlite3', max_items=10000)
+    cache['blah'] = 'blip'
+    cache.cache_info()
+    ```
+
+    reads don't write.  access times and hit counts are kept in memory and
+    flushed to the eviction index every `flush_every` reads, before any
+    eviction pass, or when `flush()` is called.
+    """
+
+    policies = ('lru', 'lfu')
+
+    SQL = {
+        'access_touch': '''update {tbl}_access
+            set atime=max(atime, ?), hits=hits+? where keyf=?''',
+        'access_get': '''select hits, size from {tbl}_access where keyf=?''',
+        'access_put': '''insert or replace into {tbl}_access
+            (keyf, atime, hits, size) values (?, ?, ?, ?)''',
+        'access_drop': '''delete from {tbl}_access where keyf=?''',
+        'blob_size': '''select total(length(data)) from {tbl}_chunks
+            where blob=?''',
+        'victims_lru': '''select keyf, size from {tbl}_access where keyf != ?
+            order by atime limit 32''',
+        'victims_lfu': '''select keyf, size from {tbl}_access where keyf != ?
+            order by hits, atime limit 32''',
+        }
+
+    def __init__(self, table=None, fpath=None, max_items=None, max_bytes=None,
+            policy='lru', flush_every=100, metrics=None, changelog=False,
+            changelog_retain=None, zdict=False, datetimes='iso',
+            cached_statements=128, database=None):
+        if policy not in self.policies:
+            raise ValueError('policy must be one of ' + str(self.policies))
+        if max_items is None and max_bytes is None:
+            raise ValueError('need at least one of max_items or max_bytes')
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._flush_every = flush_every
+        self._touched = {}
+        self.hits = self.misses = self.evictions = 0
+        super(CacheBag, self).__init__(
+            table=table, fpath=fpath, metrics=metrics,
+            changelog=changelog, changelog_retain=changelog_retain,
+            zdict=zdict, datetimes=datetimes,
+            cached_statements=cached_statements, database=database
+            )
+        self._count, self._bytes = self._totals()
+
+    def _access_table(self):
+        return '{}_access'.format(self._table)
+
+    def _own_names(self):
+        return super(CacheBag, self)._own_names() + [self._access_table()]
+
+    def _ensure_table(self):
+        super(CacheBag, self)._ensure_table()
+        cur = self._db.cursor()
+        cur.execute(
+            '''create table if not exists {a} (
+                keyf text primary key, atime real, hits int, size int
+                )'''.format(a=self._access_table())
+            )
+        # the eviction index, one per policy so either one can be used later
+        cur.execute(
+            '''create index if not exists
+                i_{a}_lru on {a} (atime)'''.format(a=self._access_table())
+            )
+        cur.execute(
+            '''create index if not exists
+                i_{a}_lfu on {a} (hits, atime)'''.format(a=self._access_table())
+            )
+        self._commit()
+
+    def _totals(self):
+        cur = self._db.cursor()
+        cur.execute(
+            '''select count(1), total(size) from {a}'''.format(
+                a=self._access_table()
+            ) )
+        count, size = cur.fetchone()
+        return count, int(size)
+
+    def _restored(self):
+        super(CacheBag, self)._restored()
+        # batched access times were for the old contents
+        self._touched = {}
+        self._count, self._bytes = self._totals()
+
+    def _get(self, keyf, version):
+        try:
+            val = super(CacheBag, self)._get(keyf, version)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        _, hits = self._touched.get(keyf, (0, 0))
+        self._touched[keyf] = (time(), hits + 1)
+        if len(self._touched) >= self._flush_every:
+            self.flush()
+        return val
+
+    def _get_many(self, keys, batch):
+        keys = list(keys)
+        found = super(CacheBag, self)._get_many(keys, batch)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        now = time()
+        for k in found:
+            _, hits = self._touched.get(k, (0, 0))
+            self._touched[k] = (now, hits + 1)
+        if len(self._touched) >= self._flush_every:
+            self.flush()
+        return found
+
+    def flush(self):
+        """ writes batched access times and hit counts to the eviction index """
+        if not self._touched: return
+        self._flush_access(self._db.cursor())
+        self._commit()
+
+    def _flush_access(self, cur):
+        cur.executemany(
+            self._sql['access_touch'],
+            ( (atime, hits, k) for k,(atime, hits) in self._touched.items() )
+            )
+        self._touched = {}
+
+    def _write(self, cur, keyf, value, to_json, codec):
+        super(CacheBag, self)._write(cur, keyf, value, to_json, codec)
+        if codec == CHUNKED:
+            # value is just the blob id, the bytes are in its chunks
+            cur.execute(self._sql['blob_size'], (value,))
+            size = int(cur.fetchone()[0])
+        else:
+            size = len(value)
+        cur.execute(self._sql['access_get'], (keyf,))
+        old = cur.fetchone()
+        if old is None:
+            hits = 1
+            self._count += 1
+        else:
+            hits = old['hits'] + 1
+            self._bytes -= old['size']
+        self._bytes += size
+        cur.execute(self._sql['access_put'], (keyf, time(), hits, size))
+        self._evict(cur, keyf)
+
+    def _over(self):
+        return (
+            (self._max_items is not None and self._count > self._max_items)
+            or (self._max_bytes is not None and self._bytes > self._max_bytes)
+            )
+
+    def _evict(self, cur, keep):
+        """ evicts keys until the bag is back under its limits """
+        if not self._over(): return
+        # other processes may share the file, so resync before whacking things
+        self._flush_access(cur)
+        self._count, self._bytes = self._totals()
+        victims_sql = self._sql['victims_' + self._policy]
+        while self._over():
+            cur.execute(victims_sql, (keep,))
+            victims = cur.fetchall()
+            if not victims: break
+            for v in victims:
+                self._remove(cur, v['keyf'], v['size'])
+                self.evictions += 1
+                if not self._over(): break
+
+    def _remove(self, cur, keyf, size):
+        cur.execute(self._sql['delete'], (keyf,))
+        cur.execute(self._sql['access_drop'], (keyf,))
+        self._log_change(cur, 'del', keyf)
+        self._touched.pop(keyf, None)
+        self._count -= 1
+        self._bytes -= size
+
+    def _del(self, keyf):
+        cur = self._db.cursor()
+        cur.execute(self._sql['access_get'], (keyf,))
+        row = cur.fetchone()
+        if row is None: raise KeyError
+        self._remove(cur, keyf, row['size'])
+        self._commit()
+
+    def cache_info(self):
+        """
+        returns a dict of the hit, miss and eviction counters along with the
+        current item count and stored payload size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'items': self._count,
+            'bytes': self._bytes,
+            }
@@ -0,0 +1,158 @@
+
+"""
+command line access to a bag, mostly for moving data in and out in bulk.
+
+    python -m databag import /tmp/bag.db people people.jsonl
+    python -m databag export --format csv /tmp/bag.db people people.csv
+    python -m databag reshard people --from s0.db s1.db --to n0.db n1.db n2.db
+
+imports and exports can be picked back up with `--resume` after being
+interrupted.  progress is kept next to the dump file in `<file>.progress`.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from .main import DataBag, DictBag
+from .shard import reshard
+
+
+FORMATS = ('jsonl', 'csv')
+
+
+def _bag(args):
+    if args.dict or args.index:
+        indexes = [ tuple(i.split(',')) for i in args.index or () ]
+        return DictBag(args.table, args.dbpath, indexes=indexes)
+    return DataBag(args.table, args.dbpath)
+
+
+def _say(args, msg):
+    if not args.quiet:
+        print(msg, file=sys.stderr)
+
+
+def _progress_path(args):
+    return args.file + '.progress'
+
+
+def _read_progress(args):
+    if not args.resume or not os.path.exists(_progress_path(args)):
+        return None
+    with open(_progress_path(args)) as fp:
+        return json.load(fp)
+
+
+def _write_progress(args, state):
+    if args.file == '-': return
+    tmp = _progress_path(args) + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(state, fp)
+    os.replace(tmp, _progress_path(args))
+
+
+def _done(args):
+    if os.path.exists(_progress_path(args)):
+        os.remove(_progress_path(args))
+
+
+def do_import(args):
+    bag = _bag(args)
+    skip = _read_progress(args) or 0
+    if skip: _say(args, 'resuming after line {}'.format(skip))
+
+    def progress(n):
+        _write_progress(args, n)
+        _say(args, '{} lines'.format(n))
+
+    fp = sys.stdin if args.file == '-' else open(args.file, newline='')
+    with fp:
+        load = bag.import_csv if args.format == 'csv' else bag.import_jsonl
+        n = load(fp, batch=args.batch, progress=progress, skip=skip)
+    _done(args)
+    _say(args, 'imported {} lines'.format(n))
+
+
+def do_export(args):
+    bag = _bag(args)
+    state = _read_progress(args)
+    after, total, offset = None, 0, None
+    if state:
+        # progress from before offsets were kept has just key and count
+        after, total = state[:2]
+        if len(state) > 2: offset = state[2]
+    if after is not None: _say(args, 'resuming after key {}'.format(after))
+
+    def progress(n, key):
+        if args.file != '-':
+            # what's recorded has to be on disk, and nothing past it counted
+            fp.flush()
+            os.fsync(fp.fileno())
+            _write_progress(args, (key, total + n, fp.tell()))
+        _say(args, '{} rows'.format(total + n))
+
+    if args.file == '-': fp = sys.stdout
+    else: fp = open(args.file, 'a' if after is not None else 'w', newline='')
+    # rows written after the last saved progress get written again
+    if offset is not None: fp.truncate(offset)
+    with fp:
+        dump = bag.export_csv if args.format == 'csv' else bag.export_jsonl
+        n = dump(fp, batch=args.batch, progress=progress, after=after)
+    _done(args)
+    _say(args, 'exported {} rows'.format(total + n))
+
+
+def do_reshard(args):
+    indexes = [ tuple(i.split(',')) for i in args.index ] if args.index else None
+    n = reshard(args.table, args.src, args.dest, indexes=indexes)
+    _say(args, 'moved {} rows onto {} shards'.format(n, len(args.dest)))
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='databag', description='put your data in a bag'
+        )
+    cmds = p.add_subparsers(dest='cmd')
+    cmds.required = True
+    for name, fn, help_ in (
+            ('import', do_import, 'load a dump into a bag'),
+            ('export', do_export, 'dump a bag to a file'),
+            ):
+        c = cmds.add_parser(name, help=help_)
+        c.set_defaults(fn=fn)
+        c.add_argument('dbpath', help='sqlite file holding the bag')
+        c.add_argument('table', help='name of the bag')
+        c.add_argument('file', help="dump file, or - for stdin/stdout")
+        c.add_argument('--format', choices=FORMATS, default='jsonl')
+        c.add_argument('--dict', action='store_true', help='use a DictBag')
+        c.add_argument(
+            '--index', action='append', metavar='FIELD[,FIELD]',
+            help='index to keep on a DictBag, can be repeated'
+            )
+        c.add_argument('--batch', type=int, default=1000,
+            help='rows per commit')
+        c.add_argument('--resume', action='store_true',
+            help='pick up where an interrupted run left off')
+        c.add_argument('--quiet', action='store_true')
+
+    c = cmds.add_parser('reshard',
+        help='copy a sharded bag onto a different set of shard files')
+    c.set_defaults(fn=do_reshard)
+    c.add_argument('table', help='name of the bag')
+    c.add_argument('--from', dest='src', nargs='+', required=True,
+        metavar='DBPATH', help='current shard files, in order')
+    c.add_argument('--to', dest='dest', nargs='+', required=True,
+        metavar='DBPATH', help='new shard files, in order')
+    c.add_argument(
+        '--index', action='append', metavar='FIELD[,FIELD]',
+        help='index to build on the new shards, can be repeated'
+        )
+    c.add_argument('--quiet', action='store_true')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.fn(args)
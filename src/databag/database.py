@@ -0,0 +1,86 @@
+
+import sqlite3
+from contextlib import contextmanager
+
+from .main import DataBag
+
+
+class Database(object):
+    """
+    one sqlite connection shared by any number of bags in the same file.
+
+    ```python
+    db = Database('/tmp/app.db', cache_size=64 * 1024,
+        pragmas={'journal_mode': 'wal', 'synchronous': 'normal'})
+    people = db.bag('people', DictBag, indexes=[('name',)])
+    events = db.bag('events')
+    with db.transaction():
+        people['joe'] = {'name': 'joe'}
+        events.add({'joined': 'joe'})
+    ```
+
+    bags opened this way share one page cache (`cache_size`, in KiB) and
+    one transaction depth, so a `transaction()` on the database or on any of
+    its bags covers writes to all of them.  asking for the same table twice
+    hands back the same bag, and each table's schema is only checked the
+    first time it's opened.
+    """
+
+    def __init__(self, fpath=None, cache_size=None, pragmas=None,
+            cached_statements=256):
+        self.fpath = fpath or ':memory:'
+        self._db = sqlite3.connect(
+            self.fpath, detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=cached_statements
+            )
+        self._db.row_factory = sqlite3.Row
+        # only takes on a brand new file, see DataBag.compact()
+        self._db.execute('pragma auto_vacuum = incremental')
+        if cache_size is not None:
+            self._db.execute('pragma cache_size = {:d}'.format(-cache_size))
+        for k, v in (pragmas or {}).items():
+            self._db.execute('pragma {} = {}'.format(k, v))
+        self._txn = 0
+        self._bags = {}
+        self._ensured = set()
+
+    def bag(self, table, cls=DataBag, **ka):
+        """
+        the bag called `table`, opened as a `cls` (DataBag, DictBag,
+        CacheBag...) with keyword arguments `ka` the first time it's asked
+        for.  later calls return that same bag.
+        """
+        bag = self._bags.get(table)
+        if bag is None:
+            bag = self._bags[table] = cls(table, database=self, **ka)
+        elif type(bag) is not cls:
+            raise ValueError(
+                '{} is already open as a {}'.format(table, type(bag).__name__)
+                )
+        return bag
+
+    def _first_time(self, what):
+        """ True the first time `what` is asked about on this connection """
+        if what in self._ensured: return False
+        self._ensured.add(what)
+        return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        groups every write to any bag on this database into one commit.
+        nests with the bags' own transaction() blocks.
+        """
+        self._txn += 1
+        try:
+            yield self
+        except BaseException:
+            self._txn -= 1
+            if not self._txn: self._db.rollback()
+            raise
+        self._txn -= 1
+        if not self._txn: self._db.commit()
+
+    def close(self):
+        self._db.close()
+        self._bags = {}
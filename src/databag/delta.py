@@ -0,0 +1,74 @@
+
+import struct
+import zlib
+
+
+# a delta rebuilds `target` out of `base` as a run of ops, the whole thing
+# zlib'd on the way out:
+#   b'c' offset length    copy bytes from the base
+#   b'i' length bytes     insert new bytes
+OP = struct.Struct('<cII')
+INSERT = struct.Struct('<cI')
+
+# matches shorter than a block aren't found, and aren't worth an op anyway
+BLOCK = 16
+
+
+def diff(base, target):
+    """
+    encodes bytes `target` as a delta against bytes `base`.  the base is
+    indexed by fixed blocks and the target is scanned for them a byte at a
+    time, growing each hit both ways.  linear in both sizes, and for a big
+    document with small edits the delta is roughly the size of the edits.
+    """
+    blocks = {}
+    for i in range(0, len(base) - BLOCK + 1, BLOCK):
+        blocks.setdefault(base[i:i+BLOCK], i)
+
+    out = []
+    pending = 0 # start of target bytes not yet covered by an op
+    i = 0
+    end = len(target) - BLOCK + 1
+    while i < end:
+        at = blocks.get(target[i:i+BLOCK])
+        if at is None:
+            i += 1
+            continue
+        # grow the match backwards over the pending insert, then forwards
+        start, bstart = i, at
+        while start > pending and bstart > 0 and \
+                target[start-1] == base[bstart-1]:
+            start -= 1
+            bstart -= 1
+        stop, bstop = i + BLOCK, at + BLOCK
+        while stop < len(target) and bstop < len(base) and \
+                target[stop] == base[bstop]:
+            stop += 1
+            bstop += 1
+        if start > pending:
+            out.append(INSERT.pack(b'i', start - pending))
+            out.append(target[pending:start])
+        out.append(OP.pack(b'c', bstart, stop - start))
+        pending = i = stop
+    if pending < len(target):
+        out.append(INSERT.pack(b'i', len(target) - pending))
+        out.append(target[pending:])
+    return zlib.compress(b''.join(out))
+
+
+def patch(base, delta):
+    """ rebuilds the target bytes `delta` was made from, given its `base` """
+    ops = zlib.decompress(delta)
+    out = []
+    pos = 0
+    while pos < len(ops):
+        if ops[pos:pos+1] == b'c':
+            _, off, n = OP.unpack_from(ops, pos)
+            out.append(base[off:off+n])
+            pos += OP.size
+        else:
+            _, n = INSERT.unpack_from(ops, pos)
+            pos += INSERT.size
+            out.append(ops[pos:pos+n])
+            pos += n
+    return b''.join(out)
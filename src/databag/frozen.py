@@ -0,0 +1,223 @@
+
+import json
+import mmap
+import os
+import struct
+from bz2 import decompress
+
+from .main import BZ2, CHUNKED, ZDICT
+
+
+# file layout, all little endian:
+#   header   magic, key count, offset of the key region, offset of values
+#   index    one fixed width entry per key, sorted by key bytes
+#   keys     utf-8 keys back to back
+#   values   stored payloads back to back, exactly as they sit in sqlite.
+#            chunked values are written as their chunks end to end, which
+#            makes one bz2 stream.  zdict values are unpacked to plain text
+#            so the snapshot doesn't need the bag's dictionaries.
+MAGIC = b'DBAGFRZ1'
+HEADER = struct.Struct('<8sIQQ')
+ENTRY = struct.Struct('<QIQIB') # key off, key len, val off, val len, flags
+
+F_JSON = 1
+F_BZ2 = 2
+F_BYTES = 4
+
+
+def write_snapshot(bag, fpath):
+    """
+    writes the live rows of `bag` to an immutable snapshot at `fpath`.
+    rows are streamed twice (sizes, then payloads) so memory stays flat no
+    matter how big the bag is.  the file is written next to `fpath` and
+    renamed into place once complete.
+    """
+    db = bag._db
+    cur = db.cursor()
+    # both passes have to see the same rows, so hold a read transaction open
+    # across them unless the caller already has one going
+    began = not db.in_transaction
+    if began: cur.execute('begin')
+    try:
+        _write_snapshot(bag, cur, fpath)
+    finally:
+        if began: db.rollback()
+
+
+def _write_snapshot(bag, cur, fpath):
+    table = bag._table
+    cur.execute(
+        '''select count(1) from {tbl} where ver=0'''.format(tbl=table)
+        )
+    count = cur.fetchone()[0]
+    keys_off = HEADER.size + ENTRY.size * count
+
+    tmp = fpath + '.tmp'
+    with open(tmp, 'wb') as fp:
+        # first pass, the index and the keys
+        cur.execute(
+            '''select keyf, bz2, case when bz2 = {c} then (
+                    select total(length(c.data)) from {tbl}_chunks as c
+                    where c.blob = t.data
+                    ) else length(cast(data as blob)) end as sz,
+                case when bz2 = {z} then data end as data
+                from {tbl} as t where ver=0 order by keyf'''.format(
+                    tbl=table, c=CHUNKED, z=ZDICT
+                )
+            )
+        kpos = vpos = 0
+        fp.seek(keys_off)
+        index = bytearray()
+        for r in cur:
+            k = r['keyf'].encode()
+            fp.write(k)
+            if r['bz2'] == ZDICT: sz = len(bag._text(r).encode())
+            else: sz = int(r['sz'])
+            index += ENTRY.pack(kpos, len(k), vpos, sz, 0)
+            kpos += len(k)
+            vpos += sz
+        vals_off = keys_off + kpos
+
+        # second pass, the payloads and their flags
+        cur.execute(
+            '''select data, json, bz2
+                from {tbl} where ver=0 order by keyf'''.format(tbl=table)
+            )
+        chunks = bag._db.cursor()
+        for i, r in enumerate(cur):
+            data = r['data']
+            flags = F_JSON if r['json'] else 0
+            if r['bz2'] == CHUNKED:
+                flags |= F_BZ2 | F_BYTES
+                chunks.execute(
+                    '''select data from {tbl}_chunks
+                        where blob=? order by n'''.format(tbl=table),
+                    (data,)
+                    )
+                for c in chunks: fp.write(c['data'])
+            elif r['bz2'] == ZDICT:
+                fp.write(bag._text(r).encode())
+            else:
+                if r['bz2'] == BZ2: flags |= F_BZ2
+                fp.write(data.encode() if isinstance(data, str) else data)
+            index[(i+1) * ENTRY.size - 1] = flags
+
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, count, keys_off, vals_off))
+        fp.write(index)
+    os.replace(tmp, fpath)
+
+
+class FrozenBag(object):
+    """
+    read only view of a bag exported with `DataBag.export_snapshot(...)`.
+
+    the file is mmap'd so every process reading the same snapshot shares the
+    same pages, and lookups are a binary search over the sorted index with no
+    sqlite in the way.
+
+    ```python
+    bag.export_snapshot('/tmp/bag.snap')
+    frozen = FrozenBag('/tmp/bag.snap')
+    frozen.get('blah')
+    ```
+    """
+
+    def __init__(self, fpath):
+        with open(fpath, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mv = memoryview(self._mm)
+        magic, self._count, self._keys, self._vals = HEADER.unpack_from(
+            self._mm, 0
+            )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('not a databag snapshot')
+
+    def close(self):
+        self._mv.release()
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._mm, HEADER.size + i * ENTRY.size)
+
+    def _key(self, i):
+        ko, kl, _, _, _ = self._entry(i)
+        start = self._keys + ko
+        return self._mm[start:start+kl]
+
+    def _bisect(self, k):
+        """ index of the first key >= k """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < k: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def _find(self, keyf):
+        k = keyf.encode()
+        i = self._bisect(k)
+        if i < self._count and self._key(i) == k:
+            return i
+        return None
+
+    def _payload(self, i):
+        _, _, vo, vl, flags = self._entry(i)
+        start = self._vals + vo
+        return self._mv[start:start+vl], flags
+
+    def _data(self, i):
+        mv, flags = self._payload(i)
+        val_ = decompress(mv) if flags & F_BZ2 else mv
+        if flags & F_BYTES: return bytes(val_)
+        val_ = str(val_, 'utf-8')
+        return json.loads(val_) if flags & F_JSON else val_
+
+    def raw(self, keyf):
+        """
+        returns the stored payload for `keyf` as a memoryview over the mapped
+        file, without copying or decoding it.
+        """
+        i = self._find(keyf)
+        if i is None: raise KeyError(keyf)
+        return self._payload(i)[0]
+
+    def __getitem__(self, keyf):
+        i = self._find(keyf)
+        if i is None: raise KeyError(keyf)
+        return self._data(i)
+
+    def get(self, keyf, default=None):
+        i = self._find(keyf)
+        return default if i is None else self._data(i)
+
+    def __contains__(self, keyf):
+        return self._find(keyf) is not None
+
+    def _range(self, start, stop):
+        lo = 0 if start is None else self._bisect(start.encode())
+        hi = self._count if stop is None else self._bisect(stop.encode())
+        return range(lo, hi)
+
+    def keys(self, start=None, stop=None):
+        """ keys in order, optionally limited to start <= key < stop """
+        for i in self._range(start, stop):
+            yield self._key(i).decode()
+
+    def items(self, start=None, stop=None):
+        """ (key, value) in key order, optionally start <= key < stop """
+        for i in self._range(start, stop):
+            yield self._key(i).decode(), self._data(i)
+
+    def __iter__(self):
+        return self.keys()
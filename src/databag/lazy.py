@@ -0,0 +1,44 @@
+
+from collections.abc import Mapping
+
+
+class LazyDoc(Mapping):
+    """
+    read only stand in for a document from `find(..., lazy=True)` or
+    `by_created(lazy=True)`.  it holds the row as stored and only
+    decompresses and parses it the first time something inside is looked
+    at, so results that get dropped unread cost next to nothing.
+
+    `dict(doc)` gives a plain copy.
+    """
+
+    __slots__ = ('_bag', '_row', '_doc')
+
+    def __init__(self, bag, row):
+        self._bag = bag
+        self._row = row
+        self._doc = None
+
+    def _load(self):
+        if self._doc is None:
+            self._doc = self._bag._data(self._row)
+            self._row = None
+        return self._doc
+
+    @property
+    def loaded(self):
+        """ True once the document has been decoded """
+        return self._doc is not None
+
+    def __getitem__(self, k):
+        return self._load()[k]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        if self._doc is None: return '<LazyDoc (not loaded)>'
+        return 'LazyDoc({!r})'.format(self._doc)
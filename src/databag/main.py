@@ -1,11 +1,30 @@
 
+import csv
 import json
 import operator
+import os
+import re
 import sqlite3
+import struct
+from base64 import b64decode, b64encode
 from bz2 import compress, decompress
+from contextlib import contextmanager
 from datetime import datetime
+from io import BufferedReader, BytesIO
+from itertools import chain, islice, product
+from time import perf_counter, sleep
 from uuid import uuid1 as uuid
 from platform import python_version
+from urllib.request import pathname2url
+
+from .blob import BlobReader, BlobWriter
+from .lazy import LazyDoc
+from .metrics import Metrics
+from . import delta, zdict
+
+# layout of the tables a bag keeps, stamped into backups as the file's
+# user_version so restore() can tell an older backup from a newer one
+SCHEMA_VERSION = 1
 
 # hash any int to about a b64ish
 CHARSET = '0123456789abcdefghjklmnopqrstvwxyzABCDEFGHJKLMNOPQRSTVWXYZ'
@@ -24,6 +43,100 @@ def hashint(num):
     return sign + result
 
 
+dtjs = lambda d: d.isoformat() if isinstance(d, datetime) else None
+dtepoch = lambda d: d.timestamp() if isinstance(d, datetime) else None
+
+# what an iso format datetime string starts with
+ISO_DT = re.compile(r'\d{4}-\d\d-\d\d[T ]\d\d:\d\d')
+
+
+def parse_iso(s):
+    """ a datetime from what datetime.isoformat() made """
+    try:
+        return datetime.fromisoformat(s)
+    except AttributeError: # before 3.7
+        for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return datetime.strptime(s[:26], fmt)
+            except ValueError:
+                pass
+        raise ValueError('not an iso datetime: ' + s)
+
+
+def to_epoch(v):
+    """
+    datetimes, and strings holding iso format ones, as epoch seconds.  naive
+    datetimes are taken to be local time.  anything else comes back as is.
+    """
+    if isinstance(v, datetime): return v.timestamp()
+    if isinstance(v, str) and ISO_DT.match(v):
+        try:
+            return parse_iso(v).timestamp()
+        except ValueError:
+            pass
+    return v
+
+
+MISSING = object()
+
+def get_path(d, path, default=MISSING):
+    """
+    the value at dotted `path` ('profile.addr.city') in document `d`, or
+    `default`.  a key that really has dots in it wins over the nesting.  a
+    list along the way gives a list of what its elements hold at the rest
+    of the path, so `'items.sku'` is every item's sku.
+    """
+    if path in d: return d[path]
+    v = d
+    for part in path.split('.'):
+        if isinstance(v, dict):
+            if part not in v: return default
+            v = v[part]
+        elif isinstance(v, list):
+            found = []
+            for x in v:
+                if isinstance(x, dict) and part in x:
+                    y = x[part]
+                    found.extend(y if isinstance(y, list) else [y])
+            if not found: return default
+            v = found
+        else:
+            return default
+    return v
+
+
+def _encode_bytes(b):
+    """ an open_writer value as text for the exports """
+    return b64encode(b).decode('ascii')
+
+
+def _decode_value(v, encoding):
+    """ an exported value back from its `encoding`, '' or None for plain """
+    if not encoding: return v
+    if encoding != 'base64':
+        raise ValueError('unknown value encoding: ' + str(encoding))
+    return b64decode(v)
+
+
+def _need_backup_api(what):
+    if not hasattr(sqlite3.Connection, 'backup'): # before 3.7
+        raise NotImplementedError('{}() needs python 3.7 or later'.format(what))
+
+
+def _check_integrity(db):
+    """ raises sqlite3.DatabaseError unless the file on `db` checks out """
+    problems = [ r[0] for r in db.execute('pragma integrity_check') ]
+    if problems != ['ok']:
+        raise sqlite3.DatabaseError(
+            'integrity check failed: ' + '; '.join(problems[:10])
+            )
+
+
+# what the bz2 column holds.  it started life as a boolean, so plain and bz2
+# rows keep their 0 and 1, other encodings count up from there.
+RAW, BZ2, CHUNKED, ZDICT, DELTA = 0, 1, 2, 3, 4
+
+
 class DataBag(object):
     """
     put your data in a bag.
@@ -34,15 +147,111 @@ class DataBag(object):
     ```
     """
 
-    def __init__(self, table=None, fpath=None, versioned=False, history=10):
+    # statements on the hot paths.  each bag formats these with its table
+    # name once (see _statements), so every call hands sqlite the same string
+    # and hits its statement cache.  subclasses add theirs in their own SQL.
+    SQL = {
+        'get': '''select data, json, bz2 from {tbl} where keyf=? and ver=?''',
+        'has': '''select 1 from {tbl} where keyf=?''',
+        'when': '''select ts from {tbl} where keyf=?''',
+        'keys': '''select keyf from {tbl} order by keyf''',
+        'by_created_asc': '''select keyf, data, json, bz2, ver
+            from {tbl} order by ts asc''',
+        'by_created_desc': '''select keyf, data, json, bz2, ver
+            from {tbl} order by ts desc''',
+        'keys_by_created_desc': '''select keyf from {tbl} order by ts desc''',
+        'versions': '''select ver, bz2 from {tbl} where keyf=?
+            order by ver asc''',
+        'drop_version': '''delete from {tbl} where keyf=? and ver=?''',
+        'shift_version': '''update {tbl} set ver=? where keyf=? and ver=?''',
+        'insert': '''insert into {tbl} (keyf, data, ts, json, bz2, ver)
+            values (?, ?, ?, ?, ?, 0)''',
+        'delete': '''delete from {tbl} where keyf=?''',
+        'log_change': '''insert into {tbl}_changes (op, keyf, ts)
+            values (?, ?, ?)''',
+        'trim_changes': '''delete from {tbl}_changes where seq <= ?''',
+        }
+
+    def __init__(self, table=None, fpath=None, versioned=False, history=10,
+            metrics=None, changelog=False, changelog_retain=None,
+            zdict=False, zdict_max=16384, deltas=False, max_chain=8,
+            datetimes='iso', cached_statements=128, database=None):
         if not fpath:
             fpath=':memory:'
+        if datetimes not in ('iso', 'epoch'):
+            raise ValueError("datetimes must be 'iso' or 'epoch'")
         self._table = table
+        self._sql = self._statements()
+        # size of the connection's prepared statement cache.  the default
+        # is plenty for one bag, raise it for DictBags with lots of indexes
+        # or query shapes.
+        self._cached_statements = cached_statements
+        # how datetimes inside values get written
+        self._epoch = datetimes == 'epoch'
+        self._dtjs = dtepoch if self._epoch else dtjs
+        self._use_zdict = zdict
+        self._zdict_max = zdict_max
+        self._zdict = None # (version, dictionary) new rows get packed with
+        self._zdicts = {} # every version we've needed to read, by version
         self._versioned = versioned
         self._history = history
-        self._db = sqlite3.connect(fpath, detect_types=sqlite3.PARSE_DECLTYPES)
-        self._db.row_factory = sqlite3.Row
-        self._ensure_table()
+        self._deltas = deltas
+        self._max_chain = max_chain
+        self._changelog = changelog or changelog_retain is not None
+        self._changelog_retain = changelog_retain
+        # a bag from a Database uses its connection, otherwise it has its own
+        self._database = database
+        if database is None:
+            self._own_txn = 0
+            self._db = self._connect(fpath)
+            self._db.row_factory = sqlite3.Row
+            # only takes on a brand new file, lets compact() hand back free
+            # pages without a full vacuum
+            self._db.execute('pragma auto_vacuum = incremental')
+        else:
+            self._db = database._db
+        # metrics can be True for a private collector, or a Metrics instance
+        # to share one between bags.  when off, this stays None and the hot
+        # paths only pay for the None check.
+        if metrics is True: metrics = Metrics()
+        self._metrics = metrics or None
+        if self._metrics is not None: self._metrics.watch(self._db)
+        if database is None or database._first_time(
+                (type(self), table, self._use_zdict, self._changelog)
+                ):
+            self._ensure_table()
+        if self._use_zdict: self._load_zdict()
+
+    # transaction() depth.  bags from one Database share it along with the
+    # connection, which is what lets a transaction span several of them.
+    @property
+    def _txn(self):
+        d = self._database
+        return self._own_txn if d is None else d._txn
+
+    @_txn.setter
+    def _txn(self, n):
+        d = self._database
+        if d is None: self._own_txn = n
+        else: d._txn = n
+
+    def _connect(self, fpath):
+        return sqlite3.connect(
+            fpath, detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self._cached_statements
+            )
+
+    def _statements(self):
+        """ SQL from this class and its bases, formatted for this bag """
+        sql = {}
+        for cls in reversed(type(self).__mro__):
+            sql.update(vars(cls).get('SQL', {}))
+        return { k:v.format(tbl=self._table) for k,v in sql.items() }
+
+    @property
+    def metrics(self):
+        """ the Metrics collector for this bag, or None if not enabled """
+        return self._metrics
 
     def _ensure_table(self):
         cur = self._db.cursor()
@@ -56,7 +265,64 @@ class DataBag(object):
             '''create unique index if not exists
                 idx_dataf_{tbl} on {tbl} (keyf, ver)'''.format(tbl=self._table)
             )
-        self._db.commit()
+        # values written through open_writer() live here in pieces, and go
+        # away with whatever row points at them
+        cur.execute(
+            '''create table if not exists {tbl}_chunks (
+                blob text, n int, data blob, primary key (blob, n)
+                )'''.format(tbl=self._table)
+            )
+        cur.execute(
+            '''create trigger if not exists {tbl}_chunks_gc
+                after delete on {tbl} when old.bz2 = {c}
+                begin
+                    delete from {tbl}_chunks where blob = old.data;
+                end'''.format(tbl=self._table, c=CHUNKED)
+            )
+        if self._use_zdict:
+            cur.execute(
+                '''create table if not exists {tbl}_zdicts (
+                    ver integer primary key autoincrement,
+                    data blob, ts timestamp
+                    )'''.format(tbl=self._table)
+                )
+        if self._changelog:
+            cur.execute(
+                '''create table if not exists {tbl}_changes (
+                    seq integer primary key autoincrement,
+                    op text, keyf text, ts timestamp
+                    )'''.format(tbl=self._table)
+                )
+        self._commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        groups every write made inside the block into one commit.
+
+        ```python
+        with bag.transaction():
+            bag['a'] = 1
+            bag['b'] = 2
+        ```
+
+        blocks nest, only the outermost one commits.  an exception escaping
+        the outermost block rolls all of it back.
+        """
+        self._txn += 1
+        try:
+            yield self
+        except BaseException:
+            self._txn -= 1
+            if not self._txn: self._db.rollback()
+            raise
+        self._txn -= 1
+        if not self._txn: self._db.commit()
+
+    def _commit(self):
+        """ commits, unless we're inside a transaction() block """
+        if not self._txn:
+            self._db.commit()
 
     def _check_version_arg(self, v):
         if v is None: return 0
@@ -68,29 +334,175 @@ class DataBag(object):
         """
         implements an alternative method for retrieving items from the bag
         """
-        version = self._check_version_arg(version)
-        if keyf not in self:
+        try:
+            return self.__getitem__(keyf, version)
+        except KeyError:
             return default
-        return self.__getitem__(keyf, version)
 
     def __getitem__(self, keyf, version=None):
+        m = self._metrics
+        if m is None: return self._get(keyf, version)
+        start = perf_counter()
+        try:
+            return self._get(keyf, version)
+        finally:
+            m.observe('get', start)
+
+    def _get(self, keyf, version):
         version = self._check_version_arg(version)
         cur = self._db.cursor()
-        cur.execute(
-            '''
-            select data, json, bz2
-            from {tbl}
-            where keyf=? and ver=?
-            '''.format(tbl=self._table),
-            (keyf, version)
-            )
+        cur.execute(self._sql['get'], (keyf, version))
         d = cur.fetchone()
         if d is None: raise KeyError
+        if d['bz2'] == DELTA:
+            val_ = self._rebuild(keyf, version)
+            return json.loads(val_) if d['json'] else val_
         return self._data(d)
 
+    def _rebuild(self, keyf, version):
+        """
+        the text of delta encoded history row `version`, by walking up to the
+        nearest full copy and patching back down from it
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            '''select data, json, bz2 from {tbl}
+                where keyf=? and ver>=? order by ver'''.format(
+                    tbl=self._table
+                ),
+            (keyf, version)
+            )
+        deltas = []
+        for d in cur:
+            if d['bz2'] != DELTA: break
+            deltas.append(d['data'])
+        text = self._text(d).encode()
+        for patch in reversed(deltas):
+            text = delta.patch(text, patch)
+        return text.decode()
+
     def _data(self, d):
-        val_ = decompress(d['data']).decode() if d['bz2'] else d['data']
-        return json.loads(val_) if d['json'] else val_
+        if d['bz2'] == DELTA:
+            # history rows turn up in by_created scans, they need keyf and ver
+            val_ = self._rebuild(d['keyf'], d['ver'])
+            return json.loads(val_) if d['json'] else val_
+        if d['bz2'] == CHUNKED:
+            with BufferedReader(BlobReader(self, d['data'])) as fp:
+                return fp.read()
+        m = self._metrics
+        if m is None:
+            val_ = self._text(d)
+            return json.loads(val_) if d['json'] else val_
+
+        if d['bz2']:
+            start = perf_counter()
+            val_ = self._text(d)
+            m.time('decompress', start)
+        else:
+            val_ = d['data']
+        if d['json']:
+            start = perf_counter()
+            val_ = json.loads(val_)
+            m.time('json_decode', start)
+        return val_
+
+    def _text(self, d):
+        """ the stored text of a (non chunked) row, before any json decoding """
+        codec = d['bz2']
+        if codec == BZ2: return decompress(d['data']).decode()
+        if codec == ZDICT:
+            return zdict.unpack(d['data'], self._get_zdict(zdict.version(d['data'])))
+        return d['data']
+
+    def _load_zdict(self):
+        cur = self._db.cursor()
+        cur.execute(
+            '''select ver, data from {tbl}_zdicts
+                order by ver desc limit 1'''.format(tbl=self._table)
+            )
+        r = cur.fetchone()
+        if r is not None:
+            self._zdict = (r['ver'], r['data'])
+            self._zdicts[r['ver']] = r['data']
+
+    def _get_zdict(self, ver):
+        d = self._zdicts.get(ver)
+        if d is None:
+            # written by another process or an older training
+            cur = self._db.cursor()
+            cur.execute(
+                '''select data from {tbl}_zdicts where ver=?'''.format(
+                    tbl=self._table
+                ),
+                (ver,)
+                )
+            d = self._zdicts[ver] = cur.fetchone()['data']
+        return d
+
+    def train_zdict(self, sample=1000, size=16384, recompress=False,
+            batch=1000):
+        """
+        trains a compression dictionary from up to `sample` random documents
+        in the bag and stores it as the bag's newest version.  from then on,
+        values shorter than `zdict_max` get deflated against it.  older rows
+        keep pointing at the version they were written with, so this can be
+        rerun whenever the data drifts.
+
+        with `recompress`, every live row gets rewritten with the new
+        dictionary too, `batch` rows per commit.
+
+        needs the bag to be opened with `zdict=True`.  returns the new
+        dictionary's version.
+        """
+        if not self._use_zdict:
+            raise ValueError('bag was not opened with zdict=True')
+        cur = self._db.cursor()
+        cur.execute(
+            '''select data, json, bz2 from {tbl}
+                where ver=0 and bz2 != ? order by random() limit ?'''.format(
+                    tbl=self._table
+                ),
+            (CHUNKED, sample)
+            )
+        d = zdict.train((self._text(r) for r in cur), size)
+        cur.execute(
+            '''insert into {tbl}_zdicts (data, ts) values (?, ?)'''.format(
+                tbl=self._table
+            ),
+            (sqlite3.Binary(d), datetime.now())
+            )
+        self._commit()
+        ver = cur.lastrowid
+        self._zdict = (ver, d)
+        self._zdicts[ver] = d
+        if recompress: self._recompress(batch)
+        return ver
+
+    def _recompress(self, batch):
+        """
+        re-encodes stored rows in place, keeping their timestamps.  deltas
+        are left alone, the text they patch doesn't change.
+        """
+        last = 0
+        cur = self._db.cursor()
+        while True:
+            cur.execute(
+                '''select rowid, data, json, bz2 from {tbl}
+                    where rowid > ? and bz2 not in (?, ?) order by rowid
+                    limit ?'''.format(tbl=self._table),
+                (last, CHUNKED, DELTA, batch)
+                )
+            rows = cur.fetchall()
+            if not rows: return
+            with self.transaction():
+                for r in rows:
+                    value, _, codec = self._pack(self._text(r))
+                    self._db.execute(
+                        '''update {tbl} set data=?, bz2=?
+                            where rowid=?'''.format(tbl=self._table),
+                        (value, codec, r['rowid'])
+                        )
+            last = rows[-1]['rowid']
 
     def _genkey(self):
         return hashint(uuid().int)
@@ -100,87 +512,258 @@ class DataBag(object):
         self[k] = value
         return k
 
-    def __setitem__(self, keyf, value):
-        to_json = is_bz2 = False
+    def _encode(self, value):
+        """
+        serializes a value for storage, compressing it when that helps.
+        returns (value, to_json, codec)
+        """
+        m = self._metrics
+        to_json = False
         if not isinstance(value, str):
-            dtjs = lambda d: d.isoformat() if isinstance(d, datetime) else None
-            value = json.dumps(value, default=dtjs)
+            if m: start = perf_counter()
+            value = json.dumps(value, default=self._dtjs)
+            if m: m.time('json_encode', start)
             to_json = True
 
-        if len(value) > 39: # min len of bz2'd string
+        if m: start = perf_counter()
+        packed, raw, codec = self._pack(value)
+        if m:
+            m.time('compress', start)
+            m.count_bytes(raw, len(packed))
+        return packed, to_json, codec
+
+    def _pack(self, value):
+        """
+        compresses serialized `value` with whatever does best.
+        returns (value, original length, codec)
+        """
+        raw = len(value)
+        if self._zdict is not None and raw < self._zdict_max:
+            # small stuff, where a shared dictionary beats going it alone
+            ver, d = self._zdict
+            packed = zdict.pack(value, ver, d)
+            if len(packed) < raw:
+                return sqlite3.Binary(packed), raw, ZDICT
+        elif raw > 39: # min len of bz2'd string
             compressed = compress(value.encode())
-            if len(value) > len(compressed):
-                value = sqlite3.Binary(compressed)
-                is_bz2 = True
+            if raw > len(compressed):
+                return sqlite3.Binary(compressed), raw, BZ2
+        return value, raw, RAW
+
+    def __setitem__(self, keyf, value):
+        m = self._metrics
+        if m is None: return self._set(keyf, value)
+        start = perf_counter()
+        try:
+            self._set(keyf, value)
+        finally:
+            m.observe('set', start)
 
+    def _set(self, keyf, value):
+        value, to_json, codec = self._encode(value)
         # we'll want this handle to not scope out in a minute so that it gets
         # commited if we are versioned
         cur = self._db.cursor()
+        self._write(cur, keyf, value, to_json, codec)
+        self._commit()
 
+    def _write(self, cur, keyf, value, to_json, codec):
+        """
+        stores an already encoded value on cursor `cur`, handling versioning.
+        committing is left to the caller so subclasses can hang more work off
+        of the same transaction.
+        """
         # handle versioning
         if self._versioned:
             curv = self._db.cursor()
-            curv.execute('''
-                select ver
-                from {tbl} where keyf=?
-                order by ver asc
-                '''.format(tbl=self._table),
-                (keyf,)
-                )
-            for r in curv:
+            curv.execute(self._sql['versions'], (keyf,))
+            vers = curv.fetchall()
+            for r in vers:
                 ver = r['ver'] - 1
                 if abs(ver) > self._history:
                     # poor fella, getting whacked
-                    cur.execute('''
-                        delete from {tbl} where keyf=? and ver=?
-                        '''.format(tbl=self._table),
-                        (keyf, r['ver'])
-                        )
+                    cur.execute(self._sql['drop_version'], (keyf, r['ver']))
                 else:
-                    cur.execute('''
-                        update {tbl} set ver=? where keyf=? and ver=?
-                        '''.format(tbl=self._table),
-                        (ver, keyf, r['ver'])
+                    cur.execute(
+                        self._sql['shift_version'], (ver, keyf, r['ver'])
                         )
+            if self._deltas and vers and self._history:
+                self._demote(cur, keyf, value, codec, vers)
         else:
-            cur.execute('''
-                delete from {tbl} where keyf=? and ver=0
-                '''.format(tbl=self._table),
-                (keyf,)
-                )
+            cur.execute(self._sql['drop_version'], (keyf, 0))
 
         cur.execute(
-            '''INSERT INTO {tbl} (keyf, data, ts, json, bz2, ver)
-                values (?, ?, ?, ?, ?, 0)'''.format(tbl=self._table),
-            ( keyf, value, datetime.now(), to_json, is_bz2 )
+            self._sql['insert'],
+            ( keyf, value, datetime.now(), to_json, codec )
             )
-        self._db.commit()
+        self._log_change(cur, 'set', keyf)
 
-    def __delitem__(self, keyf):
+    def _demote(self, cur, keyf, value, codec, vers):
         """
-        remove an item from the bag, all versions if exist.
+        swaps the full copy that just became version -1 for a delta against
+        the incoming value, unless that would make a reader patch through
+        more than `max_chain` deltas to get back to it
         """
-        cur = self._db.cursor()
+        # deltas directly below the old current version, oldest first
+        chain = 0
+        for r in reversed(vers[:-1]):
+            if r['bz2'] != DELTA: break
+            chain += 1
+        if chain + 1 > self._max_chain or CHUNKED in (codec, vers[-1]['bz2']):
+            return
         cur.execute(
-            '''delete from {tbl} where keyf = ?'''.format(tbl=self._table),
+            '''select data, json, bz2 from {tbl}
+                where keyf=? and ver=-1'''.format(tbl=self._table),
             (keyf,)
             )
+        old = cur.fetchone()
+        base = self._text({'data': value, 'bz2': codec}).encode()
+        patch = delta.diff(base, self._text(old).encode())
+        if len(patch) >= len(old['data']): return
+        cur.execute(
+            '''update {tbl} set data=?, bz2=?
+                where keyf=? and ver=-1'''.format(tbl=self._table),
+            (sqlite3.Binary(patch), DELTA, keyf)
+            )
+
+    def _log_change(self, cur, op, keyf):
+        """
+        appends to the changelog, if there is one, on the writer's cursor so
+        it lands in the same transaction as the change itself
+        """
+        if not self._changelog: return
+        cur.execute(self._sql['log_change'], (op, keyf, datetime.now()))
+        if self._changelog_retain is not None:
+            cur.execute(
+                self._sql['trim_changes'],
+                (cur.lastrowid - self._changelog_retain,)
+                )
+
+    def __delitem__(self, keyf):
+        """
+        remove an item from the bag, all versions if exist.
+        """
+        m = self._metrics
+        if m is None: return self._del(keyf)
+        start = perf_counter()
+        try:
+            self._del(keyf)
+        finally:
+            m.observe('delete', start)
+
+    def _del(self, keyf):
+        cur = self._db.cursor()
+        cur.execute(self._sql['delete'], (keyf,))
         # raise error if nothing deleted
-        if cur.rowcount != 1:
+        if cur.rowcount < 1:
             raise KeyError
-        self._db.commit()
+        self._log_change(cur, 'del', keyf)
+        self._commit()
 
-    def when(self, keyf):
+    def get_many(self, keys, batch=500):
         """
-        returns a datetime obj representing the creation of the keyed data
+        current values for several keys, fetched `batch` keys per query.
+        returns a dict holding the keys that were found.
+        """
+        m = self._metrics
+        if m is None: return self._get_many(keys, batch)
+        start = perf_counter()
+        try:
+            return self._get_many(keys, batch)
+        finally:
+            m.observe('get_many', start)
+
+    def _get_many(self, keys, batch):
+        keys = list(keys)
+        found = {}
+        cur = self._db.cursor()
+        for i in range(0, len(keys), batch):
+            chunk = keys[i:i+batch]
+            cur.execute(
+                '''select keyf, data, json, bz2 from {tbl}
+                    where ver=0 and keyf in ({q})'''.format(
+                        tbl=self._table, q=', '.join('?' * len(chunk))
+                    ),
+                chunk
+                )
+            for d in cur.fetchall():
+                found[d['keyf']] = self._data(d)
+        return found
+
+    def set_many(self, items):
         """
+        stores every (key, value) pair in `items`, or every item of a dict,
+        in one transaction.  returns how many were written.
+        """
+        if isinstance(items, dict): items = items.items()
+        m = self._metrics
+        if m is None: return self._set_many(items)
+        start = perf_counter()
+        try:
+            return self._set_many(items)
+        finally:
+            m.observe('set_many', start)
+
+    def _set_many(self, items):
+        n = 0
+        with self.transaction():
+            for k, v in items:
+                self._set(k, v)
+                n += 1
+        return n
+
+    def open_writer(self, keyf, chunk_size=1 << 20, compresslevel=9):
+        """
+        returns a writable binary file object that streams a value of any
+        size into the bag under `keyf`, compressing as it goes and storing it
+        in `chunk_size` pieces.
+
+        ```python
+        with bag.open_writer('big') as fp:
+            for block in source:
+                fp.write(block)
+        ```
+
+        the value shows up (and replaces any old one) when the writer is
+        closed.  reading it back with `bag['big']` gives bytes, all at once;
+        `open_reader` streams it.  the writer holds the bag's transaction
+        open until it's closed, so other writes to this bag in the meantime
+        commit along with it.
+        """
+        return BlobWriter(self, keyf, self._genkey(), chunk_size, compresslevel)
+
+    def _store_blob(self, keyf, blob_id):
+        self._write(self._db.cursor(), keyf, blob_id, False, CHUNKED)
+
+    def open_reader(self, keyf, version=None, buffer_size=1 << 16):
+        """
+        returns a readable binary file object over the value at `keyf`.
+        values written with `open_writer` are streamed a chunk at a time,
+        anything else is served from memory as its stored text.
+        """
+        version = self._check_version_arg(version)
         cur = self._db.cursor()
         cur.execute(
-            '''select ts from {tbl} where keyf=?'''.format(tbl=self._table),
-            (keyf,)
+            '''select data, json, bz2 from {tbl}
+                where keyf=? and ver=?'''.format(tbl=self._table),
+            (keyf, version)
             )
         d = cur.fetchone()
         if d is None: raise KeyError
+        if d['bz2'] == CHUNKED:
+            return BufferedReader(BlobReader(self, d['data']), buffer_size)
+        if d['bz2'] == DELTA:
+            return BytesIO(self._rebuild(keyf, version).encode())
+        return BytesIO(self._text(d).encode())
+
+    def when(self, keyf):
+        """
+        returns a datetime obj representing the creation of the keyed data
+        """
+        cur = self._db.cursor()
+        cur.execute(self._sql['when'], (keyf,))
+        d = cur.fetchone()
+        if d is None: raise KeyError
         return d['ts']
 
     def __iter__(self):
@@ -188,9 +771,7 @@ class DataBag(object):
         returns keys of items in bag, sorted by key
         """
         cur = self._db.cursor()
-        cur.execute('''select keyf from {tbl} order by keyf'''.format(
-            tbl=self._table
-        ) )
+        cur.execute(self._sql['keys'])
         for k in cur:
             yield k['keyf']
 
@@ -199,23 +780,512 @@ class DataBag(object):
         returns key,value from bag in date order
         """
         cur = self._db.cursor()
-        order = 'desc' if desc else 'asc'
-        cur.execute(
-            '''select keyf, data, json, bz2
-                from {tbl} order by ts {o}'''.format(
-                    tbl=self._table, o=order
-                    )
-            )
+        cur.execute(self._sql['by_created_desc' if desc else 'by_created_asc'])
         for d in cur:
             yield d['keyf'], self._data(d)
 
     def __contains__(self, keyf):
+        cur = self._db.cursor()
+        cur.execute(self._sql['has'], (keyf,))
+        return cur.fetchone() is not None
+
+    def last_seq(self):
+        """ the newest changelog sequence number, 0 if nothing's changed """
+        if not self._changelog: return 0
         cur = self._db.cursor()
         cur.execute(
-            '''select 1 from {tbl} where keyf=?'''.format(tbl=self._table),
-            (keyf,)
+            '''select seq from sqlite_sequence where name=?''',
+            (self._table + '_changes',)
             )
-        return cur.fetchone() is not None
+        r = cur.fetchone()
+        return r['seq'] if r else 0
+
+    def changes(self, since_seq=0, batch=500, follow=False, poll=1.0):
+        """
+        streams (seq, op, key) from the changelog for every change after
+        `since_seq`, oldest first.  op is 'set' or 'del'.  consumers keep the
+        last seq they handled and pass it back in to pick up from there.
+
+        with `follow`, keeps polling every `poll` seconds for new changes
+        instead of stopping at the end.
+
+        raises ValueError if changes after `since_seq` have already been
+        dropped by `changelog_retain` or `truncate_changes`.
+        """
+        if not self._changelog:
+            raise ValueError('bag has no changelog')
+        cur = self._db.cursor()
+        cur.execute(
+            '''select min(seq) as lo from {tbl}_changes'''.format(
+                tbl=self._table
+            ) )
+        lo = cur.fetchone()['lo']
+        if lo is None: lo = self.last_seq() + 1
+        if since_seq + 1 < lo:
+            raise ValueError(
+                'changes up to {} have been truncated'.format(lo - 1)
+                )
+
+        while True:
+            cur.execute(
+                '''select seq, op, keyf from {tbl}_changes
+                    where seq > ? order by seq limit ?'''.format(
+                        tbl=self._table
+                    ),
+                (since_seq, batch)
+                )
+            rows = cur.fetchall()
+            for r in rows:
+                yield r['seq'], r['op'], r['keyf']
+            if rows:
+                since_seq = rows[-1]['seq']
+            elif follow:
+                sleep(poll)
+            else:
+                return
+
+    def truncate_changes(self, upto_seq):
+        """ drops changelog entries with seq <= `upto_seq` """
+        cur = self._db.cursor()
+        cur.execute(
+            '''delete from {tbl}_changes where seq <= ?'''.format(
+                tbl=self._table
+            ),
+            (upto_seq,)
+            )
+        self._commit()
+
+    def _import(self, rows, batch, progress):
+        """
+        writes (key, value) pairs from iterable `rows`, committing every
+        `batch` rows.  a key of None gets one generated, a bytes value is
+        stored as with open_writer.
+        """
+        n = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, batch))
+            if not chunk: break
+            self._import_chunk(chunk)
+            n += len(chunk)
+            if progress: progress(n)
+        return n
+
+    def _import_chunk(self, chunk):
+        """ writes one batch of _import's rows in a transaction """
+        with self.transaction():
+            for k, v in chunk:
+                if k is None: k = self._genkey()
+                if isinstance(v, bytes):
+                    # an exported open_writer value, back to a blob
+                    with self.open_writer(k) as fp: fp.write(v)
+                else:
+                    self[k] = v
+
+    def _export(self, after, batch):
+        """
+        streams live (key, value) pairs in key order, starting after key
+        `after`, fetching `batch` rows at a time so memory stays flat.
+        open_writer values come out as bytes.
+        """
+        cur = self._db.cursor()
+        while True:
+            # no lower bound to start with, '' is a key like any other
+            cur.execute(
+                '''select keyf, data, json, bz2 from {tbl}
+                    where ver=0 {after} order by keyf limit ?'''.format(
+                        tbl=self._table,
+                        after='' if after is None else 'and keyf > ?'
+                    ),
+                (batch,) if after is None else (after, batch)
+                )
+            rows = cur.fetchall()
+            if not rows: return
+            for d in rows:
+                yield d['keyf'], self._data(d)
+            after = rows[-1]['keyf']
+
+    def import_jsonl(self, fp, batch=1000, progress=None, skip=0):
+        """
+        loads lines of `{"key": ..., "value": ...}` from file object `fp`.
+        lines without a key get one generated, ones with `"encoding":
+        "base64"` are stored as with open_writer.
+
+        commits every `batch` lines, calling `progress(n)` after each commit
+        with the number of lines consumed from the start of the file.  hand
+        the last number seen back in as `skip` to resume an interrupted
+        import.  returns the number of lines consumed.
+        """
+        lines = iter(fp)
+        for _ in islice(lines, skip): pass
+        def rows():
+            for line in lines:
+                d = json.loads(line)
+                yield d.get('key'), _decode_value(d['value'], d.get('encoding'))
+        prog = progress and (lambda n: progress(skip + n))
+        return skip + self._import(rows(), batch, prog)
+
+    def export_jsonl(self, fp, batch=1000, progress=None, after=None):
+        """
+        writes the live contents of the bag to file object `fp` as lines of
+        `{"key": ..., "value": ...}`, in key order.  values written with
+        open_writer go out base64 encoded, with `"encoding": "base64"`.
+
+        calls `progress(n, key)` every `batch` lines with the count written
+        and the last key.  pass that key as `after` to resume.
+        returns the number of lines written.
+        """
+        n = 0
+        for k, v in self._export(after, batch):
+            line = {'key': k, 'value': v}
+            if isinstance(v, bytes):
+                line.update(value=_encode_bytes(v), encoding='base64')
+            fp.write(json.dumps(line, default=self._dtjs) + '\n')
+            n += 1
+            if progress and not n % batch: progress(n, k)
+        if progress and n % batch: progress(n, k)
+        return n
+
+    def import_csv(self, fp, batch=1000, progress=None, skip=0):
+        """
+        same as import_jsonl but reads `key,value,encoding` csv rows, with a
+        header, where each value is json encoded.
+        """
+        reader = csv.reader(fp)
+        next(reader, None)
+        for _ in islice(reader, skip): pass
+        # files from before the encoding column have just key and value
+        rows = (
+            (r[0] or None, _decode_value(json.loads(r[1]), r[2:] and r[2]))
+            for r in reader
+            )
+        prog = progress and (lambda n: progress(skip + n))
+        return skip + self._import(rows, batch, prog)
+
+    def export_csv(self, fp, batch=1000, progress=None, after=None):
+        """
+        same as export_jsonl but writes `key,value,encoding` csv rows, with a
+        header, where each value is json encoded.
+        """
+        writer = csv.writer(fp)
+        if after is None: writer.writerow(('key', 'value', 'encoding'))
+        n = 0
+        for k, v in self._export(after, batch):
+            enc = ''
+            if isinstance(v, bytes):
+                v, enc = _encode_bytes(v), 'base64'
+            writer.writerow((k, json.dumps(v, default=self._dtjs), enc))
+            n += 1
+            if progress and not n % batch: progress(n, k)
+        if progress and n % batch: progress(n, k)
+        return n
+
+    def _timed(self, op, rows):
+        """ wraps a result generator for metrics, if they're on """
+        m = self._metrics
+        return rows if m is None else m.timed_iter(op, rows)
+
+    def _pragma(self, name):
+        return self._db.execute('pragma {}'.format(name)).fetchone()[0]
+
+    def _own_names(self):
+        """ the tables this bag keeps, whether or not they exist yet """
+        t = self._table
+        return [t, t + '_chunks', t + '_zdicts', t + '_changes']
+
+    def _own_tables(self):
+        """ names of every table and index in the file belonging to this bag """
+        # exact names, a prefix would take in other bags named like this one
+        tables = set(self._own_names())
+        cur = self._db.cursor()
+        cur.execute('''select name, tbl_name from sqlite_master''')
+        return sorted( r['name'] for r in cur if r['tbl_name'] in tables )
+
+    def stats(self, sample=1000):
+        """
+        storage figures for the bag, as a dict of
+
+        - `rows`: live and historical (versioned) row counts
+        - `payload`: row counts and stored bytes, by how they're stored
+        - `compression_ratio`: original size over stored size, estimated by
+          decompressing up to `sample` rows of each compression (None for
+          all of them)
+        - `tables`: bytes used and unused for this bag's table, side tables
+          and indexes.  None when sqlite lacks the dbstat table.
+        - `file`: page size and counts, free pages and fragmentation for the
+          whole database file, which may hold other bags too
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            '''select total(ver=0) as live, total(ver<0) as hist
+                from {tbl}'''.format(tbl=self._table)
+            )
+        r = cur.fetchone()
+        rows = {'live': int(r['live']), 'historical': int(r['hist'])}
+
+        payload = {
+            'raw': {'rows': 0, 'bytes': 0},
+            'compressed': {'rows': 0, 'bytes': 0},
+            'chunked': {'rows': 0, 'bytes': 0},
+            'zdict': {'rows': 0, 'bytes': 0},
+            'delta': {'rows': 0, 'bytes': 0},
+            }
+        names = {
+            RAW: 'raw', BZ2: 'compressed', CHUNKED: 'chunked', ZDICT: 'zdict',
+            DELTA: 'delta',
+            }
+        cur.execute(
+            '''select bz2, count(1) as n, total(length(cast(data as blob))) as sz
+                from {tbl} group by bz2'''.format(tbl=self._table)
+            )
+        for r in cur:
+            p = payload[names[r['bz2']]]
+            p['rows'] += r['n']
+            p['bytes'] += int(r['sz'])
+        cur.execute(
+            '''select total(length(data)) from {tbl}_chunks'''.format(
+                tbl=self._table
+            ) )
+        payload['chunked']['bytes'] = int(cur.fetchone()[0])
+
+        # what the compressed rows were worth, from a sample of each kind
+        stored = est = payload['raw']['bytes']
+        for codec, name in ((BZ2, 'compressed'), (ZDICT, 'zdict')):
+            cur.execute(
+                '''select length(cast(data as blob)) as sz, data, bz2 from {tbl}
+                    where bz2 = {c} {lim}'''.format(
+                        c=codec,
+                        tbl=self._table,
+                        lim='' if sample is None else 'limit {:d}'.format(sample)
+                    )
+                )
+            sampled = expanded = 0
+            for r in cur:
+                sampled += r['sz']
+                expanded += len(self._text(r).encode())
+            stored += payload[name]['bytes']
+            est += payload[name]['bytes'] * (
+                expanded / sampled if sampled else 1
+                )
+        # chunked values and deltas are left out, there's no original size
+        # to compare them to
+        ratio = est / stored if stored else None
+
+        page_size = self._pragma('page_size')
+        pages = self._pragma('page_count')
+        free = self._pragma('freelist_count')
+        tables, unused, used = None, None, None
+        try:
+            cur.execute(
+                '''select name, sum(pgsize) as sz, sum(unused) as unused
+                    from dbstat group by name'''
+                )
+            dbstat = { r['name']:(r['sz'], r['unused']) for r in cur }
+        except sqlite3.OperationalError:
+            pass # no dbstat compiled in
+        else:
+            tables = {
+                n:{'bytes': dbstat[n][0], 'unused': dbstat[n][1]}
+                for n in self._own_tables() if n in dbstat
+                }
+            used = sum(sz for sz,_ in dbstat.values())
+            unused = sum(u for _,u in dbstat.values())
+
+        return {
+            'rows': rows,
+            'payload': payload,
+            'compression_ratio': ratio,
+            'tables': tables,
+            'file': {
+                'page_size': page_size,
+                'pages': pages,
+                'free_pages': free,
+                'free_bytes': free * page_size,
+                # share of bytes in used pages that hold nothing
+                'fragmentation': unused / used if used else None,
+                },
+            }
+
+    def compact(self, pages=64, max_steps=None, pause=0, convert=False):
+        """
+        hands free pages back to the filesystem `pages` at a time, committing
+        and sleeping `pause` seconds between steps so other connections get
+        the lock in between.  stops when nothing is free or after `max_steps`.
+        returns the number of pages reclaimed.
+
+        needs the file to be in incremental auto_vacuum mode, which new files
+        are.  older files can be switched with `convert=True`, which runs one
+        full VACUUM (and holds an exclusive lock for it).
+        """
+        if self._txn:
+            raise ValueError('compact() commits, not inside a transaction()')
+        if self._pragma('auto_vacuum') != 2:
+            if not convert:
+                raise ValueError(
+                    'file is not in incremental auto_vacuum mode, '
+                    'see compact(convert=True)'
+                    )
+            self._db.commit()
+            self._db.execute('pragma auto_vacuum = incremental')
+            self._db.execute('vacuum')
+
+        freed = steps = 0
+        while max_steps is None or steps < max_steps:
+            before = self._pragma('freelist_count')
+            if not before: break
+            # executescript steps the pragma to completion, a plain execute
+            # only frees the first page
+            self._db.executescript(
+                'pragma incremental_vacuum({:d})'.format(pages)
+                )
+            freed += before - self._pragma('freelist_count')
+            steps += 1
+            if pause: sleep(pause)
+        return freed
+
+    @contextmanager
+    def snapshot(self):
+        """
+        a consistent, read only view of the bag as it is when the block
+        starts, on a connection of its own.
+
+        ```python
+        with bag.snapshot() as snap:
+            for k, v in snap.by_created():
+                bag[k] = fix(v) # doesn't shift what the scan sees
+        ```
+
+        the file is switched to WAL (for good) so the snapshot and writers,
+        this bag or other processes, don't block each other.  writing to the
+        snapshot raises.  needs a bag in a file.
+
+        while a snapshot is open, checkpoints can't get past it, so the WAL
+        file keeps growing with every write.  for long analytics, keep
+        snapshots as short as the consistency you need (a scan per snapshot,
+        not a job per snapshot), and `checkpoint('truncate')` afterwards to
+        shrink the WAL back down.
+        """
+        from .reader import open_snapshot, close_snapshot
+        snap = open_snapshot(self)
+        try:
+            yield snap
+        finally:
+            close_snapshot(snap)
+
+    def checkpoint(self, mode='passive'):
+        """
+        runs a WAL checkpoint, `mode` being one of sqlite's passive, full,
+        restart or truncate.  returns (busy, wal pages, pages checkpointed),
+        busy being 1 when readers or writers kept it from finishing.
+        """
+        if mode not in ('passive', 'full', 'restart', 'truncate'):
+            raise ValueError('no such checkpoint mode: ' + str(mode))
+        if self._txn:
+            raise ValueError('checkpoint() commits, not inside a transaction()')
+        self._db.commit()
+        return tuple(
+            self._db.execute('pragma wal_checkpoint({})'.format(mode)).fetchone()
+            )
+
+    def backup(self, dest_path, pages_per_step=256, sleep=0, progress=None):
+        """
+        copies the database file, while it's in use, to `dest_path`.
+
+        uses sqlite's online backup, `pages_per_step` pages at a time with
+        `sleep` seconds between steps, so writers carry on in between (a
+        write from another connection restarts the copy, one through this
+        bag is carried into it).  `progress(copied, total)` is called with
+        page counts after each step.
+
+        the copy is written next to `dest_path` and only moved into place
+        once `pragma integrity_check` passes on it, raising
+        sqlite3.DatabaseError otherwise.  the whole file is copied, every
+        bag in it included.  needs python 3.7 or later.
+        """
+        _need_backup_api('backup')
+        if self._txn:
+            raise ValueError('backup() commits, not inside a transaction()')
+        self._db.commit()
+        cb = None
+        if progress:
+            cb = lambda status, remaining, total: progress(
+                total - remaining, total
+                )
+        tmp = dest_path + '.tmp'
+        dest = sqlite3.connect(tmp)
+        try:
+            self._db.backup(dest, pages=pages_per_step, progress=cb, sleep=sleep)
+            _check_integrity(dest)
+            dest.execute('pragma user_version = {:d}'.format(SCHEMA_VERSION))
+            dest.commit()
+        except BaseException:
+            dest.close()
+            os.remove(tmp)
+            raise
+        dest.close()
+        os.replace(tmp, dest_path)
+
+    def restore(self, src_path, pages_per_step=256, sleep=0, progress=None):
+        """
+        replaces the whole database file with the backup at `src_path`,
+        checking the backup's integrity first.
+
+        a backup from an older layout is brought up to date (missing side
+        tables created, the schema version moved on), one from a newer
+        databag raises ValueError.  a DictBag then rebuilds its indexes from
+        the restored documents.  `pages_per_step`, `sleep` and `progress`
+        are as for backup().
+
+        other connections to the file see the restore as one big write.
+        bags sharing a Database can't restore, their caches would go stale.
+        """
+        _need_backup_api('restore')
+        if self._database is not None:
+            raise ValueError("bags sharing a Database can't restore()")
+        if self._txn:
+            raise ValueError('restore() commits, not inside a transaction()')
+        src = sqlite3.connect(
+            'file:{}?mode=ro'.format(pathname2url(src_path)), uri=True
+            )
+        try:
+            _check_integrity(src)
+            ver = src.execute('pragma user_version').fetchone()[0]
+            if ver > SCHEMA_VERSION:
+                raise ValueError(
+                    'backup is schema version {}, this databag only knows up '
+                    'to {}'.format(ver, SCHEMA_VERSION)
+                    )
+            cb = None
+            if progress:
+                cb = lambda status, remaining, total: progress(
+                    total - remaining, total
+                    )
+            self._db.commit()
+            src.backup(self._db, pages=pages_per_step, progress=cb, sleep=sleep)
+        finally:
+            src.close()
+        self._restored()
+        self._db.execute('pragma user_version = {:d}'.format(SCHEMA_VERSION))
+        self._db.commit()
+
+    def _restored(self):
+        """ brings the bag in line with a file restore() just put under it """
+        self._zdict = None
+        self._zdicts = {}
+        self._ensure_table()
+        if self._use_zdict: self._load_zdict()
+
+    def export_snapshot(self, fpath):
+        """
+        writes the current (unversioned) contents of the bag to an immutable,
+        mmap friendly file at `fpath`.  open it with `FrozenBag(fpath)`.
+        """
+        from .frozen import write_snapshot
+        write_snapshot(self, fpath)
+
+
+# the pseudo field full text queries go under
+TEXT = '$text'
 
 
 class Qmeta(type):
@@ -241,6 +1311,27 @@ class Q(metaclass=Qmeta):
 
     NOTE: multiple Q's on the same key get and'd.  OR isn't supported yet.
 
+    Fields holding lists match when any one element meets all of a Q's
+    conditions.  `contains` and `all` test for elements independently.
+    ```python
+    d.find(Q.tags.contains('red'))
+    d.find(Q.tags.all(['red', 'blue']))
+    ```
+
+    Nested fields are reached with dotted paths, `Q('profile.city')` or
+    `Q.profile.city`.
+
+    Full text queries need a text index, see DictBag.ensure_text_index.
+    ```python
+    d.find(Q.search('quick fox'), Q.age > 20)
+    ```
+
+    Bounding boxes work on any two numeric fields, and use a spatial index
+    (DictBag.ensure_spatial_index) when there is one.
+    ```python
+    d.find(Q.within(lon=(-98, -97), lat=(30, 31)))
+    ```
+
     You can also create one q object for your query on the same key and use that
     over and over.
     ```python
@@ -260,17 +1351,28 @@ class Q(metaclass=Qmeta):
         '<=': operator.le,
         '=': operator.eq,
         '!=': operator.ne,
+        'has': operator.eq,
         }
 
+    # how each condition is written in sql, when it isn't the symbol itself
+    sql_ops = {'has': '='}
+
     def __init__(self, key):
         self._k = key
         self._ands = list()
         self._and_ops = set()
 
+    def __getattr__(self, key):
+        # Q.profile.city, for Q('profile.city')
+        if key.startswith('_') or self._ands:
+            raise AttributeError(key)
+        return Q('{}.{}'.format(self._k, key))
+
     def query(self):
         return (
             "and".join(
-                ' "{k}" {v} ? '.format(k=self._k, v=op) for op,_ in self._ands
+                ' "{k}" {v} ? '.format(k=self._k, v=Q.sql_ops.get(op, op))
+                for op,_ in self._ands
             ),
             [v for _,v in self._ands]
         )
@@ -310,6 +1412,40 @@ class Q(metaclass=Qmeta):
     def __ne__(self, val):
         return self._cond( '!=', val)
 
+    def contains(self, val):
+        """ the field is `val`, or a list with `val` in it """
+        return self._cond( 'has', val )
+
+    def all(self, vals):
+        """ the field is a list with every one of `vals` in it """
+        for v in vals:
+            self._cond( 'has', v )
+        return self
+
+    @staticmethod
+    def search(words):
+        """
+        full text match against the bag's text index.  `words` is an sqlite
+        FTS5 query, so 'quick fox' wants both words, and phrases in double
+        quotes, OR, NOT and prefix* all work.
+        """
+        return Q(TEXT)._cond( 'match', words )
+
+    @staticmethod
+    def within(box=None, **ka):
+        """
+        a bounding box, a (low, high) range for each of two fields, given as
+        a dict or keywords.  `Q.within(lon=(-98, -97), lat=(30, 31))`.  a
+        spatial index on the two fields makes it fast.
+        """
+        box = dict(box or {}, **ka)
+        if len(box) != 2:
+            raise ValueError('within needs a range for two fields')
+        fields = tuple(sorted(box))
+        return Q(fields)._cond(
+            'within', tuple( tuple(box[f]) for f in fields )
+            )
+
 
 class DictBag(DataBag):
     """
@@ -320,16 +1456,35 @@ class DictBag(DataBag):
     NOTE - the entire index model here is heavily inspired by goatfish
     """
 
-    def __init__(self, table=None, fpath=None, indexes=None):
+    def __init__(self, table=None, fpath=None, indexes=None, metrics=None,
+            changelog=False, changelog_retain=None, zdict=False,
+            datetimes='iso', cached_statements=128, shape_cache=256,
+            database=None):
 
-        super(DictBag, self).__init__(table=table, fpath=fpath)
+        super(DictBag, self).__init__(
+            table=table, fpath=fpath, metrics=metrics,
+            changelog=changelog, changelog_retain=changelog_retain,
+            zdict=zdict, datetimes=datetimes,
+            cached_statements=cached_statements, database=database
+            )
         self._indexes = set()
+        self._defer_index = False
+        self._index_sql = {} # index -> its insert and delete statements
+        # query shape (fields and operators, no values) -> (index, sql), so
+        # repeat finds skip picking an index and building the statement
+        self._shapes = {}
+        self._shape_cache = shape_cache
+        self._text_fields = None # what the text index covers, if there is one
+        self._text_sql = None # its insert and delete statements
+        # spatial indexes, sorted fields (how within Qs name them) -> (x, y)
+        self._spatial = {}
         if indexes:
             for idx in indexes:
                 self.ensure_index(idx)
 
     def _make_index_name(self, index):
-        nm = '_'.join(sorted(index))
+        # dotted paths can't go in a bare table name
+        nm = '_'.join(sorted(index)).replace('.', '__')
         return 'idx_{t}_{x}'.format(t=self._table, x=nm)
 
     def ensure_index(self, index):
@@ -337,12 +1492,25 @@ class DictBag(DataBag):
         creates an index on a set of fields in a dict
 
         Notes
+        - fields can be dotted paths into nested dicts, ('profile.city',)
         - these can be considered sparse.  If a key doesn't exist in a dictionary,
           it won't be added to the index.
-        - currently, if an item is added before an index is created, the item
-          isn't in the index. this is gross and will be fixed soon.
+        - an index that's new to the file gets filled from the documents
+          already in the bag
         """
         idx_name = self._make_index_name(index)
+        if self._database is not None and \
+                not self._database._first_time(idx_name):
+            # another bag on this connection already made it
+            self._indexes.add(tuple(sorted( index )))
+            self._shapes.clear()
+            return
+        cur = self._db.cursor()
+        cur.execute(
+            '''select 1 from sqlite_master where type='table' and name=?''',
+            (idx_name,)
+            )
+        backfill = cur.fetchone() is None
 
         cols = [' "{i}" '.format(i=idx) for idx in index]
 
@@ -355,7 +1523,6 @@ class DictBag(DataBag):
         # it's REAL we basically say "try to be constrained as possible".
         # Is this a hack? yep.  Does it work? yep.
 
-        cur = self._db.cursor()
         cur.execute(
             '''create table if not exists {i} (
                 "id" integer primary key autoincrement not null,
@@ -370,39 +1537,454 @@ class DictBag(DataBag):
             '''create index if not exists
                 i_{i} on {i} ({c})'''.format(i=idx_name, c=','.join(cols))
             )
-        self._db.commit()
-        self._indexes.add(tuple(sorted( index )))
+        index = tuple(sorted( index ))
+        if backfill and not self._defer_index:
+            cur.executemany(
+                self._index_insert(index),
+                chain.from_iterable(
+                    self._index_rows(k, d, index)
+                    for k,d in self.by_created()
+                    )
+                )
+        self._commit()
+        self._indexes.add(index)
+        # a new index can change the best plan for any shape
+        self._shapes.clear()
 
-    def __setitem__(self, keyf, value):
+    def ensure_text_index(self, fields):
+        """
+        creates a full text index (sqlite FTS5) over string `fields`, for
+        `Q.search(...)` and `{'$text': ...}` queries
+
+        Notes
+        - a bag has one text index, asking for different fields rebuilds it
+        - fields can be dotted paths.  lists of strings are indexed as their
+          words, anything that isn't a string is left out.
+        - an index that's new to the file gets filled from the documents
+          already in the bag
+        """
+        fields = tuple(fields)
+        txt = self._text_table()
+        fts = 'fts_' + self._table
+        cols = [ '"{}"'.format(f) for f in fields ]
+        self._text_sql = (
+            '''insert into "{t}" (keyf, {c}) values ({v})'''.format(
+                t=txt, c=', '.join(cols), v=', '.join(['?'] * (len(cols) + 1))
+                ),
+            '''delete from "{t}" where keyf=?'''.format(t=txt),
+            )
+        cur = self._db.cursor()
+        cur.execute('pragma table_info("{}")'.format(txt))
+        have = tuple( r['name'] for r in cur.fetchall() )[2:]
+        self._text_fields = fields
+        self._shapes.clear()
+        if have == fields: return
+
+        with self.transaction():
+            if have:
+                cur.execute('drop table "{}"'.format(fts))
+                cur.execute('drop table "{}"'.format(txt))
+            # the words sit in a plain table keyed like the documents, so a
+            # write can find and replace them.  fts indexes it via triggers.
+            cur.execute(
+                '''create table "{t}" (
+                    id integer primary key, keyf text unique, {c}
+                    )'''.format(t=txt, c=', '.join(cols))
+                )
+            cur.execute(
+                '''create virtual table "{f}" using fts5(
+                    {c}, content='{t}', content_rowid='id'
+                    )'''.format(f=fts, t=txt, c=', '.join(cols))
+                )
+            cur.execute(
+                '''create trigger "{t}_ai" after insert on "{t}" begin
+                    insert into "{f}" (rowid, {c}) values (new.id, {n});
+                    end'''.format(
+                        t=txt, f=fts, c=', '.join(cols),
+                        n=', '.join( 'new.' + c for c in cols )
+                    )
+                )
+            cur.execute(
+                '''create trigger "{t}_ad" after delete on "{t}" begin
+                    insert into "{f}" ("{f}", rowid, {c})
+                        values ('delete', old.id, {o});
+                    end'''.format(
+                        t=txt, f=fts, c=', '.join(cols),
+                        o=', '.join( 'old.' + c for c in cols )
+                    )
+                )
+            if not self._defer_index:
+                cur.executemany(
+                    self._text_sql[0],
+                    filter(None, (
+                        self._text_row(k, d) for k,d in self.by_created()
+                        ))
+                    )
+
+    def _own_names(self):
+        names = super(DictBag, self)._own_names()
+        for i in self._indexes:
+            names.append(self._make_index_name(i))
+        if self._text_fields:
+            fts = 'fts_' + self._table
+            names += [self._text_table(), fts] + [ fts + s
+                for s in ('_data', '_idx', '_docsize', '_config') ]
+        for fields in self._spatial.values():
+            pts, rtree = self._spatial_tables(fields)
+            names += [pts, rtree] + [ rtree + s
+                for s in ('_node', '_rowid', '_parent') ]
+        return names
+
+    def _text_table(self):
+        return 'txt_{}'.format(self._table)
+
+    def _text_row(self, key, data):
+        """ the text index row for `data`, None if it has none of the text """
+        vals = []
+        for f in self._text_fields:
+            v = get_path(data, f, None)
+            if isinstance(v, list):
+                v = ' '.join( x for x in v if isinstance(x, str) ) or None
+            elif not isinstance(v, str):
+                v = None
+            vals.append(v)
+        if all( v is None for v in vals ): return None
+        return (key,) + tuple(vals)
+
+    def ensure_spatial_index(self, fields):
+        """
+        creates a spatial index (sqlite rtree) on the points made by two
+        numeric fields, `(x_field, y_field)`, for `Q.within(...)` bounding
+        boxes and `nearest(...)`
+
+        Notes
+        - fields can be dotted paths.  documents without numbers in both
+          fields are left out.
+        - an index that's new to the file gets filled from the documents
+          already in the bag
+        """
+        fx, fy = fields
+        pts, rtree = self._spatial_tables((fx, fy))
+        cur = self._db.cursor()
+        cur.execute(
+            '''select 1 from sqlite_master where type='table' and name=?''',
+            (pts,)
+            )
+        backfill = cur.fetchone() is None
+        self._spatial[tuple(sorted(fields))] = (fx, fy)
+        self._shapes.clear()
+        if not backfill: return
+
+        with self.transaction():
+            # points sit in a plain table keyed like the documents, the rtree
+            # indexes it via triggers
+            cur.execute(
+                '''create table "{p}" (
+                    id integer primary key, keyf text unique, x real, y real
+                    )'''.format(p=pts)
+                )
+            cur.execute(
+                '''create virtual table "{r}" using rtree(
+                    id, minx, maxx, miny, maxy
+                    )'''.format(r=rtree)
+                )
+            cur.execute(
+                '''create trigger "{p}_ai" after insert on "{p}" begin
+                    insert into "{r}" values (new.id, new.x, new.x, new.y, new.y);
+                    end'''.format(p=pts, r=rtree)
+                )
+            cur.execute(
+                '''create trigger "{p}_ad" after delete on "{p}" begin
+                    delete from "{r}" where id = old.id;
+                    end'''.format(p=pts, r=rtree)
+                )
+            if not self._defer_index:
+                cur.executemany(
+                    self._spatial_statements((fx, fy))[0],
+                    filter(None, (
+                        self._spatial_row(k, d, (fx, fy))
+                        for k,d in self.by_created()
+                        ))
+                    )
+
+    def _spatial_tables(self, fields):
+        """ (points table, rtree) names for spatial index on (x, y) `fields` """
+        nm = '_'.join(fields).replace('.', '__')
+        return (
+            'geo_{t}_{x}'.format(t=self._table, x=nm),
+            'rtree_{t}_{x}'.format(t=self._table, x=nm),
+            )
+
+    def _spatial_statements(self, fields):
+        """ (insert, delete by key) for a spatial index """
+        pts = self._spatial_tables(fields)[0]
+        return (
+            '''insert into "{p}" (keyf, x, y) values (?, ?, ?)'''.format(p=pts),
+            '''delete from "{p}" where keyf=?'''.format(p=pts),
+            )
+
+    def _spatial_row(self, key, data, fields):
+        """ the point for `data` on (x, y) `fields`, None if it hasn't one """
+        xy = [ get_path(data, f, None) for f in fields ]
+        for v in xy:
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                return None
+        return (key,) + tuple(xy)
+
+    def _add_to_spatial(self, key, data):
+        for fields in self._spatial.values():
+            row = self._spatial_row(key, data, fields)
+            if row:
+                self._db.execute(self._spatial_statements(fields)[0], row)
+
+    def nearest(self, fields, point, n=10):
+        """
+        the `n` documents closest to `point`, as (key, dict, distance)
+        nearest first.  `fields` names the spatial index, `point` gives a
+        value for each field in the same order.  distance is straight line
+        on the two fields, so for lat/lon it's in degrees, not miles.
+        """
+        xy = self._spatial.get(tuple(sorted(fields)))
+        if xy is None:
+            raise ValueError(
+                'no spatial index on {}, see ensure_spatial_index()'.format(
+                    fields
+                ) )
+        at = dict(zip(fields, point))
+        x, y = at[xy[0]], at[xy[1]]
+        pts, rtree = self._spatial_tables(xy)
+        extent = self._extent(rtree)
+        if extent is None or n < 1: return []
+        minx, maxx, miny, maxy = extent
+        cur = self._db.cursor()
+        cur.execute('select max(id) from "{p}"'.format(p=pts))
+        count = cur.fetchone()[0] # near enough, and cheap
+        # a box that would hold about n points if they were spread evenly,
+        # doubled until the nth closest point found is inside it
+        span = max(maxx - minx, maxy - miny) or 1.0
+        r = span * (min(n, count) / count) ** 0.5
+        sql = '''select p.keyf,
+                (p.x - ?) * (p.x - ?) + (p.y - ?) * (p.y - ?) as d2
+            from "{r}" as r join "{p}" as p on p.id = r.id
+            where r.maxx >= ? and r.minx <= ? and r.maxy >= ? and r.miny <= ?
+            order by d2 limit ?'''.format(r=rtree, p=pts)
+        while True:
+            cur.execute(sql, (x, x, y, y, x - r, x + r, y - r, y + r, n))
+            rows = cur.fetchall()
+            everything = x - r <= minx and x + r >= maxx and \
+                y - r <= miny and y + r >= maxy
+            if everything or (len(rows) == n and rows[-1]['d2'] <= r * r):
+                break
+            r *= 2
+        docs = self.get_many([ row['keyf'] for row in rows ])
+        return [
+            (row['keyf'], docs[row['keyf']], row['d2'] ** 0.5)
+            for row in rows if row['keyf'] in docs
+            ]
+
+    def _extent(self, rtree):
+        """
+        (minx, maxx, miny, maxy) around everything in `rtree`, or None if
+        it's empty.  read off the root node, min() and max() would visit
+        every point.
+        """
+        cur = self._db.cursor()
+        cur.execute('select data from "{r}_node" where nodeno=1'.format(r=rtree))
+        data = cur.fetchone()[0]
+        # 2 bytes of depth, 2 of cell count, then cells of an 8 byte id and
+        # four big endian float32 coordinates
+        cells = struct.unpack_from('>H', data, 2)[0]
+        if not cells: return None
+        boxes = [ struct.unpack_from('>4f', data, 12 + i * 24)
+            for i in range(cells) ]
+        return (
+            min( b[0] for b in boxes ), max( b[1] for b in boxes ),
+            min( b[2] for b in boxes ), max( b[3] for b in boxes ),
+            )
+
+    def _add_to_text(self, key, data):
+        if not self._text_fields: return
+        row = self._text_row(key, data)
+        if row: self._db.execute(self._text_sql[0], row)
+
+    def _set(self, keyf, value):
         if not isinstance(value, dict):
             raise ValueError('dictbags are for dicts')
 
-        # save it normally as expected
-        super(DictBag, self).__setitem__(keyf, value)
-
-        # now add it to the necessary indexes
+        with self.transaction():
+            # save it normally as expected
+            super(DictBag, self)._set(keyf, value)
+
+            # now add it to the necessary indexes
+            if not self._defer_index:
+                self._drop_from_indexes(keyf)
+                for i in self._indexes:
+                    self._add_to_index(keyf, value, i)
+                self._add_to_text(keyf, value)
+                self._add_to_spatial(keyf, value)
+
+    def open_writer(self, keyf, *a, **ka):
+        """ streamed values are bytes, and dictbags are for dicts """
+        raise ValueError('dictbags are for dicts')
+
+    def _import_chunk(self, chunk):
+        # an exported open_writer value can't go in, and shouldn't get as
+        # far as writing the rest of the batch
+        for _, v in chunk:
+            if not isinstance(v, dict):
+                raise ValueError('dictbags are for dicts')
+        chunk = [ (k if k is not None else self._genkey(), v)
+            for k, v in chunk ]
+        # the batch's rows and its index entries commit together, so a
+        # failed import leaves the indexes matching whatever got in
+        with self.transaction():
+            defer, self._defer_index = self._defer_index, True
+            try:
+                super(DictBag, self)._import_chunk(chunk)
+            finally:
+                self._defer_index = defer
+            if not defer: self._index_many(list(dict(chunk).items()))
+
+    def _set_many(self, items):
+        # a key given twice only gets indexed once, with its last value
+        items = list(dict(items).items())
+        for _, v in items:
+            if not isinstance(v, dict):
+                raise ValueError('dictbags are for dicts')
+
+        with self.transaction():
+            defer, self._defer_index = self._defer_index, True
+            try:
+                n = super(DictBag, self)._set_many(items)
+            finally:
+                self._defer_index = defer
+            if not defer: self._index_many(items)
+        return n
+
+    def _index_many(self, items):
+        """
+        reindexes just the (key, dict) pairs in `items`, one statement per
+        index for the lot rather than one per document.  keys should be
+        unique.
+        """
+        cur = self._db.cursor()
         for i in self._indexes:
-            self._add_to_index(keyf, value, i)
+            cur.executemany(
+                '''delete from {i} where keyf=?'''.format(
+                    i=self._make_index_name(i)
+                ),
+                ( (k,) for k,_ in items )
+                )
+            cur.executemany(
+                self._index_insert(i),
+                chain.from_iterable(
+                    self._index_rows(k, v, i) for k,v in items
+                    )
+                )
+        if self._text_fields:
+            insert, delete = self._text_sql
+            cur.executemany(delete, ( (k,) for k,_ in items ))
+            cur.executemany(insert, filter(None, (
+                self._text_row(k, v) for k,v in items
+                )))
+        for fields in self._spatial.values():
+            insert, delete = self._spatial_statements(fields)
+            cur.executemany(delete, ( (k,) for k,_ in items ))
+            cur.executemany(insert, filter(None, (
+                self._spatial_row(k, v, fields) for k,v in items
+                )))
+
+    def _del(self, keyf):
+        with self.transaction():
+            super(DictBag, self)._del(keyf)
+            self._drop_from_indexes(keyf)
+
+    def _drop_from_indexes(self, keyf):
+        cur = self._db.cursor()
+        for i in self._indexes:
+            cur.execute(self._index_statements(i)[1], (keyf,))
+        if self._text_fields:
+            cur.execute(self._text_sql[1], (keyf,))
+        for fields in self._spatial.values():
+            cur.execute(self._spatial_statements(fields)[1], (keyf,))
 
     def _add_to_index(self, key, data, index):
-        keys = set(data.keys())
-        if not keys.intersection(index): return
+        rows = self._index_rows(key, data, index)
+        if rows: self._db.executemany(self._index_insert(index), rows)
 
-        idx = self._make_index_name(index)
-        cur = self._db.cursor()
-        vals = [ data.get(i, None) for i in index ]
-        vals.insert(0, key)
-        cur.execute(
-            '''
-            insert into {i} (keyf, {k}) values ({v})
-            '''.format(
+    def _index_rows(self, key, data, index):
+        """
+        the rows for `data` in `index`, none if it has none of the fields.
+        a list gets a row per element (multikey), so its elements can be
+        searched for.  more than one list field means a row per combination.
+        """
+        vals = [ get_path(data, i) for i in index ]
+        if all( v is MISSING for v in vals ): return []
+        cols = []
+        for v in vals:
+            if v is MISSING: v = None
+            vals = (v or [None]) if isinstance(v, list) else [v]
+            # with epoch datetimes, index columns hold numbers so ranges
+            # compare properly, iso strings from before the switch included
+            if self._epoch: vals = [ to_epoch(x) for x in vals ]
+            cols.append(vals)
+        return [ (key,) + row for row in product(*cols) ]
+
+    def _index_insert(self, index):
+        return self._index_statements(index)[0]
+
+    def _index_statements(self, index):
+        """ (insert, delete by key) for an index table, built once """
+        sql = self._index_sql.get(index)
+        if sql is None:
+            idx = self._make_index_name(index)
+            sql = self._index_sql[index] = (
+                '''insert into {i} (keyf, {k}) values ({v})'''.format(
                     i=idx,
                     k=', '.join('"{}"'.format(i) for i in index),
-                    v=', '.join(['?']*len(vals))
-                ),
-            vals
-            )
-        self._db.commit()
+                    v=', '.join(['?']*(len(index) + 1))
+                    ),
+                '''delete from {i} where keyf=?'''.format(i=idx),
+                )
+        return sql
+
+    def reindex(self):
+        """
+        rebuilds every index table from the documents currently in the bag
+        """
+        with self.transaction():
+            cur = self._db.cursor()
+            for i in self._indexes:
+                cur.execute(
+                    '''delete from {i}'''.format(i=self._make_index_name(i))
+                    )
+            if self._text_fields:
+                cur.execute('delete from "{}"'.format(self._text_table()))
+            for fields in self._spatial.values():
+                cur.execute(
+                    'delete from "{}"'.format(self._spatial_tables(fields)[0])
+                    )
+            for k, d in self.by_created():
+                for i in self._indexes:
+                    self._add_to_index(k, d, i)
+                self._add_to_text(k, d)
+                self._add_to_spatial(k, d)
+
+    def _restored(self):
+        super(DictBag, self)._restored()
+        # the backup may predate some of our indexes, create them empty and
+        # fill everything in one pass
+        self._defer_index = True
+        try:
+            for i in list(self._indexes):
+                self.ensure_index(i)
+            if self._text_fields:
+                self.ensure_text_index(self._text_fields)
+            for fields in list(self._spatial.values()):
+                self.ensure_spatial_index(fields)
+        finally:
+            self._defer_index = False
+        self.reindex()
 
     def find_one(self, *a, **ka):
         """
@@ -443,40 +2025,88 @@ class DictBag(DataBag):
         for k,d in self.by_created(desc=True):
             # rip through each document in the db...
             # performing the queries on each one
-            matched_all = True
-            for q in qs:
-                # on each document, first see if the key even exists
-                qk = q.key
-                if qk not in d:
-                    matched_all = False
-                    break
-
-                # now check each query against the doc
-                dv = d.get(qk)
-                for op, val in q._and_ops:
-                    if not op(dv, val):
-                        matched_all = False
-                        break
-                # if not all( op(dv, val) for op,val in q._and_ops ):
-                    # matched_all = False
-                    # break
-            if matched_all:
-                # if we got here, we matched all queries
+            if self._doc_matches(qs, d):
                 yield k, d
 
-    def _findQ(self, *a, **ka):
+    def _doc_matches(self, qs, d):
+        for q in qs:
+            if isinstance(q.key, tuple):
+                # a bounding box
+                if not self._within(q, d): return False
+                continue
+            # on each document, first see if the key even exists
+            dv = get_path(d, q.key)
+            if dv is MISSING:
+                return False
+
+            # now check each query against the doc
+            if not self._matches(q, dv):
+                return False
+        # if we got here, we matched all queries
+        return True
+
+    def _within(self, q, d):
+        for _, box in q._ands:
+            for f, (lo, hi) in zip(q.key, box):
+                v = get_path(d, f, None)
+                if isinstance(v, bool) or not isinstance(v, (int, float)):
+                    return False
+                if not lo <= v <= hi: return False
+        return True
+
+    def _matches(self, q, dv):
+        """ does document value `dv` meet every condition in `q` """
+        if not isinstance(dv, list):
+            if self._epoch: dv = to_epoch(dv)
+            return all( op(dv, val) for op,val in q._and_ops )
+        # lists match the way the index sees them, one row per element
+        if self._epoch: dv = [ to_epoch(x) for x in dv ]
+        each = []
+        for sym, val in q._ands:
+            if sym == 'has':
+                if val not in dv: return False
+            else:
+                each.append( (Q.ops[sym], val) )
+        return not each or any(
+            all( op(x, val) for op,val in each ) for x in dv
+            )
+
+    def by_created(self, desc=False, lazy=False):
+        """
+        returns key,value from bag in date order.  with `lazy`, values are
+        LazyDocs that only get decoded if they're looked at.
+        """
+        if not lazy:
+            return super(DictBag, self).by_created(desc)
+        return self._lazy_by_created(desc)
+
+    def _lazy_by_created(self, desc):
+        cur = self._db.cursor()
+        cur.execute(self._sql['by_created_desc' if desc else 'by_created_asc'])
+        for d in cur:
+            yield d['keyf'], LazyDoc(self, d)
+
+    def _keys_by_created(self):
+        cur = self._db.cursor()
+        cur.execute(self._sql['keys_by_created_desc'])
+        for d in cur:
+            yield d['keyf']
+
+    def _findQ(self, *a, keys_only=False, lazy=False, **ka):
         """
         accepts keyword arguments for eq matches on symbols.  Also accepts
         Q arguments for filtering.
 
-        acts as generator of results
+        returns a generator of results
         """
 
         # shortcircuit for empty a and ka
         if not a and not ka:
-            for k,data in self.by_created(desc=True):
-                yield k,data
-            return
+            if keys_only:
+                return self._timed('find_scan', self._keys_by_created())
+            return self._timed(
+                'find_scan', self.by_created(desc=True, lazy=lazy)
+                )
 
         qs = []
 
@@ -486,9 +2116,42 @@ class DictBag(DataBag):
 
         # now let's build the query objects, *a should be a list of Q objs
         qs.extend(a)
+        qs = self._merge_qs(qs)
+        if self._epoch: qs = [ self._epoch_q(q) for q in qs ]
+        texts = [ q for q in qs if q.key == TEXT ]
+        if texts:
+            # all the text searching goes in one Q, out front
+            text = Q(TEXT)
+            for q in texts:
+                for c in q._ands: text._cond(*c)
+            qs = [text] + [ q for q in qs if q.key != TEXT ]
+        else:
+            # a bounding box with an rtree behind it goes first, any others
+            # get checked on what it finds
+            for i, q in enumerate(qs):
+                if q.key in self._spatial:
+                    qs.insert(0, qs.pop(i))
+                    break
 
-        colset = set( q.key for q in qs )
-        index = self._find_matching_index(colset)
+        shape = tuple( (q.key, tuple(sym for sym,_ in q._ands)) for q in qs )
+        plan = self._shapes.get(shape)
+        if plan is None:
+            plan = self._plan(qs)
+            if len(self._shapes) >= self._shape_cache:
+                # drop the oldest
+                del self._shapes[next(iter(self._shapes))]
+            self._shapes[shape] = plan
+        index, sql, keys_sql = plan
+
+        if texts:
+            params = [ ' AND '.join( '({})'.format(v) for _,v in qs[0]._ands ) ]
+            return self._timed('find_text', self._side_search(
+                qs[1:], plan, params, keys_only, lazy
+                ))
+        if qs and qs[0].key in self._spatial:
+            return self._timed('find_spatial', self._side_search(
+                qs[1:], plan, self._box_params(qs[0]), keys_only, lazy
+                ))
 
         if not index:
             # OPTIMIZE
@@ -498,30 +2161,193 @@ class DictBag(DataBag):
             # slow way for everything. We should, if we find a partial index, do
             # a limited search then drop to iteration for the remaining query
             # filter
-            for k,doc in self._slow_search(qs):
-                yield k,doc
-            return
-
-        idxname = self._make_index_name(index)
+            # documents have to be decoded to be checked, lazy or not
+            rows = self._slow_search(qs)
+            if keys_only: rows = ( k for k,_ in rows )
+            return self._timed('find_scan', rows)
+
+        params = [ v for q in qs for _,v in q._ands ]
+        if keys_only:
+            return self._timed('find_indexed', self._index_keys(keys_sql, params))
+        return self._timed(
+            'find_indexed', self._index_search(sql, params, lazy)
+            )
 
-        where, params = [], []
+    def _merge_qs(self, qs):
+        """
+        one Q per field, holding every condition on it, so a list field means
+        the same thing (one element meeting them all) scanned or indexed.
+        the Qs passed in are left alone.
+        """
+        merged = {}
+        out = []
         for q in qs:
-            w,p = q.query()
-            where.append(w)
-            params.extend(p)
+            if isinstance(q.key, tuple) or q.key == TEXT:
+                # bounding boxes and text searches have their own handling
+                out.append(q)
+                continue
+            m = merged.get(q.key)
+            if m is None:
+                m = merged[q.key] = Q(q.key)
+                out.append(m)
+            for c in q._ands: m._cond(*c)
+        return out
+
+    def _plan(self, qs):
+        """
+        (index, sql, keys only sql) for a query, or (None, None, None) if it
+        has to scan
+        """
+        if qs and qs[0].key == TEXT: return self._text_plan(qs[1:])
+        if qs and qs[0].key in self._spatial:
+            return self._spatial_plan(qs[0].key, qs[1:])
+        colset = set( q.key for q in qs )
+        index = self._find_matching_index(colset)
+        if not index: return None, None, None
 
-        cur = self._db.cursor()
-        rows = cur.execute(
-            '''
+        # matching keys come off the index table, then documents are looked
+        # up by key, rather than probing the index once per document.  a
+        # multikey document has several rows, hence the distinct.
+        idx = self._make_index_name(index)
+        keys_sql = '''
+            select distinct idx.keyf as k from "{i}" as idx where {w}
+            '''.format(i=idx, w=self._where(qs, idx))
+        return index, '''
             select db.keyf as k, db.data, db.bz2, db.json
             from "{t}" as db
-            where exists (
-                select 1 from "{i}" as idx
-                where idx.keyf = db.keyf and {w}
-                )
-            '''.format(t=self._table, i=idxname, w=' and '.join( where ) ),
-            params
+            where db.keyf in ({keys})
+            '''.format(t=self._table, keys=keys_sql), keys_sql
+
+    def _text_plan(self, rest):
+        """
+        (index, sql, keys only sql) for a text search along with filters
+        `rest`.  when an index covers them they go in the same statement,
+        otherwise index is None and they get checked on the hits.
+        """
+        if self._text_fields is None:
+            raise ValueError('no text index, see ensure_text_index()')
+        index, where = self._rest_where(rest, 't.keyf')
+        fts = 'fts_' + self._table
+        hits = '''
+            from "{f}" join "{t}" as t on t.id = "{f}".rowid {{db}}
+            where "{f}" match ? {w}
+            order by "{f}".rank
+            '''.format(f=fts, t=self._text_table(), w=where)
+        sql = 'select db.keyf as k, db.data, db.bz2, db.json' + hits.format(
+            db='join "{}" as db on db.keyf = t.keyf'.format(self._table)
+            )
+        return index, sql, 'select t.keyf as k' + hits.format(db='')
+
+    def _spatial_plan(self, fields, rest):
+        """ like _text_plan, for a bounding box on spatial index `fields` """
+        index, where = self._rest_where(rest, 'p.keyf')
+        pts, rtree = self._spatial_tables(self._spatial[fields])
+        # the rtree keeps 32 bit floats, rounded outwards, so it's asked for
+        # anything overlapping the box and the exact point gets checked after
+        hits = '''
+            from "{r}" as r join "{p}" as p on p.id = r.id {{db}}
+            where r.maxx >= ? and r.minx <= ? and r.maxy >= ? and r.miny <= ?
+            and p.x between ? and ? and p.y between ? and ? {w}
+            '''.format(r=rtree, p=pts, w=where)
+        sql = 'select db.keyf as k, db.data, db.bz2, db.json' + hits.format(
+            db='join "{}" as db on db.keyf = p.keyf'.format(self._table)
             )
+        return index, sql, 'select p.keyf as k' + hits.format(db='')
+
+    def _box_params(self, q):
+        """ a within Q's box as parameters for _spatial_plan's sql """
+        box = dict(zip(q.key, q._ands[0][1]))
+        fx, fy = self._spatial[q.key]
+        (x1, x2), (y1, y2) = box[fx], box[fy]
+        return [x1, x2, y1, y2] * 2
+
+    def _rest_where(self, rest, keyf):
+        """
+        (index, extra sql condition on column `keyf`) for filters that go
+        along with a text or spatial search, or (None, '') if no index
+        covers them
+        """
+        if not rest: return None, ''
+        index = self._find_matching_index(set( q.key for q in rest ))
+        if not index: return None, ''
+        idx = self._make_index_name(index)
+        return index, '''and {k} in (
+            select idx.keyf from "{i}" as idx where {w})'''.format(
+                k=keyf, i=idx, w=self._where(rest, idx)
+            )
+
+    def _side_search(self, rest, plan, params, keys_only, lazy):
+        """
+        runs a text or spatial plan with `params` for its own part, along
+        with filters `rest`
+        """
+        index, sql, keys_sql = plan
+        if rest and not index:
+            # nothing covers the other filters, check them on the hits
+            for k, d in self._index_search(sql, params):
+                if self._doc_matches(rest, d):
+                    yield k if keys_only else (k, d)
+            return
+        params.extend( v for q in rest for _,v in q._ands )
+        if keys_only:
+            rows = self._index_keys(keys_sql, params)
+        else:
+            rows = self._index_search(sql, params, lazy)
+        for row in rows:
+            yield row
+
+    def _where(self, qs, idx):
+        """
+        sql conditions for `qs` on one row of index table `idx`.  elements a
+        list field has to contain are each checked on their own, like
+        _matches does, so only the first one comes from that row and only if
+        nothing else is asked of the field.  the rest have to be on some row
+        of the same document.
+        """
+        where = []
+        ranged = set( q.key for q in qs for sym,_ in q._ands if sym != 'has' )
+        has = set(ranged)
+        for q in qs:
+            for sym, _ in q._ands:
+                if sym != 'has':
+                    where.append(' "{k}" {s} ? '.format(k=q.key, s=sym))
+                elif q.key not in has:
+                    has.add(q.key)
+                    where.append(' "{k}" = ? '.format(k=q.key))
+                else:
+                    where.append(
+                        ''' "keyf" in (
+                            select "keyf" from "{i}" where "{k}" = ?) '''.format(
+                                i=idx, k=q.key
+                            )
+                        )
+        return 'and'.join(where)
+
+    def _epoch_q(self, q):
+        """
+        `q` with any datetimes it compares against as epoch seconds, iso
+        strings included, the same as stored values get
+        """
+        if q.key == TEXT: return q
+        vals = [ to_epoch(v) for _,v in q._ands ]
+        if all( v is v2 for (_,v), v2 in zip(q._ands, vals) ): return q
+        q2 = Q(q.key)
+        for (sym, _), v in zip(q._ands, vals):
+            q2._cond(sym, v)
+        return q2
+
+    def _index_keys(self, sql, params):
+        cur = self._db.cursor()
+        for d in cur.execute(sql, params):
+            yield d['k']
+
+    def _index_search(self, sql, params, lazy=False):
+        cur = self._db.cursor()
+        rows = cur.execute(sql, params)
+        if lazy:
+            for d in rows:
+                yield d['k'], LazyDoc(self, d)
+            return
         # return ( (d['k'], self._data(d)) for d in rows )
         for d in rows:
             yield d['k'], self._data(d)
@@ -539,25 +2365,42 @@ class DictBag(DataBag):
             '$gte': operator.ge,
             '$lte': operator.le,
             '$ne': operator.ne,
+            '$contains': Q.contains,
+            '$all': Q.all,
             }
 
         qs = []
 
         for k,v in qdict.items():
-            if not isinstance(v, dict):
+            if k == TEXT:
+                # {'$text': 'words'}, or mongo's {'$text': {'$search': 'words'}}
+                if isinstance(v, dict):
+                    if set(v) != {'$search'}:
+                        raise NotImplementedError(
+                            "Non-supported operator detected: " + k
+                        )
+                    v = v['$search']
+                qs.append( Q.search(v) )
+            elif k == '$within':
+                # {'$within': {'lon': [-98, -97], 'lat': [30, 31]}}
+                qs.append( Q.within(v) )
+            elif not isinstance(v, dict):
                 # treat like normal keyword match {'y':111}
                 qs.append( Q(k) == v)
             else:
                 # OPTIMIZE - does not check for formatting other than an
                 # existing op...
                 # dictionary.. for now assume it's formatted properly
+                # every operator on a field goes on the one Q, so a list
+                # field needs one element meeting all of them
+                q = Q(k)
                 for o_, val in v.items():
                     if o_ not in ops:
                         raise NotImplementedError(
                             "Non-supported operator detected: " + k
                         )
-                    op = ops[o_]
-                    qs.append( op(Q(k), val) )
+                    q = ops[o_](q, val)
+                qs.append(q)
         return qs
 
     def find(self, *qdicts, **kwa):
@@ -582,6 +2425,10 @@ class DictBag(DataBag):
         And even a combination of ...
         >>> x.find( k2=88, {'k1': 23})
         ```
+
+        `keys_only=True` gives just the keys, and when an index covers the
+        query the documents aren't read at all.  `lazy=True` gives LazyDocs
+        that are only decoded when looked into.
         """
         qs = []
         for qd in qdicts:
@@ -0,0 +1,153 @@
+
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter
+
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+    float('inf'),
+    )
+
+
+class Histogram(object):
+    """ call count, total and max, plus bucketed latencies """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max: self.max = ms
+        self.buckets[bisect_left(BUCKETS, ms)] += 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total,
+            'max_ms': self.max,
+            'buckets': {
+                'le_{}'.format(b): n for b,n in zip(BUCKETS, self.buckets)
+                },
+            }
+
+
+class Metrics(object):
+    """
+    collects timings for a bag, or for several if they share one instance.
+
+    ```python
+    m = Metrics(slow_query_ms=50)
+    bag = DictBag('dbag', '/tmp/bag.sqlite3', metrics=m)
+    ...
+    forward_somewhere(m.as_dict())
+    ```
+
+    per operation latencies (get, set, delete, find_indexed, find_scan), time
+    spent in compression and json, and payload bytes before and after
+    compression are always collected.  with `slow_query_ms` set, sqlite's
+    trace and progress hooks are used to keep the last `slow_log_size`
+    statements that took longer than that.
+
+    a statement's duration runs until the next statement starts or the bag
+    operation that issued it finishes.  for finds that includes time the
+    caller spends between rows, `vm_steps` (in units of `progress_every`
+    sqlite instructions) shows how much of it was sqlite actually working.
+    """
+
+    def __init__(self, slow_query_ms=None, slow_log_size=100,
+            progress_every=1000):
+        self.slow_query_ms = slow_query_ms
+        self.progress_every = progress_every
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self.reset()
+
+    def reset(self):
+        self.ops = {}
+        self.timers = {}
+        self.bytes = {'raw': 0, 'stored': 0}
+        self.slow_queries.clear()
+        self._stmt = None
+
+    def observe(self, op, start):
+        """ records an operation that began at perf_counter() `start` """
+        now = perf_counter()
+        h = self.ops.get(op)
+        if h is None: h = self.ops[op] = Histogram()
+        h.add((now - start) * 1000)
+        if self._stmt is not None: self._end_statement(now)
+
+    def time(self, name, start):
+        """ adds the time since perf_counter() `start` to timer `name` """
+        elapsed = perf_counter() - start
+        t = self.timers.get(name)
+        if t is None: t = self.timers[name] = [0, 0.0]
+        t[0] += 1
+        t[1] += elapsed
+
+    def count_bytes(self, raw, stored):
+        self.bytes['raw'] += raw
+        self.bytes['stored'] += stored
+
+    def timed_iter(self, op, it):
+        """
+        wraps generator `it` so only the time spent inside it, not in the
+        caller's loop body, gets recorded against `op`
+        """
+        h = self.ops.get(op)
+        if h is None: h = self.ops[op] = Histogram()
+        spent = 0.0
+        it = iter(it)
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    row = next(it)
+                except StopIteration:
+                    spent += perf_counter() - start
+                    return
+                spent += perf_counter() - start
+                yield row
+        finally:
+            h.add(spent * 1000)
+
+    def watch(self, db):
+        """ hooks sqlite connection `db` up to the slow query log """
+        if self.slow_query_ms is None: return
+        db.set_trace_callback(self._trace)
+        db.set_progress_handler(self._progress, self.progress_every)
+
+    def _trace(self, sql):
+        now = perf_counter()
+        if self._stmt is not None: self._end_statement(now)
+        self._stmt = [sql, now, 0]
+
+    def _progress(self):
+        if self._stmt is not None: self._stmt[2] += 1
+        return 0
+
+    def _end_statement(self, now):
+        sql, start, steps = self._stmt
+        self._stmt = None
+        ms = (now - start) * 1000
+        if ms >= self.slow_query_ms:
+            self.slow_queries.append(
+                {'sql': sql.strip(), 'ms': ms, 'vm_steps': steps}
+                )
+
+    def as_dict(self):
+        """ everything collected so far, as plain python types """
+        return {
+            'ops': { k:h.as_dict() for k,h in self.ops.items() },
+            'timers': {
+                k:{'count': n, 'total_ms': t * 1000}
+                for k,(n,t) in self.timers.items()
+                },
+            'bytes': dict(self.bytes),
+            'slow_queries': list(self.slow_queries),
+            }
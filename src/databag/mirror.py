@@ -0,0 +1,386 @@
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from .main import DataBag
+from .reader import close_snapshot, open_snapshot
+
+
+class MirrorBag(DataBag):
+    """
+    a bag held in a python dict, written back to sqlite in the background.
+    reads come straight out of memory and writes only mark keys dirty, a
+    flusher thread saves what changed every `flush_interval` seconds, or
+    sooner once `flush_dirty` keys are waiting.
+
+    ```python
+    with MirrorBag('scratch', '/tmp/scratch.db') as bag:
+        for k, v in things:
+            bag[k] = v
+    # everything's on disk here
+    ```
+
+    with `preload` the whole table is read in when the bag opens, otherwise
+    keys are read in the first time they're asked for.
+
+    what survives a crash:
+
+    * everything up to the last finished flush.  each flush is one sqlite
+      transaction, so the file holds the bag as it was at some flush, never
+      part of one.
+    * nothing written since.  that's up to `flush_interval` seconds or
+      `flush_dirty` keys (more if flushes are falling behind).  call
+      `flush()` for a checkpoint, and `close()` when done, the flusher
+      doesn't run at interpreter exit.
+    * writes inside a `transaction()` block are held back from flushing
+      until it ends, so they land together.  they aren't rolled back in
+      memory if the block raises.
+
+    values are kept as given, so change a stored dict in place and the
+    change is saved or not depending on whether it has been flushed yet;
+    set the key again instead.  other processes writing the same table
+    aren't seen, and only see this bag's writes as they're flushed.
+
+    calls that read the file rather than the dict flush first, so they see
+    every write made before them: `when`, `by_created`, versioned gets,
+    `export_jsonl` / `export_csv`, `export_snapshot`, `snapshot`, `backup`,
+    `stats`, `changes`, `last_seq` and `open_reader`.  `changes(follow=True)`
+    picks up later writes as they get flushed.  `open_writer`, and importing
+    the values it makes, aren't supported.
+
+    with metrics on, each flush is timed as the `flush` operation.
+    """
+
+    SQL = {
+        'keys_by_created_asc': '''select keyf from {tbl}
+            where ver=0 order by ts asc''',
+        'keys_by_created_desc': '''select keyf from {tbl}
+            where ver=0 order by ts desc''',
+        }
+
+    def __init__(self, table=None, fpath=None, preload=True,
+            flush_interval=1.0, flush_dirty=1000, versioned=False,
+            history=10, metrics=None, changelog=False, changelog_retain=None,
+            zdict=False, datetimes='iso', cached_statements=128):
+        self._preload = preload
+        self._flush_interval = flush_interval
+        self._flush_dirty = flush_dirty
+        self._mem = {}
+        # in write order, so the rows' timestamps come out in it too
+        self._dirty = {}
+        self._deleted = set()
+        self._hold = 0
+        self._error = None
+        # _lock guards the dict and the dirty sets, _io the connection.
+        # always take _io first.
+        self._lock = threading.RLock()
+        self._io = threading.RLock()
+        super(MirrorBag, self).__init__(
+            table=table, fpath=fpath, versioned=versioned, history=history,
+            metrics=metrics, changelog=changelog,
+            changelog_retain=changelog_retain, zdict=zdict,
+            datetimes=datetimes, cached_statements=cached_statements
+            )
+        if preload: self._load()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._flusher = None
+        if flush_interval is not None:
+            self._flusher = threading.Thread(target=self._run)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _load(self):
+        """ reads the whole table into memory """
+        cur = self._db.cursor()
+        cur.execute(
+            '''select keyf, data, json, bz2 from {tbl}
+                where ver=0'''.format(tbl=self._table)
+            )
+        for d in cur:
+            self._mem[d['keyf']] = self._data(d)
+
+    def _connect(self, fpath):
+        # the flusher thread writes on this connection too
+        return sqlite3.connect(
+            fpath, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+            cached_statements=self._cached_statements
+            )
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            try:
+                self._flush()
+            except Exception as e:
+                # handed to whoever calls flush() or close() next
+                self._error = e
+
+    def _get(self, keyf, version):
+        if version:
+            self.flush()
+            with self._io:
+                return super(MirrorBag, self)._get(keyf, version)
+        try:
+            return self._mem[keyf]
+        except KeyError:
+            if self._preload: raise
+        return self._fault(keyf)
+
+    def _fault(self, keyf):
+        """ reads in a key that isn't in memory yet """
+        with self._io:
+            with self._lock:
+                if keyf in self._mem: return self._mem[keyf]
+                if keyf in self._deleted: raise KeyError
+            val = super(MirrorBag, self)._get(keyf, 0)
+            with self._lock:
+                return self._mem.setdefault(keyf, val)
+
+    def _set(self, keyf, value):
+        with self._lock:
+            self._mem[keyf] = value
+            self._deleted.discard(keyf)
+            self._dirty.pop(keyf, None)
+            self._dirty[keyf] = None
+            n = len(self._dirty) + len(self._deleted)
+        self._dirtied(n)
+
+    def _del(self, keyf):
+        if keyf not in self:
+            raise KeyError
+        with self._lock:
+            self._mem.pop(keyf, None)
+            self._dirty.pop(keyf, None)
+            self._deleted.add(keyf)
+            n = len(self._dirty) + len(self._deleted)
+        self._dirtied(n)
+
+    def _dirtied(self, n):
+        if n < self._flush_dirty or self._hold: return
+        if self._flusher is None: self.flush()
+        else: self._wake.set()
+
+    def _get_many(self, keys, batch):
+        found = {}
+        missing = []
+        for k in keys:
+            try:
+                found[k] = self._mem[k]
+            except KeyError:
+                missing.append(k)
+        if missing and not self._preload:
+            for k in missing:
+                try:
+                    found[k] = self._fault(k)
+                except KeyError:
+                    pass
+        return found
+
+    def _set_many(self, items):
+        n = 0
+        with self.transaction():
+            for k, v in items:
+                self._set(k, v)
+                n += 1
+        return n
+
+    @contextmanager
+    def transaction(self):
+        """
+        holds the writes made inside the block back from flushing until it
+        ends, so they reach the file in one commit.  unlike DataBag, an
+        exception doesn't undo them.
+        """
+        with self._lock:
+            self._hold += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._hold -= 1
+                n = len(self._dirty) + len(self._deleted)
+            self._dirtied(n)
+
+    def flush(self):
+        """
+        writes every dirty and deleted key out in one transaction, now.
+        returns how many keys were written.  also raises whatever went wrong
+        in the last background flush.
+        """
+        err, self._error = self._error, None
+        n = self._flush(force=True)
+        if err is not None: raise err
+        return n
+
+    def _flush(self, force=False):
+        with self._io:
+            with self._lock:
+                if self._hold and not force: return 0
+                if not self._dirty and not self._deleted: return 0
+                dirty, self._dirty = self._dirty, {}
+                deleted, self._deleted = self._deleted, set()
+                writes = [ (k, self._mem[k]) for k in dirty ]
+            m = self._metrics
+            if m: start = perf_counter()
+            try:
+                cur = self._db.cursor()
+                for k, v in writes:
+                    self._write(cur, k, *self._encode(v))
+                for k in deleted:
+                    cur.execute(self._sql['delete'], (k,))
+                    self._log_change(cur, 'del', k)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                with self._lock:
+                    # put back whatever hasn't been changed again since
+                    for k in dirty:
+                        if k not in self._deleted:
+                            self._dirty.setdefault(k, None)
+                    for k in deleted:
+                        if k not in self._dirty: self._deleted.add(k)
+                raise
+            if m: m.observe('flush', start)
+            return len(writes) + len(deleted)
+
+    def pending(self):
+        """ how many changed keys are waiting to be flushed """
+        return len(self._dirty) + len(self._deleted)
+
+    def close(self):
+        """ stops the flusher, flushes what's left and closes the file """
+        if self._flusher is not None:
+            self._stop.set()
+            self._wake.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def __contains__(self, keyf):
+        if keyf in self._mem: return True
+        if self._preload or keyf in self._deleted: return False
+        with self._io:
+            return super(MirrorBag, self).__contains__(keyf)
+
+    def __iter__(self):
+        """ returns keys of items in bag, sorted by key """
+        if self._preload:
+            with self._lock:
+                keys = sorted(self._mem)
+            return iter(keys)
+        self.flush()
+        with self._io:
+            return iter(list(super(MirrorBag, self).__iter__()))
+
+    def __len__(self):
+        if self._preload: return len(self._mem)
+        return sum(1 for _ in self)
+
+    def when(self, keyf):
+        self.flush()
+        with self._io:
+            return super(MirrorBag, self).when(keyf)
+
+    def by_created(self, desc=False):
+        """ returns key,value from bag in date order, as of a flush now """
+        self.flush()
+        with self._io:
+            cur = self._db.cursor()
+            cur.execute(self._sql[
+                'keys_by_created_desc' if desc else 'keys_by_created_asc'
+                ])
+            keys = [ d['keyf'] for d in cur ]
+        for k in keys:
+            try:
+                yield k, self[k]
+            except KeyError:
+                pass
+
+    def open_writer(self, keyf, *a, **ka):
+        raise NotImplementedError(
+            "streamed values go straight to the file, which MirrorBag can't "
+            "keep in step with its dict"
+            )
+
+    def _import_chunk(self, chunk):
+        # exported open_writer values would need open_writer, turn the batch
+        # down before any of it lands in the dict
+        for _, v in chunk:
+            if isinstance(v, bytes):
+                raise NotImplementedError(
+                    "MirrorBag can't import streamed (open_writer) values"
+                    )
+        super(MirrorBag, self)._import_chunk(chunk)
+
+    def open_reader(self, *a, **ka):
+        return self._on_disk('open_reader', *a, **ka)
+
+    def _on_disk(self, name, *a, **ka):
+        """ flushes, then runs DataBag method `name` with the file to itself """
+        self.flush()
+        with self._io:
+            return getattr(super(MirrorBag, self), name)(*a, **ka)
+
+    def export_jsonl(self, *a, **ka):
+        return self._on_disk('export_jsonl', *a, **ka)
+
+    def export_csv(self, *a, **ka):
+        return self._on_disk('export_csv', *a, **ka)
+
+    def export_snapshot(self, *a, **ka):
+        return self._on_disk('export_snapshot', *a, **ka)
+
+    def backup(self, *a, **ka):
+        return self._on_disk('backup', *a, **ka)
+
+    def stats(self, *a, **ka):
+        return self._on_disk('stats', *a, **ka)
+
+    def last_seq(self):
+        return self._on_disk('last_seq')
+
+    def changes(self, *a, **ka):
+        """
+        same as DataBag.changes, from a flush now.  doesn't hold the file
+        while it's read, so following it doesn't stop the flusher.
+        """
+        self.flush()
+        return super(MirrorBag, self).changes(*a, **ka)
+
+    def restore(self, *a, **ka):
+        """
+        same as DataBag.restore.  writes that haven't been flushed yet are
+        thrown away along with the rest of what the bag held.
+        """
+        with self._io:
+            return super(MirrorBag, self).restore(*a, **ka)
+
+    def _restored(self):
+        super(MirrorBag, self)._restored()
+        with self._lock:
+            self._mem = {}
+            self._dirty = {}
+            self._deleted = set()
+            if self._preload: self._load()
+
+    @contextmanager
+    def snapshot(self):
+        """ same as DataBag.snapshot, as of a flush now """
+        self.flush()
+        with self._io:
+            snap = open_snapshot(self)
+        try:
+            yield snap
+        finally:
+            close_snapshot(snap)
@@ -1,10 +1,12 @@
 
 from .model import (
     set_db_path,
+    set_database,
     Model,
     Field,
     IntField,
     DateTimeField,
     StrField
     )
+from .session import Session
 
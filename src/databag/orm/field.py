@@ -1,9 +1,16 @@
 
 import json
+from copy import copy
 from datetime import datetime, timedelta, timezone
 
+from ..main import parse_iso
 
-parse_date = lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+def parse_date(x):
+    """ epoch seconds, or an iso string from before epoch storage """
+    if isinstance(x, (int, float)):
+        return datetime.fromtimestamp(x, timezone.utc)
+    return parse_iso(x)
 
 
 class Field:
@@ -13,24 +20,37 @@ class Field:
     _from_json = None
     _value = None
     _field_name = None
+    _slot = None # where the value sits in an instance's value list
+    _index = False
 
     def __init__(self,
             field_type,
             default=None,
             toj=None,
-            fromj=None
+            fromj=None,
+            index=False
             ):
         if default is not None: self._default = default
         # need toj fromj
         self._field_type = field_type
         self._default = default
         self._from_json = fromj or field_type
+        self._index = index
 
     def set_field_name(self, name):
         self._field_name = name
 
+    def bind(self, name, slot):
+        """
+        a copy of this field for one model class, which has its own layout.
+        done once when the class is created.
+        """
+        fld = copy(self)
+        fld._field_name = name
+        fld._slot = slot
+        return fld
+
     def __set__(self, instance, value):
-        field_name = self._field_name
         if value is None and self._default:
             value = (
                 self._default() if callable(self._default)
@@ -38,13 +58,14 @@ class Field:
                 )
         if not isinstance(value, self._field_type):
             raise ValueError("invalid type")
-        instance[field_name] = value
+        instance._vals[self._slot] = value
+        instance._dirty = True
 
     def __get__(self, obj, cls=None):
         if obj is None: # cls object gets the field, not val
             return self
-        # can we just get the value from the model instance's value store?
-        val = obj[self._field_name]
+        # straight from the model instance's value list
+        val = obj._vals[self._slot]
         # if the value was None, is there a default?
         if val is None and self._default is not None:
             val = (
@@ -52,7 +73,7 @@ class Field:
                 else self._default
                 )
             # first time we've asked for default, save it on the model instance
-            obj[self._field_name] = val
+            obj._vals[self._slot] = val
         return val
 
 
@@ -62,21 +83,22 @@ class Field:
 
 
 class StrField(Field):
-    def __init__(self, default=''):
-        super(StrField, self).__init__(str, default=default)
+    def __init__(self, default='', index=False):
+        super(StrField, self).__init__(str, default=default, index=index)
 
 
 class IntField(Field):
-    def __init__(self, default=0):
-        super(IntField, self).__init__(int, default=default)
+    def __init__(self, default=0, index=False):
+        super(IntField, self).__init__(int, default=default, index=index)
 
 
 class DateTimeField(Field):
-    def __init__(self, default=lambda:datetime.now(timezone.utc)):
+    def __init__(self, default=lambda:datetime.now(timezone.utc), index=False):
         super(DateTimeField, self).__init__(
             field_type=datetime,
             default=default,
             toj=lambda x: x.isoformat(),
-            fromj=parse_date
+            fromj=parse_date,
+            index=index
             )
 
@@ -1,5 +1,5 @@
 
-from databag import DictBag, Q
+from databag import Database, DictBag, Q
 from .field import Field, IntField, DateTimeField, StrField
 
 
@@ -7,11 +7,18 @@ class MissingDBConnection(Exception): pass
 
 
 class DBConnection:
+    _database = None
+
     def __init__(self):
         self._dbp = None
 
     def set_db_path(self, dbp):
         DBConnection._dbp = dbp
+        DBConnection._database = None
+
+    def set_database(self, db):
+        DBConnection._dbp = db.fpath
+        DBConnection._database = db
 
     @property
     def dbpath(self):
@@ -19,54 +26,131 @@ class DBConnection:
             raise MissingDBConnection("must instantiate dbconnection first")
         return DBConnection._dbp
 
+    @property
+    def database(self):
+        """ the Database every model's bag is opened from, made on first use """
+        if DBConnection._database is None:
+            DBConnection._database = Database(self.dbpath)
+        return DBConnection._database
+
 dbconn = DBConnection()
 
 def set_db_path(dbp):
     dbconn.set_db_path(dbp)
 
-
-class Model:
+def set_database(db):
+    """
+    opens model bags from Database `db`, to pick its cache size and pragmas
+    or share it with bags used outside the ORM
+    """
+    dbconn.set_database(db)
+
+
+class ModelMeta(type):
+    """
+    works out a model's fields once, when the class is made, instead of on
+    every instance.  each class gets its own copies of the fields it can see
+    (inherited ones first), numbered by where their values sit in an
+    instance's value list, and `__slots__` so instances don't carry a dict.
+    """
+
+    def __new__(mcs, name, bases, ns):
+        # subclasses that want a __dict__ back can ask for one with
+        # __slots__ = ('__dict__',)
+        ns.setdefault('__slots__', ())
+        cls = super(ModelMeta, mcs).__new__(mcs, name, bases, ns)
+        found = {}
+        for klass in reversed(cls.__mro__):
+            for k,v in vars(klass).items():
+                if isinstance(v, Field): found[k] = v
+        cls._fields = {}
+        for i,(k,fld) in enumerate(found.items()):
+            fld = cls._fields[k] = fld.bind(k, i)
+            setattr(cls, k, fld)
+        # what from_d and to_d run through, so they don't look anything up
+        cls._loaders = tuple(
+            (k, f._slot, f._field_type, f._from_json)
+            for k,f in cls._fields.items()
+            )
+        cls._dumpers = tuple(
+            (k, f._slot, f) for k,f in cls._fields.items()
+            )
+        # single field indexes from Field(index=True), then compound ones
+        # from the class's `indexes`, as DictBag.ensure_index takes them
+        specs = [ (k,) for k,f in cls._fields.items() if f._index ]
+        specs.extend( tuple(i) for i in cls.indexes )
+        cls._index_specs = []
+        for i in specs:
+            if sorted(i) not in ( sorted(j) for j in cls._index_specs ):
+                cls._index_specs.append(i)
+        return cls
+
+
+class Model(metaclass=ModelMeta):
+    # _dirty is set when a field changes and cleared once the model's saved
+    __slots__ = ('_key', '_vals', '_dirty')
     _created_ts = DateTimeField()
-    _key = None
-    __fields = None
     __db = None
-    __values = None
+    # compound indexes, as tuples of field names.  single field ones can be
+    # declared on the field with index=True.
+    indexes = ()
+    # how the bag stores datetimes, see DataBag.  'epoch' makes them cheap to
+    # load and range queryable through indexes.
+    datetimes = 'iso'
 
     def __init__(self, key=None, **ka):
-        self._update_fields()
-        self.__values = {}
+        self._vals = [None] * len(self._fields)
         self._key = key
+        self._dirty = True
         for k,a in ka.items():
             setattr(self, k, a)
 
     def __setitem__(self, k, val):
-        self.__values[k] = val
+        self._vals[self._fields[k]._slot] = val
+        self._dirty = True
 
     def __getitem__(self, k):
         # instance[k] should always return the raw value I know about
         # we assume other access methods have run through the field's default
         # setters by now
-        return self.__values.get(k)
-
-    @classmethod
-    def _update_fields(cls):
-        """ update the fields dict """
-        cls.__fields = {}
-        for k in dir(cls):
-            fld = getattr(cls, k)
-            if not isinstance(fld, Field): continue
-            fld.set_field_name(k)
-            cls.__fields[k] = fld
+        fld = self._fields.get(k)
+        return None if fld is None else self._vals[fld._slot]
 
     def to_d(self):
-        return { k:getattr(self, k) for k in self.__fields }
+        vals = self._vals
+        d = {}
+        for k, slot, fld in self._dumpers:
+            val = vals[slot]
+            # unset, let the field fill in its default
+            if val is None: val = fld.__get__(self)
+            d[k] = val
+        return d
 
     @classmethod
-    def grab(cls, key):
-        obj = cls.from_d(cls._db()[key])
+    def _load(cls, key, d):
+        obj = cls.from_d(d)
         obj._key = key
         return obj
 
+    @classmethod
+    def grab(cls, key):
+        return cls._load(key, cls._db()[key])
+
+    @classmethod
+    def grab_many(cls, keys):
+        """
+        loads several models in a few queries, returns a dict of key to model
+        for the keys that were found
+        """
+        return {
+            k:cls._load(k, d) for k,d in cls._db().get_many(keys).items()
+            }
+
+    @property
+    def dirty(self):
+        """ True if the model has changes that haven't been saved """
+        return self._dirty
+
     @property
     def key(self):
         return self._key
@@ -81,41 +165,62 @@ class Model:
 
     @classmethod
     def _db(cls):
-        if cls.__db is None:
-            cls.__db = DictBag(cls.table_name(), dbconn.dbpath)
-        return cls.__db
+        # looked up on this class only, a subclass has a table of its own
+        db = cls.__dict__.get('_Model__db')
+        if db is None:
+            # every model shares one connection, and can share transactions
+            db = cls.__db = dbconn.database.bag(
+                cls.table_name(), DictBag, indexes=cls._index_specs,
+                datetimes=cls.datetimes
+                )
+        return db
 
     @classmethod
     def set_db(cls, db):
         """
         if you use the set_db_path method in this library then calling set_db on
-        each model is unnecessary
+        each model is unnecessary.  the model's declared indexes get created
+        on `db` if it doesn't have them yet.
         """
+        for i in cls._index_specs:
+            db.ensure_index(i)
         cls.__db = db
 
     @classmethod
     def from_d(cls, some_dict):
         key = some_dict.get(cls.key_field(), None)
-        obj = cls(key)
+        if cls.__init__ is Model.__init__:
+            # skip __init__ and its setattr per keyword
+            obj = cls.__new__(cls)
+            obj._key = key
+            obj._vals = [None] * len(cls._fields)
+        else:
+            obj = cls(key)
+        vals = obj._vals
         # be generous, add all of dict to model
-        for k,f in cls.__fields.items():
-        # for k,v in some_dict.items():
+        for k, slot, field_type, from_json in cls._loaders:
             val = some_dict.get(k)
-            if val is not None:
-                setattr(obj,k,f._from_json(val))
+            if val is None: continue
+            if type(val) is not field_type:
+                val = from_json(val)
+                if not isinstance(val, field_type):
+                    raise ValueError("invalid type")
+            vals[slot] = val
+        obj._dirty = False
         return obj
 
     def save(self):
         # are we a new object, or updating?
-        if self.key: self._db[self.key] = self.to_d()
+        if self.key: self._db()[self.key] = self.to_d()
         else:
             self._key = self._db().add(self.to_d())
+        self._dirty = False
         return self
 
     @classmethod
     def find(cls, *qdicts, **ka):
         for k,d in cls._db().find(*qdicts, **ka):
-            yield k,cls.from_d(d)
+            yield k, cls._load(k, d)
 
     @classmethod
     def find_one(cls, *qdicts, **ka):
@@ -124,7 +229,7 @@ class Model:
     @classmethod
     def iter(cls):
         for k,d in cls._db().find():
-            yield k, cls.from_d(d)
+            yield k, cls._load(k, d)
 
 
 
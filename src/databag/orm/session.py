@@ -0,0 +1,91 @@
+
+class Session:
+    """
+    unit of work for models.  models loaded through or added to a session
+    are tracked, and `flush()` writes the new and changed ones in one
+    transaction, with index upkeep done once per batch.  unchanged models
+    aren't written at all.  (models whose bags were handed in with set_db on
+    separate connections get a transaction per connection.)
+
+    ```python
+    with Session() as s:
+        for thing in s.grab_many(Thing, keys).values():
+            thing.num += 1
+        s.add(Thing(thingname='new'))
+    # flushed here, unless the block raised
+    ```
+
+    a key loaded twice comes back as the same object.
+    """
+
+    def __init__(self):
+        self._loaded = {} # (cls, key) -> model
+        self._new = []
+
+    def add(self, obj):
+        """ tracks `obj`, saved or not, returns it """
+        if obj.key is None:
+            if not any(o is obj for o in self._new):
+                self._new.append(obj)
+        else:
+            obj = self._loaded.setdefault((type(obj), obj.key), obj)
+        return obj
+
+    def grab(self, cls, key):
+        obj = self._loaded.get((cls, key))
+        if obj is None: obj = self.add(cls.grab(key))
+        return obj
+
+    def grab_many(self, cls, keys):
+        """ like Model.grab_many, only loading keys the session doesn't have """
+        keys = list(keys)
+        objs = {}
+        missing = []
+        for k in keys:
+            obj = self._loaded.get((cls, k))
+            if obj is None: missing.append(k)
+            else: objs[k] = obj
+        for k, obj in cls.grab_many(missing).items():
+            objs[k] = self.add(obj)
+        return objs
+
+    def dirty(self):
+        """ every tracked model that flush() would write """
+        return self._new + [ o for o in self._loaded.values() if o.dirty ]
+
+    def flush(self):
+        """ saves new and changed models, returns how many were written """
+        by_bag = {}
+        for obj in self.dirty():
+            bag = type(obj)._db()
+            by_bag.setdefault(id(bag), (bag, []))[1].append(obj)
+        # bags sharing a connection (all of them, normally) get written in
+        # one transaction
+        by_conn = {}
+        for bag, objs in by_bag.values():
+            by_conn.setdefault(id(bag._db), []).append((bag, objs))
+        n = 0
+        for group in by_conn.values():
+            with group[0][0].transaction():
+                for bag, objs in group:
+                    for obj in objs:
+                        if obj.key is None: obj._key = bag._genkey()
+                    n += bag.set_many([ (o.key, o.to_d()) for o in objs ])
+        for _, objs in by_bag.values():
+            for obj in objs:
+                obj._dirty = False
+        for obj in self._new:
+            self._loaded[(type(obj), obj.key)] = obj
+        self._new = []
+        return n
+
+    def clear(self):
+        """ stops tracking everything, without saving """
+        self._loaded = {}
+        self._new = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *a):
+        if exc_type is None: self.flush()
@@ -0,0 +1,61 @@
+
+import sqlite3
+from urllib.request import pathname2url
+
+
+class _Reader(object):
+    """
+    stands in for a Database so a bag can sit on a snapshot's connection.
+    tables are never created and the read transaction is never committed.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._txn = 1
+
+    def _first_time(self, what):
+        return False
+
+
+def open_snapshot(bag):
+    """
+    a read only bag like `bag`, on its own connection, holding a read
+    transaction open on the file as it is right now.  switches the file to
+    WAL if it isn't already.  close it with close_snapshot().
+    """
+    from .main import DictBag, DataBag
+
+    fpath = bag._db.execute('pragma database_list').fetchone()['file']
+    if not fpath:
+        raise ValueError('snapshots need a bag in a file, not in memory')
+    if bag._pragma('journal_mode') != 'wal':
+        if bag._txn or bag._db.in_transaction:
+            raise ValueError(
+                "can't switch the file to WAL for a snapshot in a transaction"
+                )
+        bag._db.execute('pragma journal_mode = wal')
+
+    db = sqlite3.connect(
+        'file:{}?mode=ro'.format(pathname2url(fpath)), uri=True,
+        detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None
+        )
+    db.row_factory = sqlite3.Row
+    # the snapshot is taken at the first read, not the begin
+    db.execute('begin')
+    db.execute('select count(1) from sqlite_master').fetchone()
+
+    ka = dict(
+        database=_Reader(db), zdict=bag._use_zdict, changelog=bag._changelog,
+        datetimes='epoch' if bag._epoch else 'iso'
+        )
+    if not isinstance(bag, DictBag):
+        return DataBag(bag._table, **ka)
+    snap = DictBag(bag._table, indexes=list(bag._indexes), **ka)
+    snap._text_fields, snap._text_sql = bag._text_fields, bag._text_sql
+    snap._spatial = dict(bag._spatial)
+    return snap
+
+
+def close_snapshot(snap):
+    snap._db.rollback()
+    snap._db.close()
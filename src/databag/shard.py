@@ -0,0 +1,425 @@
+
+import heapq
+import queue
+import sqlite3
+import threading
+import zlib
+from itertools import chain, islice
+
+from .main import CHUNKED, ZDICT, DataBag, DictBag
+from .metrics import Metrics
+
+
+def shard_for(keyf, shards):
+    """
+    the shard number for `keyf`.  crc32 rather than hash() since it has to
+    come out the same in every process, forever.
+    """
+    return zlib.crc32(keyf.encode()) % shards
+
+
+class _Threaded(object):
+    """ shard connections get read from worker threads during fan outs """
+
+    def _connect(self, fpath):
+        return sqlite3.connect(
+            fpath, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+            cached_statements=self._cached_statements
+            )
+
+class _DataShard(_Threaded, DataBag): pass
+class _DictShard(_Threaded, DictBag): pass
+
+
+_DONE = object()
+
+class _Failed(object):
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(q, item, stop):
+    """ blocking put that gives up once the consumer has gone away """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(rows, q, stop):
+    try:
+        for row in rows:
+            if not _put(q, row, stop): return
+        item = _DONE
+    except Exception as e:
+        item = _Failed(e)
+    _put(q, item, stop)
+
+
+def _drain(q):
+    while True:
+        item = q.get()
+        if item is _DONE: return
+        if isinstance(item, _Failed): raise item.exc
+        yield item
+
+
+class ShardedDataBag(object):
+    """
+    a DataBag spread over several sqlite files so writers to different
+    shards don't wait on each other's locks.
+
+    ```python
+    bag = ShardedDataBag('dbag', ['/tmp/s0.db', '/tmp/s1.db', '/tmp/s2.db'])
+    bag['blah'] = 'blip'
+    ```
+
+    keys go to a shard by a stable hash, so a bag must always be opened with
+    the same list of files in the same order.  use `reshard(...)` to move to a
+    different number of shards.
+
+    single key operations touch one shard.  iteration, `by_created`, the
+    exports and `find` run on every shard at once, each in its own thread
+    feeding a bounded buffer of `buffer` rows, and get merged (in order,
+    where the DataBag equivalent is ordered).  `get_many`, `set_many` and
+    the imports split their keys up by shard and commit each shard's part
+    on its own, so a failure can leave some shards written and not others.
+    `open_writer` and `open_reader` go to the key's shard, `compact`,
+    `checkpoint` and `train_zdict` run on every shard.  `transaction()`, the
+    changelog calls, `backup`, `restore` and the snapshots need one file and
+    raise NotImplementedError.
+    """
+
+    _shard_cls = _DataShard
+
+    def __init__(self, table=None, fpaths=(), buffer=256, **ka):
+        if not fpaths:
+            raise ValueError('need at least one shard')
+        self._table = table
+        self._buffer = buffer
+        # one collector for the lot, not one per shard
+        if ka.get('metrics') is True: ka['metrics'] = Metrics()
+        self._shards = [ self._shard_cls(table, fp, **ka) for fp in fpaths ]
+
+    def _shard(self, keyf):
+        return self._shards[shard_for(keyf, len(self._shards))]
+
+    def get(self, keyf, default=None, version=None):
+        return self._shard(keyf).get(keyf, default, version)
+
+    def __getitem__(self, keyf, version=None):
+        return self._shard(keyf).__getitem__(keyf, version)
+
+    def __setitem__(self, keyf, value):
+        self._shard(keyf)[keyf] = value
+
+    def __delitem__(self, keyf):
+        del self._shard(keyf)[keyf]
+
+    def __contains__(self, keyf):
+        return keyf in self._shard(keyf)
+
+    def when(self, keyf):
+        return self._shard(keyf).when(keyf)
+
+    def add(self, value):
+        k = self._shards[0]._genkey()
+        self[k] = value
+        return k
+
+    @property
+    def metrics(self):
+        """ the Metrics collector every shard reports to, or None """
+        return self._shards[0].metrics
+
+    def open_writer(self, keyf, *a, **ka):
+        return self._shard(keyf).open_writer(keyf, *a, **ka)
+
+    def open_reader(self, keyf, *a, **ka):
+        return self._shard(keyf).open_reader(keyf, *a, **ka)
+
+    def compact(self, *a, **ka):
+        """ DataBag.compact on every shard, returns the pages reclaimed """
+        return sum( s.compact(*a, **ka) for s in self._shards )
+
+    def checkpoint(self, mode='passive'):
+        """ DataBag.checkpoint on every shard, a result per shard """
+        return [ s.checkpoint(mode) for s in self._shards ]
+
+    def train_zdict(self, *a, **ka):
+        """
+        DataBag.train_zdict on every shard, each from its own documents.
+        returns each shard's new dictionary version.
+        """
+        return [ s.train_zdict(*a, **ka) for s in self._shards ]
+
+    def _one_file(self, *a, **ka):
+        raise NotImplementedError(
+            "shards are separate files, back up or snapshot each one; "
+            "together they wouldn't be one point in time"
+            )
+
+    backup = restore = snapshot = export_snapshot = _one_file
+
+    def _by_shard(self, items, key=lambda item: item[0]):
+        """ (shard, [item, ...]) for `items`, keyed by key(item) """
+        per_shard = {}
+        for item in items:
+            per_shard.setdefault(self._shard(key(item)), []).append(item)
+        return per_shard.items()
+
+    def get_many(self, keys, batch=500):
+        found = {}
+        for shard, shard_keys in self._by_shard(keys, key=lambda k: k):
+            found.update(shard.get_many(shard_keys, batch))
+        return found
+
+    def set_many(self, items):
+        """ same as DataBag.set_many, in one transaction per shard """
+        if isinstance(items, dict): items = items.items()
+        return sum(
+            shard.set_many(shard_items)
+            for shard, shard_items in self._by_shard(items)
+            )
+
+    def transaction(self):
+        raise NotImplementedError(
+            "shards are separate files, a transaction can't span them"
+            )
+
+    def _import(self, rows, batch, progress):
+        """ same as DataBag._import, `batch` rows at a time across shards """
+        n = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, batch))
+            if not chunk: break
+            chunk = [ (k if k is not None else self._shards[0]._genkey(), v)
+                for k, v in chunk ]
+            for shard, shard_rows in self._by_shard(chunk):
+                shard._import_chunk(shard_rows)
+            n += len(chunk)
+            if progress: progress(n)
+        return n
+
+    def _export(self, after, batch):
+        return self._fanout(
+            lambda s: s._export(after, batch), key=lambda r: r[0]
+            )
+
+    @property
+    def _dtjs(self):
+        return self._shards[0]._dtjs
+
+    # these only go through _import, _export and _dtjs
+    import_jsonl = DataBag.import_jsonl
+    export_jsonl = DataBag.export_jsonl
+    import_csv = DataBag.import_csv
+    export_csv = DataBag.export_csv
+
+    def stats(self, sample=1000):
+        """
+        row and payload figures summed over the shards, with each shard's
+        own DataBag.stats under `shards`
+        """
+        shards = [ s.stats(sample) for s in self._shards ]
+        rows = {'live': 0, 'historical': 0}
+        payload = {}
+        for st in shards:
+            for k, v in st['rows'].items(): rows[k] += v
+            for name, p in st['payload'].items():
+                tot = payload.setdefault(name, {'rows': 0, 'bytes': 0})
+                tot['rows'] += p['rows']
+                tot['bytes'] += p['bytes']
+        return {'rows': rows, 'payload': payload, 'shards': shards}
+
+    def _no_changelog(self, *a, **ka):
+        raise NotImplementedError(
+            'each shard numbers its changes on its own, there is no one '
+            'sequence to follow across them'
+            )
+
+    changes = last_seq = truncate_changes = _no_changelog
+
+    def close(self):
+        """ closes every shard's file """
+        for s in self._shards:
+            s._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def _fanout(self, fn, key=None, reverse=False):
+        """
+        runs generator function `fn(shard)` against every shard in parallel.
+        with `key`, each shard's output has to already be sorted by it and the
+        results get merge sorted, otherwise they come back a shard at a time,
+        in shard order, with the shards still to come filling their buffers
+        meanwhile.
+        """
+        stop = threading.Event()
+        iters = []
+        for shard in self._shards:
+            q = queue.Queue(maxsize=self._buffer)
+            t = threading.Thread(target=_produce, args=(fn(shard), q, stop))
+            t.daemon = True
+            t.start()
+            iters.append(_drain(q))
+        if key is None:
+            merged = chain.from_iterable(iters)
+        else:
+            merged = heapq.merge(*iters, key=key, reverse=reverse)
+        try:
+            for row in merged:
+                yield row
+        finally:
+            # stops the producers if we got abandoned part way through
+            stop.set()
+
+    def __iter__(self):
+        """
+        returns keys of items in bag, sorted by key
+        """
+        return self._fanout(iter, key=lambda k: k)
+
+    def by_created(self, desc=False):
+        """
+        returns key,value from bag in date order
+        """
+        order = 'desc' if desc else 'asc'
+        def rows(shard):
+            cur = shard._db.cursor()
+            cur.execute(
+                '''select keyf, data, json, bz2, ver, ts
+                    from {tbl} order by ts {o}'''.format(
+                        tbl=shard._table, o=order
+                        )
+                )
+            for d in cur:
+                yield d['ts'], d['keyf'], shard._data(d)
+        merged = self._fanout(rows, key=lambda r: r[0], reverse=desc)
+        return ( (k, v) for _, k, v in merged )
+
+
+class ShardedDictBag(ShardedDataBag):
+    """
+    DictBag flavor of ShardedDataBag.  indexes live on every shard and finds
+    fan out to all of them.
+    """
+
+    _shard_cls = _DictShard
+
+    def ensure_index(self, index):
+        for s in self._shards:
+            s.ensure_index(index)
+
+    def ensure_text_index(self, fields):
+        """ text matches come back ranked within each shard, not overall """
+        for s in self._shards:
+            s.ensure_text_index(fields)
+
+    def ensure_spatial_index(self, fields):
+        for s in self._shards:
+            s.ensure_spatial_index(fields)
+
+    def nearest(self, fields, point, n=10):
+        """ same as DictBag.nearest, the closest `n` from every shard """
+        found = []
+        for s in self._shards:
+            found.extend(s.nearest(fields, point, n))
+        return heapq.nsmallest(n, found, key=lambda r: r[2])
+
+    def reindex(self):
+        for s in self._shards:
+            s.reindex()
+
+    def find(self, *qdicts, **kwa):
+        """ same as DictBag.find, across every shard """
+        # bad queries should raise here, like DictBag.find, not on first next
+        self._shards[0].find(*qdicts, **kwa)
+        return self._fanout(lambda s: s.find(*qdicts, **kwa))
+
+    def find_one(self, *a, **ka):
+        try:
+            return next(self.find(*a, **ka))
+        except StopIteration:
+            return None, None
+
+
+def reshard(table, src, dest, indexes=None, batch=1000):
+    """
+    copies bag `table` from shard files `src` onto shard files `dest`,
+    which may be a different number of them.  every row moves with its
+    version and timestamp, and open_writer values with their chunks.  rows
+    packed with a trained zdict are recompressed without it, since each file
+    numbers its dictionaries on its own; `train_zdict` the new shards to get
+    that back.  with `indexes`, the destination is treated as a
+    ShardedDictBag and those indexes get built once the rows are in.
+    returns the number of rows copied.
+
+    the destination files must be new to this bag and can't overlap `src`.
+    nothing should be writing to the source while this runs.
+    """
+    if set(src) & set(dest):
+        raise ValueError('source and destination shards overlap')
+    cls = ShardedDataBag if indexes is None else ShardedDictBag
+    target = cls(table, dest)
+    for s in target._shards:
+        cur = s._db.cursor()
+        cur.execute('''select 1 from {tbl} limit 1'''.format(tbl=table))
+        if cur.fetchone():
+            raise ValueError('destination shards already hold this bag')
+
+    n = 0
+    for fpath in src:
+        source = DataBag(table, fpath)
+        cur = source._db.cursor()
+        cur.execute(
+            '''select keyf, data, ts, json, bz2, ver from {tbl}'''.format(
+                tbl=table
+            ) )
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows: break
+            per_shard = {}
+            for r in rows:
+                shard = target._shard(r['keyf'])
+                shard_rows, chunks = per_shard.setdefault(shard, ([], []))
+                r = list(r)
+                if r[4] == ZDICT:
+                    # dictionary versions are per file and would clash
+                    r[1], _, r[4] = shard._pack(source._text(
+                        {'data': r[1], 'bz2': ZDICT}
+                        ))
+                elif r[4] == CHUNKED:
+                    # the pieces go along with the row pointing at them
+                    chunks.extend(source._db.execute(
+                        '''select blob, n, data from {tbl}_chunks
+                            where blob=?'''.format(tbl=table),
+                        (r[1],)
+                        ))
+                shard_rows.append(r)
+            for shard, (shard_rows, chunks) in per_shard.items():
+                with shard.transaction():
+                    shard._db.executemany(
+                        '''insert into {tbl} (keyf, data, ts, json, bz2, ver)
+                            values (?, ?, ?, ?, ?, ?)'''.format(tbl=table),
+                        shard_rows
+                        )
+                    shard._db.executemany(
+                        '''insert into {tbl}_chunks (blob, n, data)
+                            values (?, ?, ?)'''.format(tbl=table),
+                        [ tuple(c) for c in chunks ]
+                        )
+            n += len(rows)
+
+    # new index tables fill themselves from the rows already copied
+    for index in indexes or ():
+        target.ensure_index(index)
+    return n
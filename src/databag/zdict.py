@@ -0,0 +1,55 @@
+
+import re
+import struct
+import zlib
+from collections import Counter
+
+
+# a zdict payload is the dictionary version it was packed with followed by
+# a raw deflate stream (no zlib header or checksum, they'd eat the savings)
+HEADER = struct.Struct('>I')
+
+# zlib only looks back 32k, anything past that in a dictionary is dead weight
+MAX_SIZE = 32 * 1024
+
+# json keys with their colon, strings and numbers.  good enough pieces to
+# build a dictionary of things that repeat between documents.
+TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"\s*:?\s*|-?\d+(?:\.\d+)?|true|false|null')
+
+
+def train(samples, size=16 * 1024):
+    """
+    builds a preset dictionary out of `samples`, an iterable of serialized
+    documents.  tokens are scored by how many bytes they'd save (count *
+    length) and the best ones go at the end, since deflate reaches those
+    with the shortest distances.
+    """
+    size = min(size, MAX_SIZE)
+    counts = Counter()
+    for text in samples:
+        counts.update(TOKENS.findall(text))
+    scored = sorted(
+        ( (n * len(t), t) for t,n in counts.items() if n > 1 ),
+        reverse=True
+        )
+    picked, used = [], 0
+    for _, t in scored:
+        b = t.encode()
+        if used + len(b) > size: continue
+        picked.append(b)
+        used += len(b)
+    return b''.join(reversed(picked))
+
+
+def pack(text, ver, zdict, level=9):
+    c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    return HEADER.pack(ver) + c.compress(text.encode()) + c.flush()
+
+
+def version(payload):
+    return HEADER.unpack_from(payload)[0]
+
+
+def unpack(payload, zdict):
+    d = zlib.decompressobj(-15, zdict=zdict)
+    return (d.decompress(payload[HEADER.size:]) + d.flush()).decode()
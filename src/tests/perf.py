@@ -1,46 +1,259 @@
 #!/usr/bin/env python
 
-# incredibly stupid script to measure performance issues.
-# databag isn't intended for massive performance, so this doesn't tell us much.
+# benchmark harness for databag.
+#
+#   python src/tests/perf.py                          # in memory, defaults
+#   python src/tests/perf.py perfdb.sqlite3 --sizes 1000,10000 --shape nested
+#   python src/tests/perf.py --json now.json --baseline before.json
+#
+# every benchmark builds a fresh bag of `size` documents of the chosen shape,
+# runs `--warmup` untimed operations, then times `--ops` operations one at a
+# time and reports percentile latencies in microseconds.  with --baseline,
+# any benchmark whose p50 got more than --tolerance slower than the saved
+# run is flagged and the exit status is 1.
 
-from time import time
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter
 
-from databag import DataBag
+from databag import DataBag, DictBag, FrozenBag, MirrorBag, Q
+from databag.orm import Model, IntField, StrField
 
 
-def saves(name, dbag, iters=1000, keynames=True):
-    print(f"test: {name}  keynames={keynames} ... iters={iters} ")
-    k = 'xyz{}'
-    i = 1000
-    endi = i + iters
-    start = time()
-    while i < endi:
-        if keynames:
-            dbag[k.format(i)] = 'letters and numbers' + str(i)
-        else:
-            dbag.add('letters and numbers')
-        i += 1
-    etime = time() - start
-    print(f"  - total:{etime}s  per100:{etime/iters*100}")
+LOREM = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua '
+    )
 
 
-def main(fpath):
-    saves('non-versioned no keys',
-        DataBag('perfy', fpath, versioned=False), 1000, False)
-    saves('non-versioned no keys',
-        DataBag('perfy', fpath, versioned=False), 10000, False)
-    saves('non-versioned', DataBag('perfy', fpath, versioned=False), 1000)
-    saves('non-versioned', DataBag('perfy', fpath, versioned=False), 10000)
-    saves('versioned', DataBag('perfy', fpath, versioned=True), 1000)
-    saves('versioned', DataBag('perfy', fpath, versioned=True), 10000)
+SHAPES = {
+    'small': lambda i: {'n': i, 'name': 'user{}'.format(i), 'tag': 'abc'},
+    'medium': lambda i: {
+        'n': i, 'name': 'user{}'.format(i), 'tag': 'abc',
+        'bio': LOREM * 4, 'score': i * 0.5,
+        },
+    'nested': lambda i: {
+        'n': i, 'name': 'user{}'.format(i),
+        'profile': {
+            'email': 'user{}@example.com'.format(i),
+            'addr': {'city': 'austin', 'zip': 78700 + i % 100},
+            },
+        'tags': ['a', 'b', 'c{}'.format(i % 10)],
+        },
+    }
 
 
-if __name__ == '__main__':
+class Thing(Model):
+    name = StrField()
+    n = IntField()
+
+
+class Env(object):
+    """ what a benchmark gets handed to build its bag """
+
+    def __init__(self, fpath, size, shape, tmpdir):
+        self.fpath = fpath
+        self.size = size
+        self.doc = SHAPES[shape]
+        self.tmpdir = tmpdir
+        self._tables = 0
+
+    def table(self):
+        # a fresh table per benchmark so file based runs don't pile up
+        self._tables += 1
+        return 'bench{}'.format(self._tables)
+
+    def fill(self, bag):
+        with bag.transaction():
+            for i in range(self.size):
+                bag['k{}'.format(i)] = self.doc(i)
+        return bag
+
+
+# each benchmark takes an Env and returns a function of the op number. the
+# harness calls that function once per timed op.
+
+def bench_set(env):
+    bag = DataBag(env.table(), env.fpath)
+    return lambda i: bag.__setitem__('k{}'.format(i), env.doc(i))
+
+def bench_get(env):
+    bag = env.fill(DataBag(env.table(), env.fpath))
+    return lambda i: bag.get('k{}'.format(i % env.size))
+
+def bench_get_miss(env):
+    bag = env.fill(DataBag(env.table(), env.fpath))
+    return lambda i: bag.get('nope{}'.format(i))
+
+def _versioned(history):
+    def bench(env):
+        bag = DataBag(env.table(), env.fpath, versioned=True, history=history)
+        env.fill(bag)
+        # every key already carries a full history
+        for _ in range(history):
+            env.fill(bag)
+        return lambda i: bag.__setitem__('k{}'.format(i % env.size), env.doc(i))
+    return bench
+
+def bench_find_indexed(env):
+    bag = env.fill(DictBag(env.table(), env.fpath, indexes=[('n',)]))
+    return lambda i: list(bag.find(Q('n') == i % env.size))
+
+def bench_find_scan(env):
+    bag = env.fill(DictBag(env.table(), env.fpath))
+    return lambda i: list(bag.find(Q('n') == i % env.size))
+
+def bench_by_created(env):
+    bag = env.fill(DataBag(env.table(), env.fpath))
+    return lambda i: sum(1 for _ in bag.by_created())
+
+def bench_snapshot_get(env):
+    bag = env.fill(DataBag(env.table(), env.fpath))
+    snap = os.path.join(env.tmpdir, bag._table + '.snap')
+    bag.export_snapshot(snap)
+    frozen = FrozenBag(snap)
+    return lambda i: frozen.get('k{}'.format(i % env.size))
+
+def bench_mirror_set(env):
+    # flushes inline every flush_dirty writes, so the cost shows up here
+    bag = MirrorBag(env.table(), env.fpath, flush_interval=None)
+    return lambda i: bag.__setitem__('k{}'.format(i), env.doc(i))
 
-    import sys
-    if len(sys.argv) != 2:
-        raise SystemExit
+def bench_mirror_get(env):
+    bag = env.fill(MirrorBag(env.table(), env.fpath, flush_interval=None))
+    return lambda i: bag.get('k{}'.format(i % env.size))
 
-    main(sys.argv[1])
+def bench_orm_save(env):
+    Thing.set_db(DictBag(env.table(), env.fpath))
+    return lambda i: Thing(name='thing{}'.format(i), n=i).save()
 
+def bench_orm_load(env):
+    Thing.set_db(DictBag(env.table(), env.fpath))
+    keys = [ Thing(name='thing{}'.format(i), n=i).save().key
+        for i in range(env.size) ]
+    return lambda i: Thing.grab(keys[i % env.size])
 
+def bench_orm_hydrate(env):
+    docs = [ Thing(name='thing{}'.format(i), n=i).to_d()
+        for i in range(env.size) ]
+    return lambda i: Thing.from_d(docs[i % env.size])
+
+
+BENCHMARKS = [
+    ('set', bench_set),
+    ('get', bench_get),
+    ('get_miss', bench_get_miss),
+    ('set_versioned_h1', _versioned(1)),
+    ('set_versioned_h10', _versioned(10)),
+    ('set_versioned_h50', _versioned(50)),
+    ('find_indexed', bench_find_indexed),
+    ('find_scan', bench_find_scan),
+    ('by_created', bench_by_created),
+    ('snapshot_get', bench_snapshot_get),
+    ('mirror_set', bench_mirror_set),
+    ('mirror_get', bench_mirror_get),
+    ('orm_save', bench_orm_save),
+    ('orm_load', bench_orm_load),
+    ('orm_hydrate', bench_orm_hydrate),
+    ]
+
+# full scans get fewer ops, they're per bag rather than per document
+SCANS = {'find_scan', 'by_created'}
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered)-1))))]
+
+
+def run(fn, env, warmup, ops):
+    op = fn(env)
+    for i in range(warmup):
+        op(i)
+    timings = []
+    for i in range(warmup, warmup + ops):
+        start = perf_counter()
+        op(i)
+        timings.append((perf_counter() - start) * 1e6)
+    timings.sort()
+    return {
+        'ops': ops,
+        'mean': sum(timings) / ops,
+        'min': timings[0],
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'max': timings[-1],
+        }
+
+
+def compare(results, baseline, tolerance):
+    """ returns a list of (name, baseline p50, current p50) regressions """
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b and r['p50'] > b['p50'] * (1 + tolerance):
+            regressions.append((name, b['p50'], r['p50']))
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='databag benchmarks')
+    p.add_argument('fpath', nargs='?', default=':memory:',
+        help='sqlite file to run against, :memory: by default')
+    p.add_argument('--sizes', default='1000',
+        help='comma separated dataset sizes')
+    p.add_argument('--shape', choices=sorted(SHAPES), default='small')
+    p.add_argument('--ops', type=int, default=1000, help='timed ops per bench')
+    p.add_argument('--scan-ops', type=int, default=20,
+        help='timed ops for full scan benches')
+    p.add_argument('--warmup', type=int, default=100)
+    p.add_argument('--only', help='comma separated benchmark names')
+    p.add_argument('--json', help='write results here')
+    p.add_argument('--baseline', help='compare against results saved earlier')
+    p.add_argument('--tolerance', type=float, default=0.2,
+        help='allowed p50 slowdown vs baseline, 0.2 is 20%%')
+    args = p.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in [ int(s) for s in args.sizes.split(',') ]:
+            env = Env(args.fpath, size, args.shape, tmpdir)
+            for name, fn in BENCHMARKS:
+                if only and name not in only: continue
+                scan = name in SCANS
+                r = run(
+                    fn, env,
+                    min(args.warmup, args.scan_ops) if scan else args.warmup,
+                    args.scan_ops if scan else args.ops,
+                    )
+                label = '{}/{}/{}'.format(name, args.shape, size)
+                results[label] = r
+                print('{:<36} p50:{:>10.1f}us  p90:{:>10.1f}us  '
+                    'p99:{:>10.1f}us'.format(label, r['p50'], r['p90'], r['p99']))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'fpath': args.fpath,
+                'results': results,
+                }, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, was, now in regressions:
+            print('REGRESSION {}: p50 {:.1f}us -> {:.1f}us'.format(name, was, now))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+
+import os
+import tempfile
+import unittest
+
+from databag import DataBag, FrozenBag
+
+
+class TestBlobs(unittest.TestCase):
+
+    def setUp(self):
+        self.dbag = DataBag('dbag')
+        self.payload = os.urandom(300000)
+
+    def write(self, key, chunk_size=1024):
+        with self.dbag.open_writer(key, chunk_size, compresslevel=1) as fp:
+            for i in range(0, len(self.payload), 3000):
+                fp.write(self.payload[i:i+3000])
+        return fp
+
+    def chunks(self):
+        cur = self.dbag._db.cursor()
+        cur.execute('select count(1) from dbag_chunks')
+        return cur.fetchone()[0]
+
+    def test_roundtrip(self):
+        fp = self.write('big')
+        self.assertEqual(len(self.payload), fp.size)
+        self.assertGreater(self.chunks(), 1)
+        with self.dbag.open_reader('big') as fp:
+            self.assertEqual(self.payload[:10], fp.read(10))
+            self.assertEqual(self.payload[10:], fp.read())
+        self.assertEqual(self.payload, self.dbag['big'])
+
+    def test_invisible_until_closed(self):
+        fp = self.dbag.open_writer('big')
+        fp.write(b'abc')
+        self.assertNotIn('big', self.dbag)
+        fp.close()
+        self.assertEqual(b'abc', self.dbag['big'])
+
+    def test_abort(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.dbag.open_writer('big') as fp:
+                fp.write(b'abc')
+                1/0
+        self.assertNotIn('big', self.dbag)
+        self.assertEqual(0, self.chunks())
+
+    def test_overwrite_and_delete_clean_up(self):
+        self.write('big')
+        self.write('big')
+        self.dbag['small'] = 'x'
+        with self.dbag.open_reader('big') as fp:
+            self.assertEqual(self.payload, fp.read())
+        n = self.chunks()
+        self.dbag['big'] = 'not a blob anymore'
+        self.assertEqual(0, self.chunks())
+        self.write('big')
+        self.assertEqual(n, self.chunks())
+        del self.dbag['big']
+        self.assertEqual(0, self.chunks())
+
+    def test_versions(self):
+        d_v = DataBag('dbag', versioned=True, history=1)
+        for v in (b'one', b'two', b'three'):
+            with d_v.open_writer('big') as fp: fp.write(v)
+        self.assertEqual(b'three', d_v['big'])
+        self.assertEqual(b'two', d_v.open_reader('big', version=-1).read())
+        cur = d_v._db.cursor()
+        cur.execute('select count(1) from dbag_chunks')
+        self.assertEqual(2, cur.fetchone()[0])
+
+    def test_reader_on_plain_values(self):
+        self.dbag['s'] = 'blip'
+        self.dbag['d'] = {'x': 'y' * 100}
+        self.assertEqual(b'blip', self.dbag.open_reader('s').read())
+        self.assertEqual(
+            b'{"x": "' + b'y' * 100 + b'"}', self.dbag.open_reader('d').read()
+            )
+        with self.assertRaises(KeyError): self.dbag.open_reader('nope')
+
+    def test_snapshot(self):
+        self.write('big')
+        fd, fpath = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.dbag.export_snapshot(fpath)
+            with FrozenBag(fpath) as frozen:
+                self.assertEqual(self.payload, frozen['big'])
+        finally:
+            os.remove(fpath)
+
+    def test_stats(self):
+        self.write('big')
+        chunked = self.dbag.stats()['payload']['chunked']
+        self.assertEqual(1, chunked['rows'])
+        self.assertGreater(chunked['bytes'], 1024)
@@ -0,0 +1,126 @@
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from databag import CacheBag
+
+
+class TestCacheBag(unittest.TestCase):
+
+    def test_needs_a_limit(self):
+        with self.assertRaises(ValueError): CacheBag('cache')
+        with self.assertRaises(ValueError):
+            CacheBag('cache', max_items=2, policy='nope')
+
+    def test_max_items_lru(self):
+        cache = CacheBag('cache', max_items=2, flush_every=1)
+        cache['a'] = 'aaa'
+        cache['b'] = 'bbb'
+        cache['a'] # touch a, so b is now the oldest
+        cache['c'] = 'ccc'
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(1, cache.cache_info()['evictions'])
+
+    def test_max_items_lfu(self):
+        cache = CacheBag('cache', max_items=2, policy='lfu')
+        cache['a'] = 'aaa'
+        cache['b'] = 'bbb'
+        for _ in range(3): cache['b']
+        cache['a']
+        cache['c'] = 'ccc'
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        # the key being written is never its own victim
+        self.assertIn('c', cache)
+
+    def test_max_bytes(self):
+        cache = CacheBag('cache', max_bytes=10)
+        cache['a'] = 'x' * 6
+        cache['b'] = 'y' * 6
+        self.assertNotIn('a', cache)
+        self.assertEqual(6, cache.cache_info()['bytes'])
+        self.assertEqual(1, cache.cache_info()['items'])
+
+    def test_max_bytes_streamed(self):
+        cache = CacheBag('cache', max_bytes=1000)
+        cache['a'] = 'aaa'
+        with cache.open_writer('big') as fp: fp.write(os.urandom(20000))
+        self.assertGreater(cache.cache_info()['bytes'], 20000)
+        self.assertNotIn('a', cache)
+
+    def test_overwrite_keeps_count(self):
+        cache = CacheBag('cache', max_items=2)
+        cache['a'] = 'aaa'
+        cache['a'] = 'aaaa'
+        cache['b'] = 'bbb'
+        self.assertIn('a', cache)
+        self.assertEqual(2, cache.cache_info()['items'])
+
+    def test_counters(self):
+        cache = CacheBag('cache', max_items=10)
+        cache['a'] = 'aaa'
+        self.assertEqual('aaa', cache.get('a'))
+        self.assertIsNone(cache.get('nope'))
+        with self.assertRaises(KeyError): cache['nope']
+        info = cache.cache_info()
+        self.assertEqual(1, info['hits'])
+        self.assertEqual(2, info['misses'])
+
+    def test_reads_are_batched(self):
+        cache = CacheBag('cache', max_items=10, flush_every=5)
+        cache['a'] = 'aaa'
+        cache['a']
+        cur = cache._db.cursor()
+        sql = 'select hits from {} where keyf=?'.format(cache._access_table())
+        cur.execute(sql, ('a',))
+        self.assertEqual(1, cur.fetchone()['hits'])
+        cache.flush()
+        cur.execute(sql, ('a',))
+        self.assertEqual(2, cur.fetchone()['hits'])
+
+    def test_delitem(self):
+        cache = CacheBag('cache', max_items=10)
+        cache['a'] = 'aaa'
+        del cache['a']
+        self.assertNotIn('a', cache)
+        self.assertEqual(0, cache.cache_info()['items'])
+        with self.assertRaises(KeyError): del cache['a']
+
+    def test_reopen_keeps_totals(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            cache = CacheBag('cache', path, max_items=10)
+            cache['a'] = 'aaa'
+            again = CacheBag('cache', path, max_items=10)
+            self.assertEqual(1, again.cache_info()['items'])
+        finally:
+            os.remove(path)
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, 'backup'), 'python 3.7+')
+    def test_restore_resyncs_totals(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'cache.db')
+        bak = os.path.join(tmp.name, 'cache.bak')
+        cache = CacheBag('cache', path, max_items=100)
+        for k in 'abc': cache[k] = k * 3
+        cache.backup(bak)
+        for i in range(47): cache['k{}'.format(i)] = i
+        cache['a'] # a touch from before the restore
+        cache.restore(bak)
+        self.assertEqual(3, cache.cache_info()['items'])
+        self.assertEqual({}, cache._touched)
+
+    def test_evictions_hit_the_changelog(self):
+        cache = CacheBag('cache', max_items=1, changelog=True)
+        cache['a'] = 'aaa'
+        cache['b'] = 'bbb'
+        self.assertListEqual(
+            [(1, 'set', 'a'), (2, 'set', 'b'), (3, 'del', 'a')],
+            list(cache.changes())
+            )
@@ -0,0 +1,71 @@
+
+import json
+import os
+import tempfile
+import unittest
+
+from databag import DataBag, DictBag, Q, ShardedDataBag
+from databag.cli import main
+
+
+class TestCLI(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbpath = os.path.join(self.tmpdir.name, 'bag.db')
+        self.dump = os.path.join(self.tmpdir.name, 'dump.jsonl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_export_import(self):
+        bag = DictBag('people', self.dbpath)
+        bag['joe'] = {'name': 'joe', 'age': 23}
+        bag['sue'] = {'name': 'sue', 'age': 44}
+        main(['export', '--quiet', self.dbpath, 'people', self.dump])
+
+        other = os.path.join(self.tmpdir.name, 'other.db')
+        main(['import', '--quiet', '--index', 'age', other, 'people', self.dump])
+        again = DictBag('people', other, indexes=[('age',)])
+        self.assertEqual('sue', again.find_one(Q.age > 40)[0])
+        self.assertFalse(os.path.exists(self.dump + '.progress'))
+
+    def test_import_resume(self):
+        with open(self.dump, 'w') as fp:
+            for i in range(4):
+                fp.write(json.dumps({'key': 'k{}'.format(i), 'value': i}))
+                fp.write('\n')
+        with open(self.dump + '.progress', 'w') as fp:
+            json.dump(2, fp)
+        main(['import', '--quiet', '--resume', self.dbpath, 'b', self.dump])
+        self.assertListEqual(['k2', 'k3'], list(DataBag('b', self.dbpath)))
+
+    def test_export_resume(self):
+        bag = DataBag('b', self.dbpath)
+        for i in range(25): bag['k{:02d}'.format(i)] = i
+        main(['export', '--quiet', '--batch', '10', self.dbpath, 'b', self.dump])
+        with open(self.dump) as fp: lines = fp.readlines()
+        # killed at row 15, progress saved at row 10
+        with open(self.dump, 'w') as fp: fp.writelines(lines[:15])
+        with open(self.dump + '.progress', 'w') as fp:
+            json.dump(['k09', 10, len(''.join(lines[:10]))], fp)
+        main(['export', '--quiet', '--resume', '--batch', '10', self.dbpath,
+            'b', self.dump])
+        with open(self.dump) as fp: self.assertEqual(lines, fp.readlines())
+        self.assertFalse(os.path.exists(self.dump + '.progress'))
+
+    def test_csv(self):
+        bag = DataBag('b', self.dbpath)
+        bag['a'] = [1, 2]
+        dump = os.path.join(self.tmpdir.name, 'dump.csv')
+        main(['export', '--quiet', '--format', 'csv', self.dbpath, 'b', dump])
+        main(['import', '--quiet', '--format', 'csv', self.dbpath, 'c', dump])
+        self.assertEqual([1, 2], DataBag('c', self.dbpath)['a'])
+
+    def test_reshard(self):
+        src = [ os.path.join(self.tmpdir.name, 'a{}.db'.format(i)) for i in range(2) ]
+        dest = [ os.path.join(self.tmpdir.name, 'b{}.db'.format(i)) for i in range(3) ]
+        bag = ShardedDataBag('b', src)
+        for i in range(10): bag.add(i)
+        main(['reshard', '--quiet', 'b', '--from'] + src + ['--to'] + dest)
+        self.assertListEqual(list(bag), list(ShardedDataBag('b', dest)))
@@ -0,0 +1,95 @@
+
+import os
+import tempfile
+import unittest
+
+from databag import CacheBag, Database, DataBag, DictBag, Q
+from databag.orm import IntField, Model, Session, StrField, set_database
+
+
+class Counted(DataBag):
+    ensured = 0
+
+    def _ensure_table(self):
+        Counted.ensured += 1
+        super(Counted, self)._ensure_table()
+
+
+class Team(Model):
+    name = StrField()
+
+
+class Player(Model):
+    name = StrField()
+    num = IntField(index=True)
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+        self.db = Database(
+            self.path, cache_size=4096, pragmas={'journal_mode': 'wal'}
+            )
+
+    def test_pragmas(self):
+        pragma = lambda n: self.db._db.execute('pragma ' + n).fetchone()[0]
+        self.assertEqual(-4096, pragma('cache_size'))
+        self.assertEqual('wal', pragma('journal_mode'))
+
+    def test_shared(self):
+        a = self.db.bag('a')
+        b = self.db.bag('b', DictBag, indexes=[('n',)])
+        self.assertIs(a._db, b._db)
+        self.assertIs(a, self.db.bag('a'))
+        with self.assertRaises(ValueError):
+            self.db.bag('a', DictBag)
+        b['x'] = {'n': 1}
+        self.assertEqual('x', b.find_one(n=1)[0])
+
+    def test_transaction(self):
+        a = self.db.bag('a')
+        b = self.db.bag('b', CacheBag, max_items=10)
+        with self.db.transaction():
+            a['k'] = 1
+            with b.transaction():
+                b['k'] = 2
+            # b's block was nested, nothing's committed yet
+            self.assertTrue(self.db._db.in_transaction)
+        self.assertFalse(self.db._db.in_transaction)
+
+        with self.assertRaises(RuntimeError):
+            with a.transaction():
+                a['k'] = 10
+                b['k'] = 20
+                raise RuntimeError
+        self.assertEqual(1, a['k'])
+        self.assertEqual(2, b['k'])
+
+    def test_ensure_once(self):
+        Counted.ensured = 0
+        Counted('c', database=self.db)
+        Counted('c', database=self.db)
+        self.assertEqual(1, Counted.ensured)
+        # on its own connection it checks as usual
+        Counted('c', self.path)
+        self.assertEqual(2, Counted.ensured)
+
+    def test_orm(self):
+        set_database(self.db)
+        self.assertIs(Team._db()._db, Player._db()._db)
+        self.assertIn(('num',), Player._db()._indexes)
+        with self.assertRaises(RuntimeError):
+            with Session() as s:
+                s.add(Team(name='bears'))
+                s.add(Player(name='joe', num=3))
+                s.flush()
+                s.grab(Team, next(iter(Team._db()))).name = 'cubs'
+                s.add(Player(name='sue', num=4))
+                # half of this unit of work is already flushed, the rest
+                # goes down together
+                with self.db.transaction():
+                    s.flush()
+                    raise RuntimeError
+        self.assertEqual(['bears'], [ t.name for _,t in Team.iter() ])
+        self.assertEqual(['joe'], [ p.name for _,p in Player.iter() ])
@@ -1,8 +1,12 @@
 
+import io
+import json
 import operator
+import os
 import sqlite3
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from random import shuffle
 from string import ascii_letters as letters
 
@@ -52,6 +56,16 @@ class TestDataBag(unittest.TestCase):
         for x in range(1,10):
             d_v[key] = 'again'*x
 
+    def test_get_set_many(self):
+        self.assertEqual(3, self.dbag.set_many({'a': 1, 'b': [2], 'c': 'x'}))
+        self.dbag.set_many([('d', 4)])
+        self.assertEqual(
+            {'a': 1, 'c': 'x', 'd': 4}, self.dbag.get_many(['a', 'c', 'd', 'z'])
+            )
+        self.assertEqual(
+            {'b': [2]}, self.dbag.get_many(['b'], batch=1)
+            )
+
     def test_add_no_key(self):
         val = 'jabberwocky'
         k = self.dbag.add(val)
@@ -141,6 +155,378 @@ class TestDataBag(unittest.TestCase):
     def test_nondefault_tablename(self):
         self.assertTrue( DataBag(table='something', fpath=':memory:') )
 
+    def test_transaction(self):
+        with self.dbag.transaction():
+            self.dbag['a'] = 1
+            with self.dbag.transaction():
+                self.dbag['b'] = 2
+            self.assertTrue(self.dbag._db.in_transaction)
+        self.assertFalse(self.dbag._db.in_transaction)
+        self.assertEqual(2, self.dbag['b'])
+
+    def test_transaction_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.dbag.transaction():
+                self.dbag['a'] = 1
+                1/0
+        self.assertNotIn('a', self.dbag)
+
+    def test_jsonl_roundtrip(self):
+        self.dbag['b'] = 'blip'
+        self.dbag['a'] = {'x': [1, 2]}
+        out = io.StringIO()
+        seen = []
+        n = self.dbag.export_jsonl(out, batch=1, progress=lambda *a: seen.append(a))
+        self.assertEqual(2, n)
+        self.assertListEqual([(1, 'a'), (2, 'b')], seen)
+
+        other = DataBag('other')
+        out.seek(0)
+        self.assertEqual(2, other.import_jsonl(out))
+        self.assertEqual('blip', other['b'])
+        self.assertEqual({'x': [1, 2]}, other['a'])
+
+    def test_import_jsonl_generates_keys(self):
+        self.dbag.import_jsonl(io.StringIO('{"value": "nokey"}\n'))
+        self.assertListEqual(['nokey'], [v for k,v in self.dbag.by_created()])
+
+    def test_import_resume(self):
+        lines = ''.join(
+            '{{"key": "k{}", "value": {}}}\n'.format(i, i) for i in range(5)
+            )
+        seen = []
+        self.dbag.import_jsonl(io.StringIO(lines), batch=2, progress=seen.append)
+        self.assertListEqual([2, 4, 5], seen)
+
+        other = DataBag('other')
+        self.assertEqual(5, other.import_jsonl(io.StringIO(lines), skip=3))
+        self.assertListEqual(['k3', 'k4'], list(other))
+
+    def test_export_resume(self):
+        for k in 'abc': self.dbag[k] = k
+        out = io.StringIO()
+        self.dbag.export_jsonl(out, after='a')
+        self.assertEqual(2, len(out.getvalue().splitlines()))
+        # an empty key is still a key
+        self.dbag[''] = 'empty'
+        out = io.StringIO()
+        self.assertEqual(4, self.dbag.export_jsonl(out, batch=2))
+
+    def test_csv_roundtrip(self):
+        self.dbag['a'] = '123'
+        self.dbag['b'] = 123
+        out = io.StringIO()
+        self.dbag.export_csv(out)
+        other = DataBag('other')
+        out.seek(0)
+        self.assertEqual(2, other.import_csv(out))
+        self.assertEqual('123', other['a'])
+        self.assertEqual(123, other['b'])
+        # files from before the encoding column
+        old = DataBag('old')
+        old.import_csv(io.StringIO('key,value\na,"""x"""\n'))
+        self.assertEqual('x', old['a'])
+
+    def test_export_blobs(self):
+        big = os.urandom(3000)
+        with self.dbag.open_writer('big', chunk_size=512) as fp: fp.write(big)
+        self.dbag['small'] = 'blip'
+        for fmt in ('jsonl', 'csv'):
+            out = io.StringIO()
+            getattr(self.dbag, 'export_' + fmt)(out)
+            other = DataBag('other_' + fmt)
+            out.seek(0)
+            self.assertEqual(2, getattr(other, 'import_' + fmt)(out))
+            self.assertEqual(big, other['big'])
+            self.assertEqual('blip', other['small'])
+        with self.assertRaises(ValueError):
+            self.dbag.import_jsonl(
+                io.StringIO('{"key": "a", "value": "x", "encoding": "rot13"}\n')
+                )
+
+
+class TestChangelog(unittest.TestCase):
+
+    def setUp(self):
+        self.dbag = DataBag('dbag', changelog=True)
+
+    def test_no_changelog(self):
+        with self.assertRaises(ValueError): list(DataBag('x').changes())
+        self.assertEqual(0, DataBag('x').last_seq())
+
+    def test_changes(self):
+        self.dbag['a'] = 1
+        self.dbag['b'] = 2
+        del self.dbag['a']
+        self.assertListEqual(
+            [(1, 'set', 'a'), (2, 'set', 'b'), (3, 'del', 'a')],
+            list(self.dbag.changes())
+            )
+        self.assertListEqual(
+            [(3, 'del', 'a')], list(self.dbag.changes(since_seq=2))
+            )
+        self.assertEqual(3, self.dbag.last_seq())
+
+    def test_batches(self):
+        for i in range(7): self.dbag[str(i)] = i
+        self.assertEqual(7, len(list(self.dbag.changes(batch=2))))
+
+    def test_same_transaction(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.dbag.transaction():
+                self.dbag['a'] = 1
+                1/0
+        self.assertListEqual([], list(self.dbag.changes()))
+
+    def test_versioned_delete(self):
+        d_v = DataBag(versioned=True, changelog=True)
+        d_v['a'] = 1
+        d_v['a'] = 2
+        del d_v['a']
+        self.assertNotIn('a', d_v)
+        self.assertEqual('del', list(d_v.changes())[-1][1])
+
+    def test_retain(self):
+        d = DataBag('dbag', changelog_retain=2)
+        for i in range(5): d[str(i)] = i
+        self.assertListEqual([4, 5], [ s for s,_,_ in d.changes(since_seq=3) ])
+        with self.assertRaises(ValueError): list(d.changes())
+
+    def test_truncate(self):
+        for i in range(3): self.dbag[str(i)] = i
+        self.dbag.truncate_changes(3)
+        self.assertListEqual([], list(self.dbag.changes(since_seq=3)))
+        with self.assertRaises(ValueError): list(self.dbag.changes(since_seq=1))
+        self.dbag['x'] = 1
+        self.assertListEqual([(4, 'set', 'x')], list(self.dbag.changes(3)))
+
+    def test_dictbag(self):
+        d = DictBag('dbag', changelog=True)
+        k = d.add({'x': 1})
+        self.assertListEqual([(1, 'set', k)], list(d.changes()))
+
+
+class TestDeltaHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.dbag = DataBag('dbag', versioned=True, history=20, deltas=True,
+            max_chain=4)
+        self.docs = []
+        doc = {'n': 0, 'items': [ 'item {}'.format(i) for i in range(500) ]}
+        for n in range(15):
+            doc = dict(doc, n=n)
+            doc['items'] = doc['items'][:] + ['added {}'.format(n)]
+            doc['items'][n * 7] = 'changed {}'.format(n)
+            self.docs.append(doc)
+            self.dbag['doc'] = doc
+
+    def codecs(self):
+        cur = self.dbag._db.cursor()
+        cur.execute("select ver, bz2 from dbag where keyf='doc' order by ver desc")
+        return [ r['bz2'] for r in cur ]
+
+    def test_versions(self):
+        for n in range(15):
+            self.assertEqual(
+                self.docs[-1 - n], self.dbag.get('doc', version=-n)
+                )
+        with self.dbag.open_reader('doc', version=-3) as fp:
+            self.assertEqual(self.docs[-4]['n'], json.load(fp)['n'])
+
+    def test_chain_cap(self):
+        from databag.main import DELTA
+        codecs = self.codecs()
+        self.assertNotEqual(DELTA, codecs[0])
+        run = longest = 0
+        for c in codecs[1:]:
+            run = run + 1 if c == DELTA else 0
+            longest = max(run, longest)
+        self.assertEqual(4, longest)
+
+    def test_smaller(self):
+        plain = DataBag('dbag', versioned=True, history=20)
+        for doc in self.docs: plain['doc'] = doc
+        self.assertLess(
+            self.dbag.stats()['payload']['delta']['bytes'] * 3,
+            plain.stats()['payload']['compressed']['bytes']
+            )
+
+    def test_by_created(self):
+        # history rows come along in the scan, rebuilt from their deltas
+        found = [ v for k,v in self.dbag.by_created() ]
+        self.assertEqual(15, len(found))
+        self.assertEqual(
+            sorted(d['n'] for d in self.docs), sorted(d['n'] for d in found)
+            )
+
+    def test_history_trim(self):
+        d = DataBag('dbag', versioned=True, history=3, deltas=True)
+        for n in range(10):
+            d['k'] = {'n': n, 'pad': 'x' * 1000}
+        self.assertEqual(7, d.get('k', version=-2)['n'])
+        self.assertEqual(6, d.get('k', version=-3)['n'])
+        self.assertIsNone(d.get('k', version=-4))
+
+
+class TestEpochDatetimes(unittest.TestCase):
+
+    def setUp(self):
+        self.t0 = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.dbag = DictBag('dbag', datetimes='epoch', indexes=[('at',)])
+        for i in range(10):
+            self.dbag['k{}'.format(i)] = {
+                'n': i, 'at': self.t0 + timedelta(days=i)
+                }
+
+    def test_bad_option(self):
+        with self.assertRaises(ValueError):
+            DataBag('dbag', datetimes='nope')
+
+    def test_stored_as_epoch(self):
+        self.assertEqual(self.t0.timestamp(), self.dbag['k0']['at'])
+        cur = self.dbag._db.cursor()
+        cur.execute('select typeof(at) from idx_dbag_at limit 1')
+        self.assertEqual('real', cur.fetchone()[0])
+
+    def test_range(self):
+        q = (Q.at >= self.t0 + timedelta(days=3)) < self.t0 + timedelta(days=5)
+        self.assertEqual(
+            [3, 4], sorted(d['n'] for _,d in self.dbag.find(q))
+            )
+        # the caller's Q is left alone
+        self.assertIsInstance(q._ands[0][1], datetime)
+        # and without the index
+        self.assertEqual(
+            [8, 9],
+            sorted(d['n'] for _,d in self.dbag.find(
+                Q.at > self.t0 + timedelta(days=7), Q.n > 0
+                ))
+            )
+
+    def test_iso_strings(self):
+        self.dbag['s'] = {'at': '2021-06-01T12:30:00', 'n': 'x'}
+        self.dbag['t'] = {'day': '2021-06-01T12:30:00'}
+        # a field matches its own value, index or not
+        self.assertEqual(
+            ['s'], [ k for k,_ in self.dbag.find(at='2021-06-01T12:30:00') ]
+            )
+        self.assertEqual(
+            ['t'], [ k for k,_ in self.dbag.find(day='2021-06-01T12:30:00') ]
+            )
+
+    def test_legacy_iso(self):
+        old = DictBag('old')
+        old['a'] = {'at': self.t0}
+        old['b'] = {'at': self.t0 + timedelta(days=2)}
+        self.assertIsInstance(old['a']['at'], str)
+        # same file, switched over
+        new = DictBag('old', datetimes='epoch')
+        new._db = old._db
+        new.ensure_index(('at',))
+        found = new.find(Q.at > self.t0 + timedelta(days=1))
+        self.assertEqual(['b'], [ k for k,_ in found ])
+        self.assertEqual(
+            ['b'], [ k for k,_ in new._slow_search(
+                [new._epoch_q(Q.at > self.t0 + timedelta(days=1))]
+                ) ]
+            )
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.fpath = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.fpath) # start from an empty file
+        self.dbag = DictBag('dbag', self.fpath, indexes=[('x',)])
+
+    def tearDown(self):
+        os.remove(self.fpath)
+
+    def test_stats(self):
+        self.dbag['short'] = {'x': 1}
+        self.dbag['long'] = {'x': 2, 'text': 'blah ' * 100}
+        stats = self.dbag.stats()
+        self.assertEqual({'live': 2, 'historical': 0}, stats['rows'])
+        self.assertEqual(1, stats['payload']['raw']['rows'])
+        self.assertEqual(1, stats['payload']['compressed']['rows'])
+        self.assertGreater(stats['compression_ratio'], 1)
+        self.assertIn('idx_dbag_x', stats['tables'])
+        self.assertIn('idx_dataf_dbag', stats['tables'])
+        self.assertEqual(0, stats['file']['free_pages'])
+
+    def test_stats_own_tables_only(self):
+        other = DictBag('dbag_archive', self.fpath, indexes=[('y',)])
+        other['a'] = {'y': 1}
+        self.dbag['a'] = {'x': 1}
+        tables = self.dbag.stats()['tables']
+        self.assertIn('dbag', tables)
+        self.assertFalse([ t for t in tables if 'archive' in t ])
+        self.assertIn('idx_dbag_archive_y', other.stats()['tables'])
+
+    def test_stats_versions(self):
+        d_v = DataBag('versioned', self.fpath, versioned=True)
+        d_v['a'] = 'one'
+        d_v['a'] = 'two'
+        self.assertEqual(
+            {'live': 1, 'historical': 1}, d_v.stats()['rows']
+            )
+
+    def test_compact(self):
+        keys = [ self.dbag.add({'x': i, 'text': str(i) * 500})
+            for i in range(200) ]
+        for k in keys: del self.dbag[k]
+        free = self.dbag.stats()['file']['free_pages']
+        self.assertGreater(free, 10)
+        self.assertEqual(10, self.dbag.compact(pages=5, max_steps=2))
+        self.assertEqual(free - 10, self.dbag.compact())
+        self.assertEqual(0, self.dbag.stats()['file']['free_pages'])
+
+    def test_compact_needs_incremental(self):
+        self.dbag._db.execute('pragma auto_vacuum = none')
+        self.dbag._db.execute('vacuum')
+        with self.assertRaises(ValueError): self.dbag.compact()
+        self.dbag.compact(convert=True)
+        self.assertEqual(2, self.dbag._pragma('auto_vacuum'))
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, 'backup'), 'python 3.7+')
+    def test_backup_restore(self):
+        for i in range(100):
+            self.dbag['k{}'.format(i)] = {'x': i, 'text': str(i) * 100}
+        dest = self.fpath + '.bak'
+        self.addCleanup(os.remove, dest)
+        steps = []
+        self.dbag.backup(
+            dest, pages_per_step=2, progress=lambda n, t: steps.append((n, t))
+            )
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        self.assertFalse(os.path.exists(dest + '.tmp'))
+
+        # changes after the backup are undone by the restore
+        del self.dbag['k0']
+        self.dbag['new'] = {'x': 1000}
+        bag = DictBag('dbag', self.fpath, indexes=[('x',), ('y',)])
+        bag.restore(dest)
+        self.assertEqual({'x': 0, 'text': '0' * 100}, bag['k0'])
+        self.assertNotIn('new', bag)
+        self.assertEqual(['k99'], [ k for k,_ in bag.find(Q.x > 98) ])
+        self.assertEqual(1, bag._pragma('user_version'))
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, 'backup'), 'python 3.7+')
+    def test_restore_from_newer(self):
+        dest = self.fpath + '.bak'
+        self.addCleanup(os.remove, dest)
+        self.dbag.backup(dest)
+        db = sqlite3.connect(dest)
+        db.execute('pragma user_version = 99')
+        db.close()
+        with self.assertRaises(ValueError):
+            self.dbag.restore(dest)
+        with self.assertRaises(sqlite3.DatabaseError):
+            with open(dest, 'wb') as f: f.write(b'not a database' * 100)
+            self.dbag.restore(dest)
+
 
 class TestDictBag(unittest.TestCase):
 
@@ -192,6 +578,221 @@ class TestDictBag(unittest.TestCase):
             )
         self.assertEqual( 1, cur.fetchone()['cnt'] )
 
+    def test_shape_cache(self):
+        for i in range(5):
+            self.dbag.add({'name': 'n{}'.format(i), 'age': i})
+        found = lambda *a, **ka: sorted(
+            d['age'] for _,d in self.dbag.find(*a, **ka)
+            )
+        self.assertEqual([3, 4], found(Q.age > 2, Q.name != 'x'))
+        self.assertEqual(1, len(self.dbag._shapes))
+        plan = next(iter(self.dbag._shapes.values()))
+        # same shape, different values, same plan
+        self.assertEqual([1, 2, 3, 4], found(Q.age > 0, Q.name != 'y'))
+        self.assertEqual(1, len(self.dbag._shapes))
+        self.assertIs(plan, next(iter(self.dbag._shapes.values())))
+        # no index covers this, still remembered as a scan
+        self.assertEqual([], found(xx=1, age=2))
+        self.assertEqual((None, None, None), list(self.dbag._shapes.values())[-1])
+        self.dbag.ensure_index(('xx',))
+        self.assertEqual({}, self.dbag._shapes)
+
+    def test_shape_cache_bounded(self):
+        d = DictBag('bounded', indexes=[('n',)], shape_cache=2)
+        d.add({'n': 1})
+        for q in (Q.n > 0, Q.n < 5, Q.n >= 1):
+            self.assertEqual(1, len(list(d.find(q))))
+        self.assertEqual(2, len(d._shapes))
+
+    def test_keys_only(self):
+        k1 = self.dbag.add({'name': 'joe', 'age': 5, 'tag': 'a'})
+        k2 = self.dbag.add({'name': 'sue', 'age': 7})
+        # indexed, scanned and unfiltered
+        self.assertEqual([k2], list(self.dbag.find(Q.age > 6, keys_only=True)))
+        self.assertEqual([k1], list(self.dbag.find(tag='a', keys_only=True)))
+        self.assertEqual({k1, k2}, set(self.dbag.find(keys_only=True)))
+
+    def test_lazy(self):
+        self.dbag.add({'name': 'joe', 'age': 5})
+        self.dbag.add({'name': 'sue', 'age': 7})
+        docs = [ d for _,d in self.dbag.find(Q.age > 0, lazy=True) ]
+        self.assertEqual(2, len(docs))
+        self.assertFalse(any(d.loaded for d in docs))
+        self.assertEqual({5, 7}, { d['age'] for d in docs })
+        self.assertTrue(all(d.loaded for d in docs))
+        _, d = next(self.dbag.by_created(lazy=True))
+        self.assertFalse(d.loaded)
+        self.assertEqual({'name': 'joe', 'age': 5}, dict(d))
+        self.assertEqual('sue', next(self.dbag.find(lazy=True))[1].get('name'))
+
+    def test_ensure_index_backfills(self):
+        self.dbag.add({'name': 'joe', 'xx': 1})
+        self.dbag.add({'name': 'sue'})
+        self.dbag.ensure_index(('xx',))
+        cur = self.dbag._db.cursor()
+        cur.execute('select keyf, xx from idx_testdbag_xx')
+        self.assertEqual([1], [ r['xx'] for r in cur ])
+        self.assertEqual(
+            'joe', self.dbag.find_one(Q.xx == 1)[1]['name']
+            )
+
+    def test_multikey(self):
+        k1 = self.dbag.add({'tags': ['red', 'blue', 'red'], 'n': 1})
+        k2 = self.dbag.add({'tags': ['blue', 'green'], 'n': 2})
+        k3 = self.dbag.add({'tags': 'red', 'n': 3})
+        self.dbag.add({'tags': [], 'n': 4})
+        k5 = self.dbag.add({'nums': [1, 10], 'n': 5})
+        queries = [
+            ([Q.tags.contains('red')], {k1, k3}),
+            ([{'tags': {'$contains': 'blue'}}], {k1, k2}),
+            ([Q.tags.all(['red', 'blue'])], {k1}),
+            ([{'tags': {'$all': ['blue', 'green']}}, Q.n > 1], {k2}),
+            ([Q.tags > 'c'], {k1, k2, k3}),
+            ([Q.tags.contains('red'), Q.n >= 2], {k3}),
+            # containing 1 and having an element over 3 needn't be one element
+            ([Q.nums.contains(1), Q.nums > 3], {k5}),
+            ([Q.nums.contains(1) < 5, Q.nums.contains(10)], {k5}),
+            ([Q.nums.contains(1), Q.nums > 30], set()),
+            # ranges on a field are met by one element, however they're given
+            ([{'nums': {'$gt': 2, '$lt': 5}}], set()),
+            ([Q('nums') > 2, Q('nums') < 5], set()),
+            ([Q('nums') > 2, Q('nums') < 50], {k5}),
+            ]
+        found = lambda *a: list(self.dbag.find(*a, keys_only=True))
+        for q, want in queries:
+            scanned = found(*q)
+            self.assertEqual(want, set(scanned))
+            self.assertEqual(len(want), len(scanned))
+        self.dbag.ensure_index(('tags',))
+        self.dbag.ensure_index(('n', 'tags'))
+        self.dbag.ensure_index(('nums',))
+        cur = self.dbag._db.cursor()
+        cur.execute('select count(1) from idx_testdbag_tags where keyf=?', (k1,))
+        self.assertEqual(3, cur.fetchone()[0])
+        for q, want in queries:
+            # same answers off the index, each document once
+            indexed = found(*q)
+            self.assertEqual(want, set(indexed))
+            self.assertEqual(len(want), len(indexed))
+        self.assertEqual(
+            ' "x" = ? and "x" > ? ', (Q.x.contains(1) > 0).query()[0]
+            )
+
+    def test_dotted_paths(self):
+        k1 = self.dbag.add({'profile': {'city': 'austin', 'age': 30},
+            'items': [{'sku': 'a1'}, {'sku': 'b2'}]})
+        k2 = self.dbag.add({'profile': {'city': 'boston', 'age': 40},
+            'items': [{'sku': 'b2'}]})
+        k3 = self.dbag.add({'profile': 'none', 'a.b': 1})
+        queries = [
+            ([Q('profile.city') == 'austin'], {k1}),
+            ([{'profile.age': {'$gt': 35}}], {k2}),
+            ([Q.profile.city != 'austin', Q.profile.age < 50], {k2}),
+            ([Q('items.sku').contains('b2')], {k1, k2}),
+            ([Q('a.b') == 1], {k3}),
+            ]
+        found = lambda *a: set(self.dbag.find(*a, keys_only=True))
+        for q, want in queries:
+            self.assertEqual(want, found(*q))
+        self.dbag.ensure_index(('profile.age', 'profile.city'))
+        self.dbag.ensure_index(('items.sku',))
+        self.dbag.ensure_index(('a.b',))
+        self.assertEqual(
+            'idx_testdbag_profile__age_profile__city',
+            self.dbag._make_index_name(('profile.city', 'profile.age'))
+            )
+        for q, want in queries:
+            self.assertEqual(want, found(*q))
+        # and every one of those went through an index
+        self.assertTrue(all( p[0] for p in self.dbag._shapes.values() ))
+
+    def test_text_index(self):
+        with self.assertRaises(ValueError):
+            self.dbag.find(Q.search('fox'))
+        k1 = self.dbag.add({'title': 'the quick brown fox', 'n': 1,
+            'meta': {'tags': ['red', 'fast']}})
+        k2 = self.dbag.add({'title': 'fox fox fox', 'n': 2})
+        k3 = self.dbag.add({'title': 'a lazy dog', 'n': 3})
+        self.dbag.ensure_text_index(('title', 'meta.tags'))
+        found = lambda *a: list(self.dbag.find(*a, keys_only=True))
+        # best match first
+        self.assertEqual([k2, k1], found(Q.search('fox')))
+        self.assertEqual([k1], found({'$text': 'quick fox'}))
+        self.assertEqual([k1], found({'$text': {'$search': 'fast'}}))
+        self.assertEqual([k1], found(Q.search('fox'), Q.search('brown')))
+        # other filters, scanned and then indexed
+        self.assertEqual([k1], found(Q.search('fox'), Q.n < 2))
+        self.dbag.ensure_index(('n',))
+        self.assertEqual([k1], found(Q.search('fox'), Q.n < 2))
+        self.assertEqual(
+            {'title': 'fox fox fox', 'n': 2},
+            next(self.dbag.find(Q.search('fox'), n=2))[1]
+            )
+        # kept up to date
+        self.dbag[k2] = {'title': 'no more', 'n': 2}
+        self.dbag.set_many([(k3, {'title': 'fox dog'})])
+        del self.dbag[k1]
+        self.assertEqual([k3], found(Q.search('fox')))
+        self.dbag.reindex()
+        self.assertEqual([k3], found(Q.search('fox')))
+        # different fields, rebuilt
+        self.dbag.ensure_text_index(('title', 'body'))
+        self.assertEqual([k2], found(Q.search('more')))
+
+    def test_spatial_index(self):
+        import random
+        rnd = random.Random(4)
+        pts = {}
+        for i in range(300):
+            d = {'n': i, 'at': {'x': rnd.uniform(-10, 10), 'y': rnd.uniform(-10, 10)}}
+            pts[self.dbag.add(d)] = d
+        self.dbag.add({'n': -1, 'at': {'x': 'nope', 'y': 1}})
+        edge = self.dbag.add({'n': -2, 'at': {'x': 0.1, 'y': 0.1}})
+        inside = lambda x1, x2, y1, y2: { k for k,d in pts.items()
+            if x1 <= d['at']['x'] <= x2 and y1 <= d['at']['y'] <= y2 } | (
+            {edge} if x1 <= 0.1 <= x2 and y1 <= 0.1 <= y2 else set() )
+        boxes = [
+            Q.within({'at.x': (-1, 2), 'at.y': (0.1, 5)}),
+            {'$within': {'at.y': [-10, 0.1], 'at.x': [0.1, 10]}},
+            ]
+        want = [inside(-1, 2, 0.1, 5), inside(0.1, 10, -10, 0.1)]
+        found = lambda *a: list(self.dbag.find(*a, keys_only=True))
+        # scanned, then off the rtree
+        for q, w in zip(boxes, want):
+            self.assertEqual(w, set(found(q)))
+        with self.assertRaises(ValueError):
+            self.dbag.nearest(('at.x', 'at.y'), (0, 0))
+        empty = DictBag('empty')
+        empty.ensure_spatial_index(('x', 'y'))
+        self.assertEqual([], empty.nearest(('x', 'y'), (0, 0)))
+        self.dbag.ensure_spatial_index(('at.x', 'at.y'))
+        self.dbag.ensure_index(('n',))
+        for q, w in zip(boxes, want):
+            keys = found(q)
+            self.assertEqual(w, set(keys))
+            self.assertEqual(len(w), len(keys))
+        self.assertTrue(all( 'rtree_' in p[1] for p in self.dbag._shapes.values() ))
+        self.assertEqual(
+            { k for k in want[0] if k != edge and pts[k]['n'] < 100 },
+            set(found(boxes[0], Q.n < 100, Q.n >= 0))
+            )
+        # nearest, given in either field order
+        dist = lambda k: (pts[k]['at']['x'] - 3) ** 2 + (pts[k]['at']['y'] + 2) ** 2
+        closest = sorted(pts, key=dist)[:5]
+        self.assertEqual(
+            closest, [ k for k,_,_ in self.dbag.nearest(('at.x', 'at.y'), (3, -2), 5) ]
+            )
+        self.assertEqual(
+            closest, [ k for k,_,_ in self.dbag.nearest(('at.y', 'at.x'), (-2, 3), 5) ]
+            )
+        self.assertEqual(301, len(self.dbag.nearest(('at.x', 'at.y'), (0, 0), 500)))
+        # kept up to date
+        del self.dbag[closest[0]]
+        self.dbag[closest[1]] = {'n': 1000}
+        self.assertEqual(
+            closest[2:], [ k for k,_,_ in self.dbag.nearest(('at.x', 'at.y'), (3, -2), 3) ]
+            )
+
     def test_Q_queries(self):
         x = Q('x')
         x = x < 44
@@ -283,7 +884,56 @@ class TestDictBag(unittest.TestCase):
 
     def test_del_from_index(self):
         self.dbag.ensure_index(('x', 'y'))
-        self.dbag.add({'x':22})
+        key = self.dbag.add({'x':22})
+        del self.dbag[key]
+        cur = self.dbag._db.cursor()
+        cur.execute('select count(1) as cnt from idx_testdbag_x_y')
+        self.assertEqual( 0, cur.fetchone()['cnt'] )
+
+    def test_overwrite_updates_index(self):
+        self.dbag.ensure_index(('x',))
+        self.dbag['k'] = {'x': 1}
+        self.dbag['k'] = {'x': 2}
+        self.assertIsNone( self.dbag.find_one(x=1)[0] )
+        self.assertEqual( 'k', self.dbag.find_one(x=2)[0] )
+
+    def test_import_defers_indexing(self):
+        self.dbag.ensure_index(('x',))
+        lines = ''.join('{{"value": {{"x": {}}}}}\n'.format(i) for i in range(5))
+        self.dbag.import_jsonl(io.StringIO(lines), batch=2)
+        self.assertEqual( 3, len(list(self.dbag.find(Q.x > 1))) )
+        cur = self.dbag._db.cursor()
+        cur.execute('select count(1) as cnt from idx_testdbag_x')
+        self.assertEqual( 5, cur.fetchone()['cnt'] )
+
+    def test_import_fails_part_way(self):
+        self.dbag.ensure_index(('x',))
+        lines = '{"value": {"x": 1}}\n{"value": {"x": 2}}\n{"value": [3]}\n'
+        with self.assertRaises(ValueError):
+            self.dbag.import_jsonl(io.StringIO(lines), batch=2)
+        # the first batch got in, indexed, and later writes still index
+        self.assertEqual( 2, len(list(self.dbag.find(Q.x > 0))) )
+        self.dbag['k'] = {'x': 4}
+        self.assertEqual( 'k', self.dbag.find_one(Q.x == 4)[0] )
+
+    def test_no_blobs(self):
+        self.dbag.ensure_index(('n',))
+        self.dbag['a'] = {'n': 1}
+        with self.assertRaises(ValueError): self.dbag.open_writer('a')
+        lines = ('{"key": "b", "value": {"n": 2}}\n'
+            '{"key": "a", "value": "eA==", "encoding": "base64"}\n')
+        with self.assertRaises(ValueError):
+            self.dbag.import_jsonl(io.StringIO(lines))
+        self.assertNotIn('b', self.dbag)
+        self.assertEqual([('a', {'n': 1})], list(self.dbag.find(Q.n == 1)))
+        self.assertEqual(['a'], [ k for k,_ in self.dbag.find(Q.n >= 0) ])
+
+    def test_reindex(self):
+        self.dbag.add({'x': 1})
+        self.dbag.ensure_index(('x',))
+        self.dbag.reindex()
+        key, found = self.dbag.find_one(Q.x == 1)
+        self.assertEqual( {'x': 1}, found )
 
     def test_find_kwargs_with_index(self):
         first, second = {'x':10, 'y':99}, {'x':100, 'y':999}
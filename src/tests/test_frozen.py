@@ -0,0 +1,73 @@
+
+import os
+import tempfile
+import unittest
+
+from databag import DataBag, FrozenBag
+
+
+class TestFrozenBag(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.fpath = tempfile.mkstemp()
+        os.close(fd)
+        self.dbag = DataBag('dbag')
+        self.dbag['b'] = 'blip'
+        self.dbag['a'] = {'x': 1, 'y': [1, 2, 3]}
+        self.dbag['c'] = 'long string ' * 20 # gets bz2'd
+        self.dbag['été'] = 'summer'
+        self.dbag.export_snapshot(self.fpath)
+        self.frozen = FrozenBag(self.fpath)
+
+    def tearDown(self):
+        self.frozen.close()
+        os.remove(self.fpath)
+
+    def test_get(self):
+        for k in self.dbag:
+            self.assertEqual(self.dbag[k], self.frozen[k])
+            self.assertEqual(self.dbag[k], self.frozen.get(k))
+        self.assertIsNone(self.frozen.get('nope'))
+        self.assertEqual('soup', self.frozen.get('nope', 'soup'))
+        with self.assertRaises(KeyError): self.frozen['nope']
+
+    def test_contains(self):
+        self.assertIn('a', self.frozen)
+        self.assertNotIn('aa', self.frozen)
+        self.assertEqual(4, len(self.frozen))
+
+    def test_iter_matches_bag(self):
+        self.assertListEqual(list(self.dbag), list(self.frozen))
+
+    def test_range(self):
+        self.assertListEqual(['b', 'c'], list(self.frozen.keys('b', 'd')))
+        self.assertListEqual(
+            [('a', self.dbag['a'])],
+            list(self.frozen.items(stop='b'))
+            )
+
+    def test_raw_is_zero_copy(self):
+        raw = self.frozen.raw('b')
+        self.assertIsInstance(raw, memoryview)
+        self.assertEqual(b'blip', raw.tobytes())
+        raw.release()
+
+    def test_only_live_versions(self):
+        d_v = DataBag(versioned=True)
+        d_v['k'] = 'old'
+        d_v['k'] = 'new'
+        d_v.export_snapshot(self.fpath)
+        with FrozenBag(self.fpath) as frozen:
+            self.assertEqual(1, len(frozen))
+            self.assertEqual('new', frozen['k'])
+
+    def test_not_a_snapshot(self):
+        with open(self.fpath, 'wb') as fp:
+            fp.write(b'x' * 64)
+        with self.assertRaises(ValueError): FrozenBag(self.fpath)
+
+    def test_empty(self):
+        DataBag('empty').export_snapshot(self.fpath)
+        with FrozenBag(self.fpath) as frozen:
+            self.assertEqual([], list(frozen))
+            self.assertNotIn('a', frozen)
@@ -0,0 +1,62 @@
+
+import unittest
+
+from databag import DataBag, DictBag, Metrics, Q
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_off_by_default(self):
+        self.assertIsNone(DataBag('dbag').metrics)
+
+    def test_ops(self):
+        bag = DataBag('dbag', metrics=True)
+        bag['a'] = 'x' * 100
+        bag['a']
+        bag.get('nope')
+        del bag['a']
+        ops = bag.metrics.as_dict()['ops']
+        self.assertEqual(1, ops['set']['count'])
+        self.assertEqual(2, ops['get']['count'])
+        self.assertEqual(1, ops['delete']['count'])
+        self.assertEqual(1, sum(ops['set']['buckets'].values()))
+
+    def test_bytes_and_timers(self):
+        bag = DataBag('dbag', metrics=True)
+        bag['a'] = {'text': 'y' * 1000}
+        bag['a']
+        d = bag.metrics.as_dict()
+        self.assertGreater(d['bytes']['raw'], d['bytes']['stored'])
+        for t in ('json_encode', 'compress', 'decompress', 'json_decode'):
+            self.assertEqual(1, d['timers'][t]['count'])
+
+    def test_find(self):
+        bag = DictBag('dbag', indexes=[('x',)], metrics=True)
+        bag.add({'x': 1, 'y': 2})
+        list(bag.find(Q.x == 1))
+        list(bag.find(Q.y == 2))
+        ops = bag.metrics.as_dict()['ops']
+        self.assertEqual(1, ops['find_indexed']['count'])
+        self.assertEqual(1, ops['find_scan']['count'])
+
+    def test_shared(self):
+        m = Metrics()
+        DataBag('one', metrics=m)['a'] = 1
+        DataBag('two', metrics=m)['a'] = 1
+        self.assertEqual(2, m.as_dict()['ops']['set']['count'])
+
+    def test_slow_queries(self):
+        m = Metrics(slow_query_ms=0, slow_log_size=5)
+        bag = DataBag('dbag', metrics=m)
+        bag['a'] = 1
+        bag['a']
+        slow = m.as_dict()['slow_queries']
+        self.assertEqual(5, len(slow))
+        self.assertIn('select data', slow[-1]['sql'])
+        m.reset()
+        self.assertEqual([], m.as_dict()['slow_queries'])
+
+    def test_no_slow_log_without_threshold(self):
+        bag = DataBag('dbag', metrics=True)
+        bag['a'] = 1
+        self.assertEqual([], bag.metrics.as_dict()['slow_queries'])
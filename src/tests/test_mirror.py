@@ -0,0 +1,151 @@
+
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from databag import DataBag, FrozenBag, Metrics, MirrorBag
+
+
+class TestMirrorBag(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.fpath = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.fpath)
+
+    def tearDown(self):
+        os.remove(self.fpath)
+
+    def on_disk(self):
+        return dict( (k, v) for k,v in DataBag('m', self.fpath).by_created() )
+
+    def test_write_back(self):
+        bag = MirrorBag('m', self.fpath, flush_interval=None)
+        bag['a'] = {'x': 1}
+        bag['b'] = 2
+        self.assertEqual({'x': 1}, bag['a'])
+        self.assertEqual({}, self.on_disk())
+        self.assertEqual(2, bag.pending())
+        self.assertEqual(2, bag.flush())
+        self.assertEqual({'a': {'x': 1}, 'b': 2}, self.on_disk())
+        del bag['a']
+        with self.assertRaises(KeyError): bag['a']
+        with self.assertRaises(KeyError): del bag['a']
+        self.assertNotIn('a', bag)
+        self.assertEqual({'a': {'x': 1}, 'b': 2}, self.on_disk())
+        bag.close()
+        self.assertEqual({'b': 2}, self.on_disk())
+
+    def test_preload_and_lazy(self):
+        d = DataBag('m', self.fpath)
+        d['a'] = 'aaa'
+        d['b'] = 'bbb'
+        with MirrorBag('m', self.fpath, flush_interval=None) as bag:
+            self.assertEqual({'a': 'aaa', 'b': 'bbb'}, bag._mem)
+            self.assertEqual(['a', 'b'], list(bag))
+        with MirrorBag('m', self.fpath, preload=False) as bag:
+            self.assertEqual({}, bag._mem)
+            self.assertEqual('aaa', bag['a'])
+            self.assertEqual({'a': 'aaa'}, bag._mem)
+            self.assertIn('b', bag)
+            del bag['b']
+            self.assertNotIn('b', bag)
+            self.assertEqual({'a': 'aaa'}, bag.get_many(['a', 'b', 'c']))
+        self.assertEqual({'a': 'aaa'}, self.on_disk())
+
+    def test_dirty_threshold(self):
+        bag = MirrorBag('m', self.fpath, flush_interval=None, flush_dirty=3)
+        bag['a'] = 1
+        bag['b'] = 2
+        self.assertEqual(2, bag.pending())
+        bag['c'] = 3
+        self.assertEqual(0, bag.pending())
+        self.assertEqual(3, len(self.on_disk()))
+        # held back inside a transaction
+        with bag.transaction():
+            for k in 'defg': bag[k] = 0
+            self.assertEqual(4, bag.pending())
+        self.assertEqual(0, bag.pending())
+        bag.close()
+
+    def test_background_flush(self):
+        m = Metrics()
+        bag = MirrorBag('m', self.fpath, flush_interval=0.01, metrics=m)
+        bag['a'] = 1
+        for _ in range(200):
+            if not bag.pending(): break
+            time.sleep(0.01)
+        self.assertEqual({'a': 1}, self.on_disk())
+        bag.close()
+        self.assertIn('flush', m.as_dict()['ops'])
+
+    def test_by_created(self):
+        with MirrorBag('m', self.fpath, flush_interval=None) as bag:
+            bag['a'] = 1
+            bag['b'] = 2
+            self.assertEqual(
+                [('b', 2), ('a', 1)], list(bag.by_created(desc=True))
+                )
+            self.assertEqual(0, bag.pending())
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, 'backup'), 'python 3.7+')
+    def test_file_readers_flush(self):
+        bag = MirrorBag('m', self.fpath, flush_interval=None, changelog=True)
+        for i in range(5): bag['k{}'.format(i)] = i
+        out = io.StringIO()
+        self.assertEqual(5, bag.export_jsonl(out))
+        self.assertEqual(0, bag.pending())
+
+        bag['k5'] = 5
+        snap = self.fpath + '.snap'
+        self.addCleanup(os.remove, snap)
+        bag.export_snapshot(snap)
+        self.assertEqual(5, FrozenBag(snap).get('k5'))
+
+        bag['k6'] = 6
+        with bag.snapshot() as s:
+            self.assertEqual(6, s['k6'])
+        bag['k7'] = 7
+        self.assertEqual(8, bag.stats()['rows']['live'])
+        bag['k8'] = 8
+        self.assertEqual(9, len(list(bag.changes())))
+
+        bag['k9'] = 9
+        bak = self.fpath + '.bak'
+        self.addCleanup(os.remove, bak)
+        bag.backup(bak)
+        self.assertEqual(9, DataBag('m', bak)['k9'])
+        bag.close()
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, 'backup'), 'python 3.7+')
+    def test_restore(self):
+        bag = MirrorBag('m', self.fpath, flush_interval=None)
+        bag['a'] = 1
+        bak = self.fpath + '.bak'
+        self.addCleanup(os.remove, bak)
+        bag.backup(bak)
+        bag['b'] = 2
+        bag.flush()
+        bag['c'] = 3
+        del bag['a']
+        bag.restore(bak)
+        self.assertEqual({'a': 1}, bag._mem)
+        self.assertEqual(0, bag.pending())
+        bag.close()
+        self.assertEqual({'a': 1}, self.on_disk())
+
+    def test_no_streamed_writes(self):
+        bag = MirrorBag('m', self.fpath, flush_interval=None)
+        with self.assertRaises(NotImplementedError): bag.open_writer('a')
+        lines = ('{"key": "a", "value": 1}\n'
+            '{"key": "b", "value": "eA==", "encoding": "base64"}\n')
+        with self.assertRaises(NotImplementedError):
+            bag.import_jsonl(io.StringIO(lines))
+        self.assertEqual({}, bag._mem)
+        bag['c'] = 'ccc'
+        with bag.open_reader('c') as fp:
+            self.assertEqual(b'ccc', fp.read())
+        bag.close()
@@ -1,9 +1,11 @@
 
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from databag import DictBag, Q
-from databag.orm import Field, IntField, StrField, Model, set_db_path
+from databag.orm import (
+    Field, IntField, StrField, DateTimeField, Model, Session, set_db_path
+    )
 
 
 class Faker(Model):
@@ -11,6 +13,24 @@ class Faker(Model):
     age = IntField()
 
 
+class OlderFaker(Faker):
+    age = IntField(default=40)
+    job = StrField(default='retired')
+
+
+class Indexed(Model):
+    name = StrField(index=True)
+    age = IntField(index=True)
+    city = StrField()
+    indexes = [('city', 'age'), ('age',)]
+
+
+class Event(Model):
+    datetimes = 'epoch'
+    name = StrField()
+    at = DateTimeField(index=True)
+
+
 class TestORM(unittest.TestCase):
 
     def setUp(self):
@@ -48,3 +68,133 @@ class TestORM(unittest.TestCase):
         self.assertTrue(isinstance(f0._created_ts, datetime))
 
 
+
+    def test_fields_per_class(self):
+        self.assertEqual(
+            ['_created_ts', 'name', 'age'], list(Faker._fields)
+            )
+        self.assertEqual(
+            ['_created_ts', 'name', 'age', 'job'], list(OlderFaker._fields)
+            )
+        # overridden in the subclass, the parent keeps its own
+        self.assertEqual(0, Faker().age)
+        self.assertEqual(40, OlderFaker().age)
+        self.assertIsNot(Faker.name, OlderFaker.name)
+
+    def test_slots(self):
+        f0 = Faker(name='joe')
+        self.assertFalse(hasattr(f0, '__dict__'))
+        with self.assertRaises(AttributeError):
+            f0.whatever = 1
+        with self.assertRaises(ValueError):
+            f0.age = 'ten'
+
+    def test_roundtrip(self):
+        f0 = OlderFaker(name='joe', age=61)
+        d = f0.to_d()
+        self.assertEqual('retired', d['job'])
+        f1 = OlderFaker.from_d(self.dbag[self.dbag.add(d)])
+        self.assertEqual(d, f1.to_d())
+        self.assertEqual('joe', f1['name'])
+        self.assertIsNone(f1['nope'])
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.dbag = DictBag(Faker.table_name(), indexes=[('age',)])
+        Faker.set_db(self.dbag)
+        self.keys = [
+            Faker(name='f{}'.format(i), age=i).save().key for i in range(10)
+            ]
+
+    def test_grab_many(self):
+        got = Faker.grab_many(self.keys[:3] + ['nope'])
+        self.assertEqual(set(self.keys[:3]), set(got))
+        self.assertEqual('f1', got[self.keys[1]].name)
+        self.assertFalse(got[self.keys[1]].dirty)
+
+    def test_flush_only_dirty(self):
+        s = Session()
+        fakers = s.grab_many(Faker, self.keys)
+        fakers[self.keys[2]].age = 20
+        new = s.add(Faker(name='new', age=30))
+        self.assertEqual(2, len(s.dirty()))
+        self.assertEqual(2, s.flush())
+        self.assertEqual([], s.dirty())
+        self.assertEqual(20, self.dbag[self.keys[2]]['age'])
+        self.assertEqual('new', self.dbag[new.key]['name'])
+        # indexes kept up with the batch
+        self.assertEqual(
+            ['f2', 'new'],
+            sorted(d['name'] for _,d in self.dbag.find(Q.age >= 20))
+            )
+        self.assertEqual(0, s.flush())
+
+    def test_identity(self):
+        s = Session()
+        f0 = s.grab(Faker, self.keys[0])
+        self.assertIs(f0, s.grab_many(Faker, self.keys[:2])[self.keys[0]])
+
+    def test_context(self):
+        with Session() as s:
+            s.grab(Faker, self.keys[0]).name = 'changed'
+        self.assertEqual('changed', self.dbag[self.keys[0]]['name'])
+        with self.assertRaises(RuntimeError):
+            with Session() as s:
+                s.grab(Faker, self.keys[0]).name = 'again'
+                raise RuntimeError
+        self.assertEqual('changed', self.dbag[self.keys[0]]['name'])
+
+
+class TestIndexes(unittest.TestCase):
+
+    def test_specs(self):
+        self.assertEqual(
+            [('name',), ('age',), ('city', 'age')], Indexed._index_specs
+            )
+        self.assertEqual([], Faker._index_specs)
+
+    def test_backfill_and_find(self):
+        dbag = DictBag(Indexed.table_name(), metrics=True)
+        for i in range(5):
+            dbag.add({'name': 'n{}'.format(i), 'age': i, 'city': 'austin'})
+        Indexed.set_db(dbag)
+        self.assertEqual(
+            {('name',), ('age',), ('age', 'city')}, dbag._indexes
+            )
+        _, found = Indexed.find_one(Q.age == 3)
+        self.assertEqual('n3', found.name)
+        self.assertEqual(
+            2, len(list(Indexed.find(Q.age > 2, city='austin')))
+            )
+        self.assertNotIn('find_scan', dbag.metrics.ops)
+        self.assertEqual(2, dbag.metrics.ops['find_indexed'].count)
+
+    def test_opened_with_indexes(self):
+        set_db_path(':memory:')
+        class Opened(Indexed): pass
+        self.assertEqual(
+            {('name',), ('age',), ('age', 'city')}, Opened._db()._indexes
+            )
+        # the parent's bag isn't handed down
+        self.assertIsNot(Opened._db(), Indexed._db())
+
+
+class TestDatetimes(unittest.TestCase):
+
+    def test_epoch(self):
+        set_db_path(':memory:')
+        t0 = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        for i in range(5):
+            Event(name='e{}'.format(i), at=t0 + timedelta(hours=i)).save()
+        _, e = Event.find_one(Q.at > t0 + timedelta(hours=3))
+        self.assertEqual('e4', e.name)
+        self.assertEqual(t0 + timedelta(hours=4), e.at)
+        self.assertIsInstance(Event._db()[e.key]['at'], float)
+
+    def test_legacy_iso(self):
+        t0 = datetime(2021, 6, 1, 12, 30, tzinfo=timezone.utc)
+        for stored in (t0.isoformat(), t0.timestamp()):
+            e = Event.from_d({'name': 'x', 'at': stored})
+            self.assertEqual(t0, e.at)
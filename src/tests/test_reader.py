@@ -0,0 +1,61 @@
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from databag import DataBag, DictBag, Q
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.dir, 'bag.db')
+
+    def test_point_in_time(self):
+        bag = DataBag('dbag', self.fpath)
+        for i in range(10):
+            bag['k{}'.format(i)] = i
+        with bag.snapshot() as snap:
+            self.assertEqual('wal', bag._pragma('journal_mode'))
+            seen = []
+            for k, v in snap.by_created():
+                # writing mid scan doesn't move what the scan sees
+                bag[k] = v + 100
+                bag.add('more')
+                seen.append(v)
+            self.assertEqual(list(range(10)), seen)
+            self.assertEqual(0, snap['k0'])
+            self.assertNotIn('k0', [ k for k in snap if k not in bag ])
+            with self.assertRaises(sqlite3.OperationalError):
+                snap['x'] = 1
+        self.assertEqual(100, bag['k0'])
+        self.assertEqual(20, len(list(bag)))
+        busy, _, _ = bag.checkpoint('truncate')
+        self.assertEqual(0, busy)
+
+    def test_other_writers(self):
+        bag = DictBag('dbag', self.fpath, indexes=[('n',)])
+        bag.ensure_text_index(('t',))
+        bag['a'] = {'n': 1, 't': 'hello there'}
+        with bag.snapshot() as snap:
+            other = DictBag('dbag', self.fpath, indexes=[('n',)])
+            # another connection can write while the snapshot is open
+            other['b'] = {'n': 2, 't': 'hello again'}
+            self.assertEqual(['a'], list(snap.find(Q.n > 0, keys_only=True)))
+            self.assertEqual(['a'], list(snap.find(Q.search('hello'), keys_only=True)))
+        self.assertEqual(2, len(list(bag.find(Q.n > 0))))
+
+    def test_needs_a_file(self):
+        with self.assertRaises(ValueError):
+            with DataBag('dbag').snapshot():
+                pass
+        bag = DataBag('dbag', self.fpath)
+        with self.assertRaises(ValueError):
+            with bag.transaction():
+                bag['a'] = 1
+                with bag.snapshot():
+                    pass
+        with self.assertRaises(ValueError):
+            bag.checkpoint('sometimes')
@@ -0,0 +1,203 @@
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from databag import DataBag, Q, ShardedDataBag, ShardedDictBag, reshard
+from databag.shard import shard_for
+
+
+class ShardFiles(object):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def paths(self, n, prefix='s'):
+        return [ os.path.join(self.tmpdir.name, '{}{}.db'.format(prefix, i))
+            for i in range(n) ]
+
+
+class TestShardedDataBag(ShardFiles, unittest.TestCase):
+
+    def setUp(self):
+        super(TestShardedDataBag, self).setUp()
+        self.dbag = ShardedDataBag('dbag', self.paths(3))
+
+    def test_stable_hash(self):
+        self.assertEqual(shard_for('blah', 3), shard_for('blah', 3))
+        self.assertEqual(1, shard_for('blah', 3))
+
+    def test_point_ops(self):
+        self.dbag['a'] = 'blip'
+        self.assertEqual('blip', self.dbag['a'])
+        self.assertEqual('blip', self.dbag.get('a'))
+        self.assertIsNone(self.dbag.get('nope'))
+        self.assertIn('a', self.dbag)
+        self.assertTrue(self.dbag.when('a'))
+        del self.dbag['a']
+        self.assertNotIn('a', self.dbag)
+        with self.assertRaises(KeyError): self.dbag['a']
+
+    def test_lands_on_one_shard(self):
+        self.dbag['a'] = 1
+        holding = [ s for s in self.dbag._shards if 'a' in s ]
+        self.assertEqual([self.dbag._shard('a')], holding)
+
+    def test_iter_sorted(self):
+        keys = [ 'k{:02d}'.format(i) for i in range(30) ]
+        for k in reversed(keys): self.dbag[k] = k
+        self.assertListEqual(keys, list(self.dbag))
+
+    def test_by_created(self):
+        keys = [ self.dbag.add(i) for i in range(20) ]
+        self.assertListEqual(
+            list(range(20)), [ v for _,v in self.dbag.by_created() ]
+            )
+        self.assertListEqual(
+            keys[::-1], [ k for k,_ in self.dbag.by_created(desc=True) ]
+            )
+
+    def test_abandoned_iteration(self):
+        for i in range(50): self.dbag.add(i)
+        it = iter(self.dbag)
+        next(it)
+        it.close()
+        self.assertEqual(50, len(list(self.dbag)))
+
+    def test_get_set_many(self):
+        self.assertEqual(3, self.dbag.set_many({'a': 1, 'b': 2, 'c': 3}))
+        self.assertEqual(
+            {'a': 1, 'c': 3}, self.dbag.get_many(['a', 'c', 'nope'])
+            )
+
+    def test_import_export(self):
+        keys = [ 'k{:02d}'.format(i) for i in range(30) ]
+        for k in keys: self.dbag[k] = {'n': k}
+        for fmt in ('jsonl', 'csv'):
+            out = io.StringIO()
+            self.assertEqual(30, getattr(self.dbag, 'export_' + fmt)(out))
+            other = ShardedDataBag(fmt, self.paths(2, fmt))
+            out.seek(0)
+            self.assertEqual(
+                30, getattr(other, 'import_' + fmt)(out, batch=7)
+                )
+            self.assertListEqual(keys, list(other))
+            self.assertEqual({'n': 'k03'}, other['k03'])
+        lines = io.StringIO()
+        self.dbag.export_jsonl(lines)
+        self.assertEqual(
+            keys, [ json.loads(l)['key'] for l in lines.getvalue().splitlines() ]
+            )
+
+    def test_stats(self):
+        for i in range(10): self.dbag.add(i)
+        stats = self.dbag.stats()
+        self.assertEqual(10, stats['rows']['live'])
+        self.assertEqual(3, len(stats['shards']))
+
+    def test_one_file_only(self):
+        with self.assertRaises(NotImplementedError): self.dbag.transaction()
+        with self.assertRaises(NotImplementedError): self.dbag.changes()
+        with self.assertRaises(NotImplementedError): self.dbag.backup('x')
+        with self.assertRaises(NotImplementedError): self.dbag.snapshot()
+
+    def test_streams(self):
+        with self.dbag.open_writer('big') as fp: fp.write(b'x' * 5000)
+        self.assertEqual(b'x' * 5000, self.dbag._shard('big')['big'])
+        with self.dbag.open_reader('big') as fp:
+            self.assertEqual(b'x' * 5000, fp.read())
+
+    def test_per_file(self):
+        bag = ShardedDataBag('z', self.paths(2, 'z'), zdict=True, metrics=True)
+        for i in range(100): bag.add({'name': 'thing', 'n': i})
+        self.assertEqual(2, len(bag.train_zdict()))
+        self.assertIs(bag.metrics, bag._shards[1].metrics)
+        self.assertEqual(0, bag.compact())
+        self.assertEqual(2, len(bag.checkpoint()))
+
+    def test_close(self):
+        with ShardedDataBag('dbag', self.paths(2, 'c')) as bag:
+            bag['a'] = 1
+        self.assertEqual(1, ShardedDataBag('dbag', self.paths(2, 'c'))['a'])
+
+    def test_needs_shards(self):
+        with self.assertRaises(ValueError): ShardedDataBag('dbag', [])
+
+
+class TestShardedDictBag(ShardFiles, unittest.TestCase):
+
+    def setUp(self):
+        super(TestShardedDictBag, self).setUp()
+        self.dbag = ShardedDictBag('dbag', self.paths(3), indexes=[('x',)])
+        for i in range(20): self.dbag.add({'x': i, 'y': i % 2})
+
+    def test_find_indexed(self):
+        found = sorted(d['x'] for _,d in self.dbag.find(Q.x >= 15))
+        self.assertListEqual([15, 16, 17, 18, 19], found)
+
+    def test_find_scan(self):
+        self.assertEqual(10, len(list(self.dbag.find(y=1))))
+
+    def test_find_one(self):
+        self.assertEqual(3, self.dbag.find_one(x=3)[1]['x'])
+        self.assertEqual((None, None), self.dbag.find_one(x=300))
+
+    def test_bad_query_raises_up_front(self):
+        with self.assertRaises(NotImplementedError):
+            self.dbag.find({'x': {'$zzz': 1}})
+
+
+class TestReshard(ShardFiles, unittest.TestCase):
+
+    def test_reshard(self):
+        src, dest = self.paths(2, 'src'), self.paths(3, 'dest')
+        old = ShardedDictBag('dbag', src)
+        for i in range(30): old['k{}'.format(i)] = {'x': i}
+
+        self.assertEqual(30, reshard('dbag', src, dest, indexes=[('x',)]))
+        new = ShardedDictBag('dbag', dest, indexes=[('x',)])
+        self.assertListEqual(list(old), list(new))
+        self.assertEqual({'x': 7}, new['k7'])
+        self.assertEqual(3, len(list(new.find(Q.x < 3))))
+        for s in new._shards:
+            for k in s: self.assertIs(s, new._shard(k))
+
+    def test_keeps_versions(self):
+        src, dest = self.paths(1, 'src'), self.paths(2, 'dest')
+        DataBag('dbag', src[0], versioned=True)['a'] = 'one'
+        DataBag('dbag', src[0], versioned=True)['a'] = 'two'
+        reshard('dbag', src, dest)
+        new = ShardedDataBag('dbag', dest, versioned=True)
+        self.assertEqual('one', new.get('a', version=-1))
+
+    def test_zdicts(self):
+        src, dest = self.paths(2, 'src'), self.paths(3, 'dest')
+        old = ShardedDataBag('dbag', src, zdict=True)
+        docs = { 'k{}'.format(i): {'name': 'thing', 'n': i} for i in range(200) }
+        for k, v in docs.items(): old[k] = v
+        for s in old._shards: s.train_zdict(recompress=True)
+        self.assertTrue(all(
+            s.stats()['payload']['zdict']['rows'] for s in old._shards
+            ))
+        reshard('dbag', src, dest)
+        new = ShardedDataBag('dbag', dest)
+        for k, v in docs.items(): self.assertEqual(v, new[k])
+
+    def test_blobs(self):
+        src, dest = self.paths(2, 'src'), self.paths(3, 'dest')
+        old = ShardedDataBag('dbag', src)
+        big = os.urandom(5000)
+        with old._shard('big').open_writer('big', chunk_size=1024) as fp:
+            fp.write(big)
+        reshard('dbag', src, dest)
+        new = ShardedDataBag('dbag', dest)
+        self.assertEqual(big, new['big'])
+
+    def test_refuses_overlap(self):
+        src = self.paths(2)
+        with self.assertRaises(ValueError): reshard('dbag', src, src[:1])
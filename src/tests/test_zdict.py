@@ -0,0 +1,82 @@
+
+import os
+import tempfile
+import unittest
+
+from databag import DataBag, DictBag, FrozenBag
+from databag.main import RAW, BZ2, ZDICT
+
+
+def doc(i):
+    return {
+        'name': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i),
+        'active': i % 2 == 0, 'roles': ['reader', 'writer'], 'score': i,
+        }
+
+
+class TestZdict(unittest.TestCase):
+
+    def setUp(self):
+        self.dbag = DictBag('dbag', zdict=True)
+        for i in range(200):
+            self.dbag['k{}'.format(i)] = doc(i)
+
+    def codecs(self):
+        cur = self.dbag._db.cursor()
+        cur.execute('select bz2, count(1) from dbag group by bz2')
+        return dict(cur.fetchall())
+
+    def test_needs_zdict(self):
+        with self.assertRaises(ValueError):
+            DataBag('dbag').train_zdict()
+
+    def test_untrained(self):
+        # nothing to pack against yet, so small docs go in as before
+        self.assertEqual({RAW: 200}, self.codecs())
+
+    def test_train(self):
+        self.assertEqual(1, self.dbag.train_zdict())
+        self.dbag['new'] = doc(500)
+        self.assertEqual(ZDICT, self.dbag._db.execute(
+            "select bz2 from dbag where keyf='new'").fetchone()[0])
+        self.assertEqual(doc(500), self.dbag['new'])
+        self.assertEqual({RAW: 200, ZDICT: 1}, self.codecs())
+        # big values still go to bz2
+        self.dbag['big'] = {'text': 'blah ' * 5000}
+        self.assertEqual(BZ2, self.dbag._db.execute(
+            "select bz2 from dbag where keyf='big'").fetchone()[0])
+
+    def test_recompress(self):
+        self.dbag.train_zdict(recompress=True, batch=50)
+        self.assertEqual({ZDICT: 200}, self.codecs())
+        self.assertEqual(doc(7), self.dbag['k7'])
+        self.assertEqual(doc(7), self.dbag.find_one(name='user7')[1])
+        s = self.dbag.stats()
+        self.assertEqual(200, s['payload']['zdict']['rows'])
+        self.assertGreater(s['compression_ratio'], 1)
+
+    def test_old_versions(self):
+        self.dbag.train_zdict(recompress=True)
+        self.dbag['k1'] = {'other': 'shape', 'entirely': True}
+        self.assertEqual(2, self.dbag.train_zdict())
+        self.dbag['new'] = doc(500)
+        vers = set(
+            r[0] for r in self.dbag._db.execute(
+                "select substr(data, 1, 4) from dbag where bz2=?", (ZDICT,)
+            ) )
+        self.assertEqual(2, len(vers))
+
+        # a fresh handle loads dictionaries as it meets them
+        reopened = DictBag('dbag', zdict=True)
+        reopened._db = self.dbag._db
+        reopened._zdicts = {}
+        self.assertEqual(doc(3), reopened['k3'])
+        self.assertEqual(doc(500), reopened['new'])
+
+    def test_snapshot(self):
+        self.dbag.train_zdict(recompress=True)
+        path = os.path.join(tempfile.mkdtemp(), 'bag.snap')
+        self.dbag.export_snapshot(path)
+        with FrozenBag(path) as frozen:
+            self.assertEqual(doc(42), frozen['k42'])
+            self.assertEqual(200, len(frozen))